@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Cold load time and size of the legacy pickled .pth checkpoint against the lean .weights format
+#   $ cd app && python -m benchmarks.ae_checkpoint
+# Files are dropped from the page cache before every load (Linux), so loads read from disk
+###
+
+import os
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+
+from server.model.ae import AutoEncoder, MODEL
+
+SEED = 489
+
+
+class _Bucket(object):
+    def save_dataset(self, output_dir):     # Only the model is measured
+        pass
+
+
+def trained_ae(log_dir):
+    # One optimizer step so there is Adam state to save
+    torch.manual_seed(SEED)
+    ae = AutoEncoder()
+    ae.EPOCH, ae.LR, ae.BATCH_SIZE = 1, 0.001, 128
+    ae.optimizer = torch.optim.Adam(ae.parameters(), lr=ae.LR)
+    ae.loss_fn = nn.BCELoss()
+    batch = torch.rand(ae.BATCH_SIZE, 28*28)
+    ae.loss = ae.loss_fn(ae(batch)[1], batch)
+    ae.loss.backward()
+    ae.optimizer.step()
+    ae.tb = SimpleNamespace(log_dir=log_dir)
+    return ae
+
+def save_legacy(ae, output_dir):
+    # The .pth layout save_model wrote before the lean format
+    model_name = '{}.pth'.format(os.path.basename(os.path.normpath(output_dir)))
+    torch.save({
+        'model_name': model_name,
+        'model_type': MODEL,
+        'model_state_dict': ae.state_dict(),
+        'device': ae.device,
+        'lr': ae.LR,
+        'batch_size': ae.BATCH_SIZE,
+        'optimizer': ae.optimizer,
+        'optimizer_state_dict': ae.optimizer.state_dict(),
+        'epoch': ae.EPOCH,
+        'loss': ae.loss,
+        'loss_fn': ae.loss_fn,
+        'tb_log_dir': ae.tb.log_dir
+        },
+        os.path.join(output_dir, model_name)
+    )
+
+def drop_cache(output_dir):
+    for path in glob.glob(os.path.join(output_dir, '*')):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def cold_load(output_dir, repeats, **kwargs):
+    times = []
+    for _ in range(repeats):
+        ae = AutoEncoder()
+        drop_cache(output_dir)
+        start = time.time()
+        ae.load_model(output_dir, **kwargs)
+        times.append(time.time() - start)
+    return min(times)
+
+def size_mb(output_dir, patterns):
+    return sum(os.path.getsize(p) for pattern in patterns for p in glob.glob(os.path.join(output_dir, pattern))) / 2**20
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AutoEncoder checkpoint format benchmark')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    legacy_dir = os.path.join(tmp_dir, 'ae_legacy_0')
+    lean_dir = os.path.join(tmp_dir, 'ae_lean_0')
+    os.makedirs(legacy_dir)
+    ae = trained_ae(os.path.join(tmp_dir, 'tb_runs'))
+    save_legacy(ae, legacy_dir)
+    ae.save_model(_Bucket(), lean_dir)
+
+    runs = [('legacy .pth', legacy_dir, {}, ['*.pth']),
+            ('lean', lean_dir, {}, ['*.weights', 'config.json']),
+            ('lean encoder only', lean_dir, {'encoder_only': True}, ['*.weights', 'config.json']),
+            ('lean + train state', lean_dir, {'train_state': True}, ['*.weights', '*.train.pt', 'config.json'])]
+    print('\n{:>20} {:>10} {:>14} {:>9}'.format('format', 'size (MB)', 'cold load (s)', 'speedup'))
+    base = None
+    for name, output_dir, kwargs, patterns in runs:
+        load = cold_load(output_dir, args.repeats, **kwargs)
+        if base is None:
+            base = load
+        print('{:>20} {:>10.1f} {:>14.4f} {:>8.1f}x'.format(name, size_mb(output_dir, patterns), load, base / load))
+    shutil.rmtree(tmp_dir)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# AutoEncoder training and inference samples/s on cpu for each CPUProfile setting
+#   $ cd app && python -m benchmarks.ae_cpu --threads 1 2 4 8
+# Pick the fastest for the host and set it as AE_CPU_PROFILE in server/config.py
+###
+
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+
+from server.model.ae import AutoEncoder
+from server.model.utils.cpu_profile import CPUProfile
+
+SEED = 489
+
+
+def settings(threads, default_threads):
+    runs = [('default', dict(threads=default_threads))]
+    runs += [('threads={}'.format(n), dict(threads=n)) for n in threads]
+    runs += [('bf16', dict(threads=default_threads, bf16=True)),
+             ('script', dict(threads=default_threads, compile='script')),
+             ('compile', dict(threads=default_threads, compile='compile')),
+             ('fuse', dict(threads=default_threads, fuse=True)),
+             ('bf16+compile', dict(threads=default_threads, bf16=True, compile='compile'))]
+    return runs
+
+def train_rate(ae, imgs, batch_size, warmup):
+    optimizer = torch.optim.Adam(ae.parameters(), lr=0.001)
+    loss_fn = nn.BCELoss()
+    ae.train()
+    batches = [imgs[i:i+batch_size] for i in range(0, len(imgs), batch_size)]
+    for i, batch in enumerate(batches[:warmup] + batches):
+        if i == warmup:     # Compilation and allocator warm up
+            start = time.time()
+        _, decoded = ae(batch)
+        loss = loss_fn(decoded, batch)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return len(imgs) / (time.time() - start)
+
+def inference_rate(ae, imgs, batch_size, warmup):
+    ae.freeze()
+    ae.eval()
+    batches = [imgs[i:i+batch_size] for i in range(0, len(imgs), batch_size)]
+    with torch.no_grad():
+        for i, batch in enumerate(batches[:warmup] + batches):
+            if i == warmup:
+                start = time.time()
+            ae(batch)
+    return len(imgs) / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AutoEncoder CPU profile benchmark')
+    parser.add_argument('--num_imgs', type=int, default=10000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help='intra-op thread counts')
+    parser.add_argument('--batch_size', type=int, default=128, help='training batch size')
+    parser.add_argument('--eval_batch_size', type=int, default=1024, help='inference batch size')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed batches')
+    args = parser.parse_args()
+
+    default_threads = torch.get_num_threads()
+    g = torch.Generator().manual_seed(SEED)
+    imgs = torch.rand(args.num_imgs, 28*28, generator=g)
+    print('{} imgs, torch {} default threads: {} oneDNN: {}\n'.format(
+            args.num_imgs, torch.__version__, default_threads, torch.backends.mkldnn.is_available()))
+
+    print('{:>14} {:>16} {:>9} {:>18} {:>9}'.format('setting', 'train samples/s', 'speedup', 'infer samples/s', 'speedup'))
+    base = None
+    for name, kwargs in settings(args.threads, default_threads):
+        torch.manual_seed(SEED)
+        try:
+            ae = AutoEncoder(profile=CPUProfile(**kwargs))
+            train = train_rate(ae, imgs, args.batch_size, args.warmup)
+            infer = inference_rate(ae, imgs, args.eval_batch_size, args.warmup)
+        except Exception as e:   # e.g. torch.compile without a compiler toolchain
+            print('{:>14} failed: {}'.format(name, e))
+            continue
+        if base is None:
+            base = (train, infer)
+        print('{:>14} {:>16.0f} {:>8.2f}x {:>18.0f} {:>8.2f}x'.format(
+                name, train, train / base[0], infer, infer / base[1]))
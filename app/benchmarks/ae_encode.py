@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Feature extraction time of eval_model (what cluster() used) against the encoder only encode()
+#   $ cd app && python -m benchmarks.ae_encode --num_imgs 100000
+###
+
+import os
+import time
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+from torch.utils.data import TensorDataset
+
+from server.model.ae import AutoEncoder
+from server.model.utils.cpu_profile import CPUProfile
+
+SEED = 489
+
+
+class _NullWriter(object):
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AutoEncoder feature extraction benchmark')
+    parser.add_argument('--num_imgs', type=int, default=100000)
+    parser.add_argument('--batch_size', type=int, default=128, help='eval_model batch size (training batch size)')
+    parser.add_argument('--encode_batch_sizes', type=int, nargs='+', default=[1024, 4096, 16384])
+    parser.add_argument('--fuse', action='store_true', help='freeze and fuse the encoder as cluster() does')
+    args = parser.parse_args()
+
+    g = torch.Generator().manual_seed(SEED)
+    dataset = TensorDataset(torch.rand(args.num_imgs, 1, 28, 28, generator=g),
+                            torch.zeros(args.num_imgs, dtype=torch.int32))
+    torch.manual_seed(SEED)
+    ae = AutoEncoder(profile=CPUProfile(fuse=args.fuse))
+    ae.EPOCH, ae.BATCH_SIZE, ae.loss_fn, ae.tb = 1, args.batch_size, nn.BCELoss(), _NullWriter()
+
+    start = time.time()
+    _, feat_eval, _, _ = ae.eval_model(SimpleNamespace(test=dataset))
+    base = time.time() - start
+    print('\n{:>22} {:>10} {:>12} {:>9}'.format('method', 'time (s)', 'imgs/s', 'speedup'))
+    print('{:>22} {:>10.3f} {:>12.0f} {:>8.1f}x'.format('eval_model', base, args.num_imgs / base, 1))
+
+    ae.freeze()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for batch_size in args.encode_batch_sizes:
+            start = time.time()
+            feat = ae.encode(dataset, path=os.path.join(tmp_dir, 'feat_ae.npy'), batch_size=batch_size)
+            wall = time.time() - start
+            print('{:>22} {:>10.3f} {:>12.0f} {:>8.1f}x'.format(
+                    'encode bs={}'.format(batch_size), wall, args.num_imgs / wall, base / wall))
+            del feat
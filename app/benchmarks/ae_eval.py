@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# fit() time with a full test set evaluation every epoch against EvalSchedule intervals and test samples
+#   $ cd app && python -m benchmarks.ae_eval --num_imgs 20000 --epochs 10
+###
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+from torch.utils.data import TensorDataset
+
+from server.model.ae import AutoEncoder
+from server.model.utils.tb_log import LogPolicy, NullWriter
+from server.model.utils.eval_schedule import EvalSchedule
+
+SEED = 489
+
+
+def random_bucket(num_imgs, test_frac=0.2):
+    g = torch.Generator().manual_seed(SEED)
+    imgs = torch.rand(num_imgs, 1, 28, 28, generator=g)
+    labels = torch.zeros(num_imgs, dtype=torch.int32)
+    num_test = int(num_imgs * test_frac)
+    return SimpleNamespace(train=TensorDataset(imgs[num_test:], labels[num_test:]),
+                            test=TensorDataset(imgs[:num_test], labels[:num_test]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AutoEncoder evaluation schedule benchmark')
+    parser.add_argument('--num_imgs', type=int, default=20000)
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--scatter', default=None, help="'umap' or 'tsne' scatter plot every 5 epochs")
+    args = parser.parse_args()
+
+    dataset = random_bucket(args.num_imgs)
+    schedules = [('no eval', None),
+                 ('every 1, full test', EvalSchedule()),
+                 ('every 2, full test', EvalSchedule(every=2)),
+                 ('every 1, 2000 sample', EvalSchedule(sample=2000)),
+                 ('every 2, 2000 sample', EvalSchedule(every=2, sample=2000, plot_sample=2000))]
+    tmp_dir = tempfile.mkdtemp()
+    print('\n{:>22} {:>10} {:>12} {:>10}'.format('schedule', 'fit (s)', 'epoch (s)', 'eval %'))
+    base = None
+    for name, schedule in schedules:
+        torch.manual_seed(SEED)
+        ae = AutoEncoder(tb=NullWriter())
+        start = time.time()
+        ae.fit(dataset, batch_size=args.batch_size, max_epochs=args.epochs, lr=0.001, eval=schedule != None,
+                scatter_plt=(args.scatter, 5) if args.scatter != None else None,
+                output_dir=os.path.join(tmp_dir, 'ae_bench_0'), eval_schedule=schedule,
+                log_policy=LogPolicy(scalars=0, histograms=0, images=0, embeddings=0, embed_sample=0))
+        wall = time.time() - start
+        if base is None:
+            base = wall     # Gradient steps only
+        print('{:>22} {:>10.2f} {:>12.3f} {:>9.0f}%'.format(name, wall, wall / args.epochs, 100 * (wall - base) / wall))
+    shutil.rmtree(tmp_dir)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Per-epoch time of AutoEncoder training with DataLoader(num_workers=4) vs TensorBatchLoader
+#   $ cd app && python -m benchmarks.ae_loader --output_dir server/model/output/ae_<label>_<timestamp>
+# Without an output dir (or img_bucket.pt) random 28x28 datasets of --sizes images are used
+###
+
+import os
+import glob
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from server.model.ae import AutoEncoder
+from server.utils.datasets.imgbucket import ImageBucket
+from server.utils.datasets.batch_loader import TensorBatchLoader
+
+SEED = 489
+
+
+def make_dataset(n):
+    g = torch.Generator().manual_seed(SEED)
+    return TensorDataset(torch.rand(n, 1, 28, 28, generator=g), torch.zeros(n, dtype=torch.int32))
+
+def loaders(dataset, batch_size):
+    return [
+        ('DataLoader(num_workers=4)', lambda: DataLoader(dataset=dataset, batch_size=batch_size, shuffle=True, num_workers=4)),
+        ('DataLoader(num_workers=0)', lambda: DataLoader(dataset=dataset, batch_size=batch_size, shuffle=True, num_workers=0)),
+        ('TensorBatchLoader', lambda: TensorBatchLoader(dataset, batch_size=batch_size, shuffle=True)),
+    ]
+
+def iterate(make_loader):
+    # Loader creation (worker start up for num_workers > 0) plus one pass, as fit() and eval_model() do
+    start = time.time()
+    for batch, _ in make_loader():
+        pass
+    return time.time() - start
+
+def train_epoch(make_loader, ae, optimizer, loss_fn):
+    start = time.time()
+    ae.train()
+    for batch, _ in make_loader():
+        batch = batch.to(ae.device).view(batch.size(0), -1)
+        _, decoded = ae(batch)
+        loss = loss_fn(decoded, batch)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AutoEncoder batch loader benchmark')
+    parser.add_argument('--output_dir', type=str, default='', help='trained output dir with img_bucket.pt (default: latest, else random)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='random dataset sizes')
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=3)
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
+    if output_dir == '':
+        output_dirs = glob.glob(os.path.join('server', 'model', 'output', 'ae*'))
+        output_dir = max(output_dirs, key=os.path.getctime) if len(output_dirs) > 0 else ''
+    if output_dir != '':
+        bucket = ImageBucket(output_dir=output_dir)
+        datasets = [('{} train'.format(bucket.LABEL), bucket.train), ('{} all'.format(bucket.LABEL), bucket.test + bucket.train)]
+    else:
+        print('No trained output dir, using random datasets')
+        datasets = [('random', make_dataset(n)) for n in args.sizes]
+
+    print('{:>12} {:>7} {:>26} {:>10} {:>12} {:>9}'.format('dataset', 'N', 'loader', 'iter (s)', 'epoch (s)', 'speedup'))
+    for name, dataset in datasets:
+        base = None
+        for loader_name, make_loader in loaders(dataset, args.batch_size):
+            torch.manual_seed(SEED)
+            ae = AutoEncoder()
+            optimizer = torch.optim.Adam(ae.parameters(), lr=0.001)
+            loss_fn = nn.BCELoss()
+            it = min(iterate(make_loader) for _ in range(args.epochs))
+            epoch = min(train_epoch(make_loader, ae, optimizer, loss_fn) for _ in range(args.epochs))
+            if base is None:
+                base = epoch
+            print('{:>12} {:>7} {:>26} {:>10.3f} {:>12.3f} {:>8.2f}x'.format(
+                    name, len(dataset), loader_name, it, epoch, base / epoch))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Training time of one fit() process against data parallel fit_parallel() over 2/4/8 local processes
+#   $ cd app && python -m benchmarks.ae_parallel --num_imgs 100000 --processes 1 2 4 8
+# The cpu threads are split between the processes, the global batch size is kept
+###
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+from torch.utils.data import TensorDataset
+
+from server.model.ae import AutoEncoder
+from server.model.utils.tb_log import LogPolicy, NullWriter
+from server.model.utils.cpu_profile import CPUProfile
+from server.model.utils.parallel import fit_parallel
+
+SEED = 489
+
+
+def random_bucket(num_imgs):
+    g = torch.Generator().manual_seed(SEED)
+    train = TensorDataset(torch.rand(num_imgs, 1, 28, 28, generator=g), torch.zeros(num_imgs, dtype=torch.int32))
+    return SimpleNamespace(train=train, test=train)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AutoEncoder data parallel training benchmark')
+    parser.add_argument('--num_imgs', type=int, default=100000)
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=None, help='total cpu threads, all cores by default')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    dataset = random_bucket(args.num_imgs)
+    threads = args.threads if args.threads != None else os.cpu_count()
+    tmp_dir = tempfile.mkdtemp()
+    fit_kwargs = dict(batch_size=args.batch_size, max_epochs=args.epochs, lr=0.001, eval=False,
+                    output_dir=os.path.join(tmp_dir, 'ae_bench_0'),
+                    log_policy=LogPolicy(scalars=0, histograms=0, images=0, embeddings=0, embed_sample=0))
+
+    print('\n{:>10} {:>10} {:>12} {:>12} {:>9}'.format('processes', 'fit (s)', 'imgs/s', 'wall (s)', 'speedup'))
+    base = None
+    for processes in args.processes:
+        start = time.time()
+        if processes == 1:
+            torch.manual_seed(SEED)
+            ae = AutoEncoder(tb=NullWriter(), profile=CPUProfile(threads=threads))
+            ae.fit(dataset, **fit_kwargs)
+            fit_time = time.time() - start
+        else:
+            fit_time = fit_parallel(processes, AutoEncoder, dataset, fit_kwargs,
+                                    profile=CPUProfile(threads=threads), tb=False)['FIT_TIME']
+        wall = time.time() - start      # Includes spawning and the dataset sent to every process
+        if base is None:
+            base = fit_time
+        print('{:>10} {:>10.2f} {:>12.0f} {:>12.2f} {:>8.1f}x'.format(
+                processes, fit_time, args.epochs * args.num_imgs / fit_time, wall, base / fit_time))
+    shutil.rmtree(tmp_dir)
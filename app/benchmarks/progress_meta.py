@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# SOM iterations per second with job meta saved on every iteration vs rate limited
+#   $ cd app && python -m benchmarks.progress_meta                  # fakeredis
+#   $ cd app && python -m benchmarks.progress_meta --redis_url redis://localhost:6379
+###
+
+import argparse
+import time
+
+import numpy as np
+from rq.job import Job
+
+from server.model.som import SOM
+from server.utils.progress import Progress
+
+SEED = 489
+DIMS = [10, 25]
+
+
+def noop():
+    pass
+
+def run(job, data, n_iter, max_rate):
+    np.random.seed(SEED)
+    progress = Progress(job, max_rate=max_rate)
+    som = SOM(data=data, dims=DIMS, n_iter=n_iter, lr_init=0.2, job=progress)
+    som.update_interval = n_iter + 1   # quiet
+    start = time.time()
+    som.train()
+    wall = time.time() - start
+    return n_iter / wall, progress.num_flushes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Job meta progress benchmark')
+    parser.add_argument('--redis_url', type=str, default='', help='live Redis, fakeredis if not given')
+    parser.add_argument('--n_iter', type=int, default=3000)
+    parser.add_argument('--n', type=int, default=10000, help='cluster size')
+    parser.add_argument('--max_rate', type=float, default=4, help='meta saves per second after')
+    args = parser.parse_args()
+
+    if args.redis_url != '':
+        from redis import Redis
+        conn = Redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+        conn = fakeredis.FakeStrictRedis()
+
+    job = Job.create(noop, connection=conn)
+    job.save()
+    data = np.random.RandomState(SEED).uniform(0, 1, size=(args.n, 2))
+
+    before, before_flushes = run(job, data, args.n_iter, max_rate=None)
+    after, after_flushes = run(job, data, args.n_iter, max_rate=args.max_rate)
+    print('{:>8} {:>12} {:>10}'.format('', 'iter/s', 'saves'))
+    print('{:>8} {:>12.1f} {:>10}'.format('before', before, before_flushes))
+    print('{:>8} {:>12.1f} {:>10}'.format('after', after, after_flushes))
+    print('speedup {:.1f}x'.format(after / before))
+    job.delete()
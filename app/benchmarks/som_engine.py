@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Benchmark of the SOM engines on 1k, 10k and 100k point clusters
+#   $ cd app && python -m benchmarks.som_engine
+###
+
+import argparse
+import time
+
+import numpy as np
+
+from server.model.som import SOM
+
+SEED = 489
+DIMS = [10, 25]
+
+
+def make_cluster(n, m=2):
+    # Blobs in [0, 1], the same range as the MinMaxScaled UMAP feat in _feat.npy
+    rng = np.random.RandomState(SEED)
+    centres = rng.uniform(0, 1, size=(8, m))
+    data = centres[rng.randint(0, len(centres), size=n)] + rng.normal(0, 0.05, size=(n, m))
+    return np.clip(data, 0, 1)
+
+def run(engine, data, n_iter, lr):
+    np.random.seed(SEED)
+    som = SOM(data=data, dims=DIMS, n_iter=n_iter, lr_init=lr, engine=engine)
+    som.update_interval = n_iter + 1   # quiet
+    start = time.time()
+    som.train()
+    wall = time.time() - start
+    _, dist = som.bmu_all(data)
+    return wall, dist.mean()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SOM engine benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--n_iter', type=int, default=3000, help='online iterations (default: 3000)')
+    parser.add_argument('--n_epochs', type=int, default=20, help='batch epochs (default: 20)')
+    parser.add_argument('--lr', type=float, default=0.2)
+    parser.add_argument('--feat', type=str, default='', help='path/to/_feat.npy instead of synthetic data')
+    args = parser.parse_args()
+
+    print('{:>8} {:>10} {:>8} {:>10} {:>10} {:>9}'.format('N', 'engine', 'iters', 'wall (s)', 'QE', 'speedup'))
+    for n in args.sizes:
+        if args.feat != '':
+            feat = np.load(args.feat)
+            data = feat[np.random.RandomState(SEED).randint(0, len(feat), size=n)]
+        else:
+            data = make_cluster(n)
+
+        base = None
+        for engine, n_iter in [('loop', args.n_iter), ('vectorized', args.n_iter), ('batch', args.n_epochs)]:
+            wall, qe = run(engine, data, n_iter, args.lr)
+            if base is None:
+                base = wall
+            print('{:>8} {:>10} {:>8} {:>10.3f} {:>10.4f} {:>8.1f}x'.format(n, engine, n_iter, wall, qe, base / wall))
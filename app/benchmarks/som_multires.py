@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Coarse-to-fine, PCA initialised and early stopped SOM training against the SOM_SCHEDULE baseline
+#   $ cd app && python -m benchmarks.som_multires --output_dir server/model/output/ae_<label>_<timestamp>
+# Without an output dir (or _feat.npy) synthetic clusters are used
+###
+
+import os
+import glob
+import time
+import argparse
+
+import numpy as np
+
+from server.model.som import SOM
+from benchmarks.som_engine import make_cluster
+
+SEED = 489
+DIMS = [10, 25]
+SCHEDULE = [(2000, 3000, 0.2), (1000, 2000, 0.2), (250, 1000, 0.1), (0, 500, 0.1)]   # server/config.py
+CONVERGE = (0.4, 0.05, 2.0, 2)
+
+
+def schedule(num_imgs):
+    for min_imgs, n_iter, lr in SCHEDULE:
+        if num_imgs > min_imgs:
+            return n_iter, lr
+    return SCHEDULE[-1][1:]
+
+def run(data, init, n_iter, lr, coarse_dims=None, coarse_iter=None, engine='vectorized', converge=None):
+    np.random.seed(SEED)
+    coarse = (coarse_dims, coarse_iter) if coarse_dims != None else None
+    som = SOM(data=data, dims=DIMS, n_iter=n_iter, lr_init=lr, init=init, engine=engine, coarse=coarse, converge=converge)
+    som.update_interval = n_iter + 1   # quiet
+    start = time.time()
+    som.train()
+    wall = time.time() - start
+    return wall, som.NUM_ITER_USED, som.quantization_error(data), som.topographic_error(data)
+
+def load_clusters(output_dir, min_imgs):
+    feat = np.load(os.path.join(output_dir, '_feat.npy'))
+    c_labels = np.load(os.path.join(output_dir, '_c_labels.npy'))
+    return [(int(c), feat[c_labels==c]) for c in np.unique(c_labels[c_labels!=-1])
+                if np.sum(c_labels==c) > min_imgs]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-resolution SOM benchmark')
+    parser.add_argument('--output_dir', type=str, default='', help='clustered output dir (default: latest, else synthetic)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000], help='synthetic cluster sizes')
+    parser.add_argument('--min_imgs', type=int, default=250, help='skip smaller clusters')
+    parser.add_argument('--coarse_dims', type=str, default='3x6')
+    parser.add_argument('--coarse_iter', type=int, default=500)
+    parser.add_argument('--fine_iters', type=int, nargs='+', default=[250, 500, 1000], help='online fine tuning updates')
+    parser.add_argument('--fine_epochs', type=int, nargs='+', default=[3, 5], help='batch fine tuning epochs')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
+    if output_dir == '':
+        output_dirs = glob.glob(os.path.join('server', 'model', 'output', 'ae*'))
+        output_dir = max(output_dirs, key=os.path.getctime) if len(output_dirs) > 0 else ''
+    if output_dir != '':
+        clusters = load_clusters(output_dir, args.min_imgs)
+    else:
+        print('No clustered output dir, using synthetic clusters')
+        clusters = [('synth_{}'.format(n), make_cluster(n)) for n in args.sizes]
+    coarse_dims = [int(d) for d in args.coarse_dims.split('x')]
+
+    print('{:>12} {:>7} {:>20} {:>12} {:>9} {:>8} {:>8} {:>8}'.format(
+            'cluster', 'N', 'method', 'full updates', 'wall (s)', 'QE', 'TE', 'speedup'))
+    for c_label, data in clusters:
+        n_iter, lr = schedule(len(data))
+        runs = [('schedule', 'random', 'vectorized', n_iter, None)]
+        runs += [('pca', 'pca', 'vectorized', n_iter, None)]
+        runs += [('pca+converge', 'pca', 'vectorized', n_iter, None)]
+        for fine_iter in args.fine_iters:
+            runs += [('multires', 'random', 'vectorized', fine_iter, coarse_dims),
+                     ('multires+pca', 'pca', 'vectorized', fine_iter, coarse_dims)]
+        for fine_epochs in args.fine_epochs:
+            runs += [('multires+pca batch', 'pca', 'batch', fine_epochs, coarse_dims)]
+        base = None
+        for name, init, engine, updates, dims in runs:
+            converge = CONVERGE if name.endswith('converge') else None
+            wall, updates, qe, te = run(data, init, updates, lr, dims, args.coarse_iter, engine, converge)
+            if base is None:
+                base = wall
+            print('{:>12} {:>7} {:>20} {:>12} {:>9.3f} {:>8.4f} {:>8.3f} {:>7.1f}x'.format(
+                    c_label, len(data), name, updates, wall, qe, te, base / wall))
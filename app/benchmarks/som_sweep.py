@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Parallel SOM (iter, lr, dims) sweep over the clusters of a clustered output dir
+#   $ cd app && python -m benchmarks.som_sweep --output_dir server/model/output/ae_<label>_<timestamp>
+# Writes som_sweep.csv and prints a SOM_SCHEDULE for server/config.py. Runs are set up like new_som(), with
+# SOM_INIT, SOM_MULTIRES and SOM_CONVERGE from server/config.py, so iter is the max of a converged run
+###
+
+import os
+import glob
+import csv
+import time
+import argparse
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from sklearn.metrics import pairwise_distances_argmin_min
+
+from server.config import BaseConfig
+from server.model.som import scheduled_som
+
+SEED = 489
+ITERS = [100, 250, 500, 750, 1000, 1500, 2000, 2500, 3000, 4000]
+LRS = [0.01, 0.05, 0.1, 0.2, 0.3, 0.5]
+SIZE_BUCKETS = [2000, 1000, 250, 0]     # min num imgs, matching SOM_SCHEDULE
+FIELDS = ['c_label', 'num_imgs', 'bucket', 'dims', 'iter', 'lr', 'iter_used', 'stop_reason', 'qe', 'te', 'dup_rate', 'wall']
+
+
+def run(c_label, data, dims, n_iter, lr, init, multires, converge):
+    np.random.seed(SEED)
+    som = scheduled_som(data, dims, n_iter, lr, init=init, multires=multires, converge=converge)
+    som.update_interval = som.N_ITER    # Only print the first iteration
+    start = time.time()
+    net = som.train()
+    wall = time.time() - start
+    img_grd_idx, _ = pairwise_distances_argmin_min(net.reshape(-1, net.shape[-1]), data)
+    return {
+        'c_label': c_label,
+        'num_imgs': len(data),
+        'bucket': next(b for b in SIZE_BUCKETS if len(data) > b or b == 0),
+        'dims': '{}x{}'.format(*dims),
+        'iter': n_iter,
+        'lr': lr,
+        'iter_used': som.NUM_ITER_USED,
+        'stop_reason': som.STOP_REASON,
+        'qe': float(som.quantization_error(data)),
+        'te': float(som.topographic_error(data)),
+        'dup_rate': 1 - len(np.unique(img_grd_idx)) / len(img_grd_idx),
+        'wall': wall,
+    }
+
+def recommend(rows, qe_tol=0.05, te_tol=0.05):
+    # Per size bucket, the cheapest (iter, lr) within qe_tol of the best mean QE and te_tol of the best mean TE
+    schedule = []
+    for bucket in SIZE_BUCKETS:
+        configs = {}
+        for row in rows:
+            if row['bucket'] == bucket:
+                configs.setdefault((row['iter'], row['lr']), []).append(row)
+        if len(configs) == 0:
+            continue
+        mean = {k: (np.mean([r['qe'] for r in v]), np.mean([r['te'] for r in v]), np.mean([r['wall'] for r in v]))
+                    for k, v in configs.items()}
+        best_qe = min(m[0] for m in mean.values())
+        best_te = min(m[1] for m in mean.values())
+        ok = [k for k, m in mean.items() if m[0] <= best_qe * (1 + qe_tol) and m[1] <= best_te + te_tol]
+        n_iter, lr = min(ok, key=lambda k: mean[k][2])
+        schedule.append((bucket, n_iter, lr))
+    return schedule
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SOM hyperparameter sweep')
+    parser.add_argument('--output_dir', type=str, default='', help='clustered output dir (default: latest)')
+    parser.add_argument('--iters', type=int, nargs='+', default=ITERS)
+    parser.add_argument('--lrs', type=float, nargs='+', default=LRS)
+    parser.add_argument('--dims', type=str, nargs='+', default=['10x25'], help='e.g. 10x25 8x20')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--csv', type=str, default='som_sweep.csv')
+    parser.add_argument('--init', type=str, default=BaseConfig.SOM_INIT, help="'pca' or 'random'")
+    parser.add_argument('--no_multires', action='store_true', help='train at full size only, ignoring SOM_MULTIRES')
+    parser.add_argument('--no_converge', action='store_true', help='always run iter, ignoring SOM_CONVERGE')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir
+    if output_dir == '':
+        output_dir = max(glob.iglob(os.path.join('server', 'model', 'output', 'ae*')), key=os.path.getctime)
+    feat = np.load(os.path.join(output_dir, '_feat.npy'))
+    c_labels = np.load(os.path.join(output_dir, '_c_labels.npy'))
+    dims_list = [[int(d) for d in dims.split('x')] for dims in args.dims]
+    multires = None if args.no_multires else BaseConfig.SOM_MULTIRES
+    converge = None if args.no_converge else BaseConfig.SOM_CONVERGE
+
+    rows = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run, int(c_label), feat[c_labels==c_label], dims, n_iter, lr, args.init, multires, converge)
+                    for c_label in np.unique(c_labels[c_labels!=-1])     # -1 is noise
+                    for dims, n_iter, lr in product(dims_list, args.iters, args.lrs)]
+        for i, future in enumerate(as_completed(futures)):
+            rows.append(future.result())
+            print('[{}/{}] {}'.format(i+1, len(futures), rows[-1]))
+    print('Sweep of {} runs took {:.1f}s'.format(len(rows), time.time() - start))
+
+    rows.sort(key=lambda r: (r['c_label'], r['dims'], r['iter'], r['lr']))
+    with open(args.csv, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Saved', args.csv)
+
+    for dims in args.dims:
+        print('\nSOM_SCHEDULE for {} grid'.format(dims))
+        for bucket, n_iter, lr in recommend([r for r in rows if r['dims'] == dims]):
+            print('    ({}, {}, {}),'.format(bucket, n_iter, lr))
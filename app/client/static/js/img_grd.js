@@ -127,9 +127,23 @@ document.addEventListener('keydown', function(evt) {
             $('#img-grd-wrapper').addClass('shade')
             updateSOM(imgIdx, selectedImgIdx, ',')
         }
+
+        if (typeof(CELL) != 'undefined' && CELL != null 
+            && evt.keyCode === 27 ){     // if ESC pressed, back up to the cluster grid
+            $('#img-grd-wrapper').addClass('shade')
+            drillSOM(null)
+        }
     }
 });
 
+// Double clicking an image drills into its cell with a child SOM
+document.querySelector('#img-grd').addEventListener('dblclick', function(evt){
+    var item = $(evt.target).closest('.grd-item')
+    if (item.length == 0 || $('#img-grd').attr('class').includes('shade')) return
+    $('#img-grd-wrapper').addClass('shade')
+    drillSOM($('.grd-item').index(item))
+});
+
 
 function updateSOM(imgIdx, selectedImgIdx, imgGridIdx) {
     taskData = {'task_data': {'SOM_MODE': 'update', 'FILTERED': false}}
@@ -194,6 +208,29 @@ function filteredSOM(btn_id){
         });
 }
 
+function drillSOM(cell){
+    C_LABEL = $('#cluster-filter .active').val()
+    $('#progress').html(cell == null ? 'Back to cluster <b>[ ' + C_LABEL + ' ]</b>' : 'Drilling into cell <b>[ ' + cell + ' ]</b>')
+
+    taskData = {'task_data': {'C_LABEL': C_LABEL, 'SOM_MODE': 'drill', 'FILTERED': false, 'CELL': cell}}
+    $.ajax({
+            url: `/tasks/som`,
+            method: 'POST',
+            contentType: 'application/json; charset=UTF-8',
+            data: JSON.stringify(taskData),
+            dataType: 'json',
+            success: console.log(JSON.stringify(taskData))
+        })
+        .done((res) => {
+            show($('#progress'))
+            console.log(res)
+            getStatus(res.task.task_type, res.task.task_id, res.task.task_data)
+        })
+        .fail((err) => {
+            console.log(err)
+        });
+}
+
 function validImgs(imgIdx){
     if ($('#num-imgs').val() =='' ){
         $('#num-imgs').val($('#num-imgs').html().match(/\d+/)[0])
@@ -168,7 +168,7 @@ function updateProgress(res) {
 
             if (NUM_BAD_EPOCHS != 0) {
                 progress_msg = progress_msg +
-                    'Loss did not improve from ' + test_loss + ' for <b>[ ' + NUM_BAD_EPOCHS + ' ]</b> epochs'
+                    'Loss did not improve from ' + test_loss + ' for <b>[ ' + NUM_BAD_EPOCHS + ' ]</b> evaluations'
             }
             $('#progress').html(progress_msg)
 
@@ -251,6 +251,7 @@ function updateProgress(res) {
         NUM_IMGS = res.task.task_data.NUM_IMGS
         NUM_FILTERED = res.task.task_data.NUM_FILTERED
         NUM_REFRESH = res.task.task_data.NUM_REFRESH
+        CELL = res.task.task_data.CELL     // Drilled cell of the grid, null on the cluster grid
 
         if ($('.grd-item').length == 0) location.reload()   //For first reload from cluster task
         refreshImgGrd(NUM_IMGS, NUM_FILTERED, NUM_REFRESH)
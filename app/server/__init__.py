@@ -22,6 +22,8 @@ from redis import Redis
 from rq import Queue, Connection
 
 from server.config import DevelopmentConfig
+from server.utils.speculation import Speculation
+from server.som_service import SOMServiceClient
 
 ROOT_DIR = os.path.dirname(__file__)
 
@@ -50,6 +52,9 @@ def create_app(script_info=None):
     migrate.init_app(app, db)
     app.redis = Redis.from_url(app.config['REDIS_URL'])
     app.task_queue = Queue(connection=app.redis)
+    app.speculation = Speculation(app.redis, app.task_queue, ttl=app.config['SOM_SPECULATE_TTL'])
+    app.som_service = SOMServiceClient(app.config['SOM_SERVICE_ADDRESS'], authkey=app.config['SECRET_KEY'], 
+                                        timeout=app.config['SOM_SERVICE_TIMEOUT'])
     # socketio.init_app(app, message_queue=app.config['REDIS_URL'])
     # socketio.init_app(app)
     
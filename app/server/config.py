@@ -13,6 +13,13 @@ import glob
 
 ROOT_DIR = os.path.dirname(__file__)
 
+def latest_output_dir(model_output_dir):
+    # Long running processes call this per job, OUTPUT_DIR below is only resolved once at import
+    #  Returns: output dir of the latest ae model with its config.json saved, else of the latest ae run
+    runs = glob.glob(os.path.join(model_output_dir, 'ae*'))
+    saved = [d for d in runs if os.path.exists(os.path.join(d, 'config.json'))]
+    return max(saved or runs, key=os.path.getctime)
+
 class BaseConfig(object):
     """Base configuration."""
     WTF_CSRF_ENABLED = True
@@ -22,11 +29,50 @@ class BaseConfig(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     REDIS_URL = os.getenv('REDIS_URL') or 'redis://'
     QUEUES = ['default']
+    PROGRESS_RATE = 4   # Max job meta saves to Redis per second
+    ARTIFACT_CACHE_MB = 1024    # Worker memory for cached features, labels and models
     MODEL_OUTPUT_DIR = os.path.join(ROOT_DIR, 'model', 'output')
     DATASET_DIR = os.path.join(ROOT_DIR, 'datasets')
     UPLOAD_DIR = os.path.join(ROOT_DIR, 'uploads')
+    AE_LOG = {          # TensorBoard epoch intervals (0 is off) and projector sample size, see server/model/utils/tb_log.py
+        'scalars': 1, 'histograms': 10, 'images': 10, 'embeddings': 0, 'embed_sample': 5000,
+    }
+    AE_CPU_PROFILE = {  # Worker threads, bf16 autocast, 'script' or 'compile' forward, fused inference, see benchmarks/ae_cpu.py
+        'threads': None, 'interop_threads': None, 'bf16': False, 'compile': None, 'fuse': False,
+    }
+    AE_CHECKPOINT_EVERY = 1     # Epochs between resumable training checkpoints, 0 is off
+    AE_TIME_BUDGET = 480    # Seconds per train job, warm start pick included, before carrying on in a new one, under the 600s job_timeout
+    AE_EVAL = {         # Evaluate every k epochs on a fixed test sample (None is all), early stopping patience counts evaluations
+        'every': 2, 'sample': 2000, 'plot_sample': 2000,
+    }
+    AE_PROCESSES = 1    # Data parallel training processes sharing AE_CPU_PROFILE threads, see benchmarks/ae_parallel.py
+    AE_FINETUNE = {     # Warm start uploads from the best of the latest trained models, None always trains from scratch
+        'candidates': 5,            # Latest models tried
+        'max_loss_ratio': 1.5,      # Sample loss on the new bucket against the model's own test loss
+        'freeze': 2,                # Leading encoder Linear layers kept fixed
+        'max_epochs': 10, 'lr': 0.0005, 'patience': 3,
+    }
+    SOM_DIMS = [10, 25]     # Image grid [rows, cols]
+    SOM_PRETRAIN = False    # Train the SOMs of every cluster in parallel after clustering, lengthens the cluster job
+    SOM_SCHEDULE = [        # (min num imgs, iter, lr) for new SOMs, largest first, see benchmarks/som_sweep.py
+        (2000, 3000, 0.2),
+        (1000, 2000, 0.2),
+        (250, 1000, 0.1),
+        (0, 500, 0.1),
+    ]
+    SOM_INIT = 'pca'    # 'pca' spreads new SOMs along the principal components, 'random' draws small normal weights
+    SOM_MULTIRES = None     # (coarse dims, coarse iter, fine iter) capping new SOM updates e.g. ([3, 6], 500, 1000), see benchmarks/som_multires.py
+    SOM_CONVERGE = None     # (ordering share, check share of iter, tol %, patience) stopping new SOMs once QE settles e.g. (0.4, 0.05, 2.0, 2)
+    SOM_REFRESH_MODE = 'queue'  # 'queue' pops neuron queues, 'incremental' retrains changed neurons, 'update' retrains all
+    SOM_UNIQUE_GRID = True  # No image shown in more than one grid cell
+    SOM_DRILL_FILL = 2  # Drilled cells grow by neighbouring cells until they fill the grid this many times over
+    SOM_SERVICE = False     # Answer 'queue' and 'switch' grids from python -m server.som_service, rq when it's down
+    SOM_SERVICE_ADDRESS = os.path.join(ROOT_DIR, 'som_service.sock')
+    SOM_SERVICE_TIMEOUT = 1.0   # Seconds before falling back to rq
+    SOM_SPECULATE = False   # Precompute the next grid while the current one is reviewed, costs a worker job per refresh
+    SOM_SPECULATE_TTL = 600     # Seconds a speculative grid is kept
     
-    OUTPUT_DIR = max(glob.iglob(os.path.join(MODEL_OUTPUT_DIR, 'ae*')), key=os.path.getctime)
+    OUTPUT_DIR = latest_output_dir(MODEL_OUTPUT_DIR)
 
         
 class DevelopmentConfig(BaseConfig):
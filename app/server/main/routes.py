@@ -19,9 +19,12 @@ from flask import jsonify, url_for, request, redirect, flash
 from flask import current_app, session
 
 from server.main import bp
-from server.main.tasks import extract_zip, load_data, load_MNIST, train, cluster, som
+from server.main.tasks import extract_zip, load_data, load_MNIST, train, resume_train, cluster, som, commit_som
 from server.main.models import Image, ImageGrid, clear_tables
 from server.utils.datasets.imgbucket import ImageBucket
+from server.model.utils.som_store import SOMStore
+from server.config import latest_output_dir
+from server.som_service import SyncTask
 
 def is_zipfile(filename):
     return '.' in filename and \
@@ -41,6 +44,7 @@ def home():
         session['NUM_IMGS'] = 0
         session['NUM_FILTERED'] = 0
         session['NUM_REFRESH'] = 0
+        session['CELL'] = None
         
     return render_template('/img_grd.html', 
             LABEL=session['LABEL'], NUM_IMGS=session['NUM_IMGS'], 
@@ -117,17 +121,31 @@ def run_task(task_type):    # TODO: split into different routes
     if task_type=='som':    # Resetting the SOM
         ## Init vars
         if session['C_LABELS'] == []:
-            c_labels = np.load(os.path.join(current_app.config['OUTPUT_DIR'], '_c_labels.npy'))
+            c_labels = np.load(os.path.join(latest_output_dir(current_app.config['MODEL_OUTPUT_DIR']), '_c_labels.npy'))
             session['C_LABELS'] = c_labels
         session['C_LABELS'] = [int(x)  for x in set(session['C_LABELS'])]
         task_data['C_LABELS'] = session['C_LABELS']
-        session['DIMS'] = [10, 25]
-        task_data['DIMS'] = [10, 25]
+        session['DIMS'] = current_app.config['SOM_DIMS']
+        task_data['DIMS'] = current_app.config['SOM_DIMS']
 
         session['img_grd_paths'] =[]
         session['img_idx'] =[]
         session['img_grd_c_labels']=[]
         print(task_data['C_LABEL'], session['C_LABEL'], task_data['FILTERED'])
+        ## Drill mode trains a child SOM over one cell of the grid, CELL=None goes back to the cluster grid
+        session['CELL'] = task_data.get('CELL') if task_data['SOM_MODE'] == 'drill' else None
+        if task_data['SOM_MODE'] == 'drill':
+            imgs = Image.query.filter_by(c_label=int(session['C_LABEL'])).filter_by(processed=False).all()
+            img_idx = [img.idx for img in imgs]
+            if session['CELL'] == None:
+                task = run_som(img_idx, session['C_LABEL'], session['DIMS'], 'switch', '')
+            else:
+                session['CELL'] = int(session['CELL'])
+                # args = (img_idx, c_label, dims, SOM_MODE='drill', NUM_REFRESH, CELL)
+                task = current_app.task_queue.enqueue(som, 
+                            args=(img_idx, session['C_LABEL'], session['DIMS'], 'drill', session['NUM_REFRESH'], session['CELL']))
+            task_data['CELL'] = session['CELL']
+
         ## Switch mode is reloading SOM with diff weights
         if task_data['SOM_MODE'] == 'switch':
             ## Switching between filtered mode, default is false
@@ -136,29 +154,28 @@ def run_task(task_type):    # TODO: split into different routes
                 imgs = Image.query.filter_by(c_label=int(task_data['C_LABEL'])).filter_by(filtered=True).all()
                 img_idx = [img.idx for img in imgs]
                 print(len(imgs))    
-                task = current_app.task_queue.enqueue(som, args=(img_idx, session['C_LABEL'], session['DIMS'], 'switch', ''))
+                task = run_som(img_idx, session['C_LABEL'], session['DIMS'], 'switch', '')
                 session['FILTERED'] = task_data['FILTERED'] 
                 session['NUM_FILTERED'] = len(imgs)
             elif not task_data['FILTERED']: ## Switching SOMS between different clusters 
-                switch_som_path = os.path.join(current_app.config['OUTPUT_DIR'], '_som_{}.npy'.format(task_data['C_LABEL']))
-                if  os.path.exists(switch_som_path):
+                store = SOMStore(latest_output_dir(current_app.config['MODEL_OUTPUT_DIR']))
+                if store.exists(task_data['C_LABEL']):
                     print('Saving current session')
                     print( session['NUM_IMGS'], session['NUM_FILTERED'], session['NUM_REFRESH'])
-                    # Saving NUM_FILTERED, NUM_REFRESH to som_path
-                    session_som_path = os.path.join(current_app.config['OUTPUT_DIR'], '_som_{}.npy'.format(session['C_LABEL']))
-                    som_net = np.load(session_som_path).item()
-                    som_net['NUM_IMGS'] = session['NUM_IMGS']
-                    som_net['NUM_FILTERED'] = session['NUM_FILTERED']
-                    som_net['NUM_REFRESH'] = session['NUM_REFRESH']
-                    som_net['DIMS'] = session['DIMS']
-                    np.save(session_som_path, som_net)
+                    # Saving NUM_FILTERED, NUM_REFRESH to the som counters sidecar
+                    store.save_counters(session['C_LABEL'], 
+                                        NUM_IMGS=session['NUM_IMGS'], 
+                                        NUM_FILTERED=session['NUM_FILTERED'], 
+                                        NUM_REFRESH=session['NUM_REFRESH'], 
+                                        DIMS=session['DIMS'])
                     
                     imgs = Image.query.filter_by(c_label=int(task_data['C_LABEL'])).filter_by(processed=False).filter_by(filtered=False).all()
                     img_idx = [img.idx for img in imgs]
                     print(len(set(img_idx)))
                     # args = (img_idx, c_label, dims, SOM_MODE'='udpate', NUM_REFRESH='') 
-                    task = current_app.task_queue.enqueue(som, args=(img_idx, task_data['C_LABEL'], session['DIMS'], 'switch', ''))
+                    task = run_som(img_idx, task_data['C_LABEL'], session['DIMS'], 'switch', '')
                     session['NUM_IMGS']  = len(imgs)
+                    session['NUM_REFRESH'] = 0  # Unless the cluster has saved counters, loaded when the grid is back
                     
                     filtered = Image.query.filter_by(c_label=int(task_data['C_LABEL'])).filter_by(filtered=True).all()
                     session['NUM_FILTERED']  = len(filtered)
@@ -189,7 +206,7 @@ def run_task(task_type):    # TODO: split into different routes
 
 @bp.route('/tasks/<task_type>/<task_id>', methods=['POST'])
 def get_status(task_type, task_id):
-    task = current_app.task_queue.fetch_job(task_id)
+    task = fetch_task(task_id)
     if request.is_json:
         req = request.get_json()
         pprint.pprint(req)
@@ -224,8 +241,13 @@ def get_status(task_type, task_id):
         task_type = 'train'
         task_data['progress_msg'] = ''
 
+    elif task_type=='train' and task.get_status()=='finished' and not task.result[-1]:    # Out of time
+        output_dir = task.result[3]
+        task = current_app.task_queue.enqueue(resume_train, output_dir, job_timeout=600)  # Next 10 min
+        task_type = 'train'
+
     elif task_type=='train' and task.get_status()=='finished':
-        batch_size, lr, epoch, output_dir = task.result    
+        batch_size, lr, epoch, output_dir, _ = task.result    
         session['ae'] = {'bs': batch_size, 'lr': lr, 'epoch': epoch}
         session['OUTPUT_DIR'] = output_dir
         print(session['LABEL'])
@@ -251,10 +273,14 @@ def get_status(task_type, task_id):
         session['img_grd_c_labels']=[]
         session['C_LABELS'] = [int(x)  for x in set(c_labels)]
         session['C_LABEL'] = session['C_LABELS'][0]
-        session['DIMS'] = [10, 25]
+        session['DIMS'] = current_app.config['SOM_DIMS']
         session['FILTERED'] = False
+        session['CELL'] = None
         
-        task = run_new_som(session['C_LABEL'], session['DIMS'])
+        if SOMStore(latest_output_dir(current_app.config['MODEL_OUTPUT_DIR'])).exists(session['C_LABEL']):    # Pretrained in cluster()
+            task = run_pretrained_som(session['C_LABEL'], session['DIMS'])
+        else:
+            task = run_new_som(session['C_LABEL'], session['DIMS'])
 
         task_data['C_LABEL'] = session['C_LABEL']
         task_data['C_LABELS'] = session['C_LABELS'] 
@@ -268,8 +294,13 @@ def get_status(task_type, task_id):
         task.refresh()
             
     elif task_type=='som' and task.get_status()=='finished':
-        img_grd_idx, c_label = task.result
+        img_grd_idx, c_label = task.result[:2]
+        if len(task.result) > 2:    # Claimed speculative grid, its SOM state is saved only now
+            commit_som(c_label, task.result[2])
         print(img_grd_idx)
+        if session.get('CELL') != None and str(c_label) == str(session['C_LABEL']):
+            session['CELL'] = None  # Every image of the drilled cell processed, back on the cluster grid
+        task_data['CELL'] = session.get('CELL')
         img_grd = ImageGrid(img_grd_idx)    # Update img_grd
         
         session['img_grd_paths'] = img_grd.img_paths
@@ -278,8 +309,7 @@ def get_status(task_type, task_id):
 
         # Loading NUM_IMGS, NUM_FILTERED, NUM_REFRESH from som net
         if task_data['SOM_MODE'] == 'switch':
-            som_path = os.path.join(current_app.config['OUTPUT_DIR'], '_som_{}.npy'.format(task_data['C_LABEL']))
-            som_net = np.load(som_path).item()
+            som_net = SOMStore(latest_output_dir(current_app.config['MODEL_OUTPUT_DIR'])).load_counters(task_data['C_LABEL'])
             if 'NUM_IMGS' in som_net:
                 print('Loading ', task_data['C_LABEL'] , som_net['NUM_IMGS'], som_net['NUM_FILTERED'], som_net['NUM_REFRESH'] )
                 session['NUM_IMGS'] = som_net['NUM_IMGS']
@@ -290,6 +320,10 @@ def get_status(task_type, task_id):
         task_data['NUM_FILTERED'] =  session['NUM_FILTERED']
         task_data['NUM_REFRESH'] = session['NUM_REFRESH'] 
 
+        # Precompute the next grid while this one is reviewed, unless the SOM service is answering
+        if current_app.config['SOM_SPECULATE'] and not isinstance(task, SyncTask):
+            speculate_som(img_grd.img_idx)
+
         
         ##  Trying to load all img grid paths at once and using shuffle filter
         # session['img_grd_paths'].append(img_grd.img_paths)
@@ -356,16 +390,26 @@ def updateSOM(img_idx, selected_img_idx, img_grd_idx):
     session['NUM_FILTERED'] += len(set(selected_img_idx))
     session['NUM_REFRESH'] += 1
 
-    # args = (img_idx, c_label, dims, SOM_MODE'='udpate', NUM_REFRESH=session['NUM_REFRESH'])
-    task = current_app.task_queue.enqueue(som, 
-                args=(img_idx, session['C_LABEL'], session['DIMS'], 'update', session['NUM_REFRESH']))
+    task = None
+    if current_app.config['SOM_SPECULATE']:   # Grid precomputed for this processed set
+        task, saved = current_app.speculation.claim(session['C_LABEL'], img_idx, session.get('CELL'))
+        task_data['SPEC_HIT'] = task != None
+        task_data['SPEC_SAVED'] = round(saved, 3)
+        task_data.update(current_app.speculation.stats())
+    if task == None and session.get('CELL') != None:     # Refreshing the drilled cell's child SOM
+        task = current_app.task_queue.enqueue(som, 
+                    args=(img_idx, session['C_LABEL'], session['DIMS'], 'drill', session['NUM_REFRESH'], session['CELL']))
+    elif task == None:
+        # args = (img_idx, c_label, dims, SOM_MODE=SOM_REFRESH_MODE, NUM_REFRESH=session['NUM_REFRESH'])
+        task = run_som(img_idx, session['C_LABEL'], session['DIMS'], current_app.config['SOM_REFRESH_MODE'], session['NUM_REFRESH'])
 
     task_data.update({'LABEL': session['LABEL'],
                     'C_LABEL': session['C_LABEL'],
                     'NUM_REFRESH': session['NUM_REFRESH'], 
                     'NUM_FILTERED': session['NUM_FILTERED'],
                     'NUM_IMGS': session['NUM_IMGS'],
-                    'DIMS': session['DIMS']
+                    'DIMS': session['DIMS'],
+                    'CELL': session.get('CELL')
                     })
         
     response_object = {
@@ -389,11 +433,9 @@ def updateSOM(img_idx, selected_img_idx, img_grd_idx):
 
 
 def run_new_som(c_label, dims):
-    if 'output_dir' not in session: 
-        session['output_dir'] = current_app.config['OUTPUT_DIR']
-        
-    if os.path.exists(os.path.join(session['output_dir'], '_som_{}.npy'.format(c_label))): # Clearing som weights
-        os.remove(os.path.join(session['output_dir'], '_som_{}.npy'.format(c_label)))  
+    # The dir the som jobs use, the app outlives uploads like the worker
+    SOMStore(latest_output_dir(current_app.config['MODEL_OUTPUT_DIR'])).remove(c_label)    # Clearing som weights and counters
+    current_app.speculation.cancel(c_label)     # Speculative grids were for the old SOM
         
     img_idx = [img.idx for img in Image.query.filter_by(c_label=int(c_label)).all()]
     # Resetting session vars
@@ -406,6 +448,48 @@ def run_new_som(c_label, dims):
     return task
 
 
+def run_pretrained_som(c_label, dims):
+    img_idx = [img.idx for img in Image.query.filter_by(c_label=int(c_label)).all()]
+    # Resetting session vars
+    session['NUM_REFRESH'] = 0
+    session['NUM_FILTERED'] = 0 
+    session['NUM_IMGS'] = len(img_idx)
+    
+    # args = (img_idx, c_label, dims, SOM_MODE'='switch', NUM_REFRESH=0)
+    task = run_som(img_idx, c_label, dims, 'switch', 0)
+    return task
+
+
+def run_som(img_idx, c_label, dims, som_mode, num_refresh):
+    # Grid straight from the SOM service when it can answer without training, else an rq som job
+    if current_app.config['SOM_SERVICE']:
+        img_grd_idx = current_app.som_service.grid(img_idx, c_label, dims, som_mode)
+        if img_grd_idx != None:
+            return SyncTask.create(current_app.redis, [img_grd_idx, c_label], SOM_MODE=som_mode)
+    return current_app.task_queue.enqueue(som, args=(img_idx, c_label, dims, som_mode, num_refresh))
+
+
+def fetch_task(task_id):
+    if task_id.startswith(SyncTask.PREFIX):
+        return SyncTask.fetch(current_app.redis, task_id)
+    return current_app.task_queue.fetch_job(task_id)
+
+
+def speculate_som(img_grd_idx):
+    # Enqueue the refresh updateSOM would run once every image in img_grd_idx is processed,
+    # the unprocessed set is the same whichever images the user selects
+    imgs = Image.query.filter_by(c_label=int(session['C_LABEL'])).filter_by(processed=False).all()
+    shown = set(int(idx) for idx in img_grd_idx)
+    img_idx = [img.idx for img in imgs if img.idx not in shown]
+    if len(img_idx) == 0:
+        return None
+    if session.get('CELL') != None:
+        return current_app.speculation.enqueue(som, img_idx, session['C_LABEL'], 
+                    session['DIMS'], 'drill', session['NUM_REFRESH']+1, session['CELL'], cell=session['CELL'])
+    # args = (img_idx, c_label, dims, SOM_MODE=SOM_REFRESH_MODE, NUM_REFRESH=session['NUM_REFRESH']+1)
+    return current_app.speculation.enqueue(som, img_idx, session['C_LABEL'], 
+                session['DIMS'], current_app.config['SOM_REFRESH_MODE'], session['NUM_REFRESH']+1)
+
 
 # TODO: Should be done as tasks but yet to work out how to declare db instance in tasks.py ><
 def save_img_db(c_labels):
@@ -16,25 +16,42 @@ from zipfile import ZipFile, BadZipfile
 from copy import copy
 from datetime import datetime
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from rq import get_current_job
 
 
 import numpy as np
 from sklearn.manifold import TSNE
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics import pairwise_distances_argmin_min
 from hdbscan import HDBSCAN
 from umap import UMAP
 from torchvision.utils import save_image, make_grid
+from torch.utils.data import TensorDataset
+from torch.utils.tensorboard import SummaryWriter
 
 from server.__init__ import create_app
+from server.config import latest_output_dir
 from server.model.ae import AutoEncoder
-from server.model.som import SOM
+from server.model.utils.tb_log import LogPolicy
+from server.model.utils.cpu_profile import CPUProfile
+from server.model.utils.checkpoint import unfinished_run, finished_runs, save_warm_start, load_warm_start
+from server.model.utils.parallel import fit_parallel
+from server.model.utils.eval_schedule import EvalSchedule
+from server.model.utils.weights import model_path, load_features, mark_features, compatible, FEAT
+from server.model.som import SOM, scheduled_som
+from server.model.utils.grid_index import GridIndex, build_indexes, index_path, load_index
+from server.model.utils.som_store import SOMStore
+from server.model.utils.som_queue import NeuronQueues
+from server.model.utils.som_drill import cell_key, cell_members
 from server.model.utils.plt import plt_scatter, plt_scatter_3D
 from server.utils.datasets.filteredMNIST import FilteredMNIST
 from server.utils.datasets.imgbucket import ImageBucket
+from server.utils.datasets.batch_loader import tensors_of
 from server.main.models import Image
 from server.utils.load import zh_detect
+from server.utils.progress import Progress
+from server.utils.cache import ArtifactCache
 
 # Import current app settings for app config
 app = create_app()
@@ -44,8 +61,11 @@ app.app_context().push()
 SEED = 489
 ALLOWED_EXTENSIONS = set(['png', 'jpg', 'jpeg'])
 
+# Arrays and models kept warm across jobs when the worker runs jobs in-process (SimpleWorker)
+artifacts = ArtifactCache(max_bytes=app.config['ARTIFACT_CACHE_MB'] * 2**20)
+
 def extract_zip(zpath):
-    job = get_current_job()
+    progress = Progress(get_current_job(), max_rate=app.config['PROGRESS_RATE'])
     zf = test_zipfile(zpath)
     zfname = os.path.basename(os.path.normpath(zpath))
     label = zfname.split('.')[0]
@@ -55,8 +75,7 @@ def extract_zip(zpath):
     # https://leeifrankjaw.github.io/articles/fix_filename_encoding_for_zip_archive_with_python.html
     if zh_detect(label):
         zfname = label+'_utf8.zip'
-        job.meta['progress_msg'] = 'Fixing filename encoding ...'
-        job.save_meta()
+        progress.stage('Fixing filename encoding ...')
         with ZipFile(os.path.join(app.config['UPLOAD_DIR'], zfname), mode='w') as ztf:
             ztf.comment = zf.comment
             for zinfo in zf.infolist():
@@ -70,8 +89,7 @@ def extract_zip(zpath):
     print(os.path.join(app.config['UPLOAD_DIR'], zfname))
         
     with ZipFile(os.path.join(app.config['UPLOAD_DIR'], zfname),"r") as z_ref:
-        job.meta['progress_msg'] = 'Extracting <b>[ {} ]</b> ...'.format(zfname)
-        job.save_meta()
+        progress.stage('Extracting <b>[ {} ]</b> ...'.format(zfname))
         print('Extracting {} ...'.format(zfname))
         z_ref.extractall(app.config['UPLOAD_DIR'])
     z_ref.close()
@@ -89,8 +107,9 @@ def load_data(label, img_dir):
                         download_raw=False, download_dir=app.config['DATASET_DIR'])
 
 
-def train(dataset):
-    job = get_current_job()
+def train(dataset, output_dir=None):
+    job_start = time.time()
+    progress = Progress(get_current_job(), max_rate=app.config['PROGRESS_RATE'])
     if len(dataset.train) < 500:
         BATCH_SIZE = 32
     elif len(dataset.train) < 2000:
@@ -101,41 +120,98 @@ def train(dataset):
     MAX_EPOCHS = 50
     LR = 0.001    
     N_TEST_IMGS = 8
-    PATIENCE = 10
-    
-    job.meta['BS'] = BATCH_SIZE
-    job.meta['MAX_EPOCHS'] = MAX_EPOCHS
-    job.meta['LR'] = LR
-    job.meta['PATIENCE'] = PATIENCE
-    job.save_meta()
-
-    ae = AutoEncoder(job=job)
+    PATIENCE = 5     # Evaluations, every AE_EVAL['every'] epochs
     timestamp = datetime.now().strftime('%Y.%m.%d-%H%M%S')
     MODEL_OUTPUT_DIR = app.config['MODEL_OUTPUT_DIR']
-    OUTPUT_DIR = os.path.join(MODEL_OUTPUT_DIR, '{}_{}_{}'.format('ae', dataset.LABEL, timestamp))
+    OUTPUT_DIR = output_dir
+    if OUTPUT_DIR == None:  # Carry on a run of the same bucket cut short by a job timeout or worker restart
+        OUTPUT_DIR = unfinished_run(MODEL_OUTPUT_DIR, 'ae', dataset.LABEL)
+    if OUTPUT_DIR != None:  # Same warm start as the run's first job, runs from before warm starts had none
+        WARM = load_warm_start(OUTPUT_DIR) or {'source': None}
+    else:
+        OUTPUT_DIR = os.path.join(MODEL_OUTPUT_DIR, '{}_{}_{}'.format('ae', dataset.LABEL, timestamp))
+        FINETUNE = app.config['AE_FINETUNE']
+        WARM = {'source': finetune_source(dataset, FINETUNE) if FINETUNE != None else None}
+        if WARM['source'] != None:
+            WARM.update((key, FINETUNE[key]) for key in ('freeze', 'max_epochs', 'lr', 'patience'))
+        save_warm_start(OUTPUT_DIR, WARM)
     print(OUTPUT_DIR)
-    ae.fit(dataset, 
+    WARM_START = WARM['source']
+    if WARM_START != None:     # A shorter run from a model that already reconstructs this bucket well
+        MAX_EPOCHS, LR, PATIENCE = WARM['max_epochs'], WARM['lr'], WARM['patience']
+    
+    progress.update(force=True, BS=BATCH_SIZE, MAX_EPOCHS=MAX_EPOCHS, LR=LR, PATIENCE=PATIENCE,
+                    WARM_START=os.path.basename(WARM_START) if WARM_START != None else None)
+    TIME_BUDGET = app.config['AE_TIME_BUDGET']
+    if TIME_BUDGET != None:     # What's left after picking the warm start
+        TIME_BUDGET = max(0, TIME_BUDGET - (time.time() - job_start))
+
+    fit_kwargs = dict(
             batch_size=BATCH_SIZE, 
             max_epochs=MAX_EPOCHS, 
             lr=LR, 
             opt='Adam',         # Adam
             loss='BCE',         # BCE or MSE
-            patience=PATIENCE,        # Num epochs for early stopping
+            patience=PATIENCE,        # Num evaluations for early stopping
             eval=True,          # Eval training process with test data
+            eval_schedule=EvalSchedule(**app.config['AE_EVAL']),
             # plt_imgs=(N_TEST_IMGS, 10),         # (N_TEST_IMGS, plt_interval)
             scatter_plt=('umap', 10),           # ('method', plt_interval)
             output_dir=OUTPUT_DIR, 
-            save_model=True)        # Also saves dataset
+            save_model=True,        # Also saves dataset
+            log_policy=LogPolicy(**app.config['AE_LOG']),
+            checkpoint_every=app.config['AE_CHECKPOINT_EVERY'],
+            time_budget=TIME_BUDGET)     # Unfinished runs are carried on by resume_train
     
-    return BATCH_SIZE, LR, ae.EPOCH, OUTPUT_DIR
+    PROCESSES = app.config['AE_PROCESSES']
+    if PROCESSES > 1 and len(dataset.train) >= PROCESSES * BATCH_SIZE:
+        # Data parallel over local processes, rank 0 reports progress to this job
+        job = get_current_job()
+        result = fit_parallel(PROCESSES, AutoEncoder, dataset, fit_kwargs, 
+                            profile=CPUProfile(**app.config['AE_CPU_PROFILE']),
+                            warm_start=(WARM_START, WARM['freeze']) if WARM_START != None else None,
+                            job_id=job.get_id() if job != None else None,
+                            redis_url=app.config['REDIS_URL'], progress_rate=app.config['PROGRESS_RATE'])
+        if job != None:
+            job.refresh()   # Meta saved by rank 0
+        return BATCH_SIZE, LR, result['EPOCH'], OUTPUT_DIR, result['FINISHED']
+
+    ae = AutoEncoder(job=progress, profile=CPUProfile(**app.config['AE_CPU_PROFILE']))
+    if WARM_START != None:
+        ae.warm_start(WARM_START, freeze=WARM['freeze'])
+    ae.fit(dataset, **fit_kwargs)
+    return BATCH_SIZE, LR, ae.EPOCH, OUTPUT_DIR, ae.FINISHED
+
+def finetune_source(dataset, finetune):
+    # The latest trained models with the same layers are tried on a sample of the new bucket, the best
+    # is used if it reconstructs it within max_loss_ratio of the loss on the same size sample of its own
+    # test set, recorded when it was saved
+    #  Returns: output dir to warm start from, None to train from scratch
+    best, best_loss = None, None
+    for run in finished_runs(app.config['MODEL_OUTPUT_DIR'], 'ae')[:finetune['candidates']]:
+        ae = AutoEncoder()
+        if not compatible(run, ae.state_dict()):
+            continue
+        ae.load_model(run, tb=False)
+        if ae.TEST_LOSS == None:    # Saved before test losses were recorded
+            continue
+        loss = ae.recon_loss(dataset.train)
+        print('{} sample loss: {:.4f} test loss: {:.4f}'.format(os.path.basename(run), loss, ae.TEST_LOSS))
+        if loss <= ae.TEST_LOSS * finetune['max_loss_ratio'] and (best_loss == None or loss < best_loss):
+            best, best_loss = run, loss
+    return best
+
+def resume_train(output_dir):
+    # Next job of a run that used up its time budget, the dataset was saved with the checkpoint
+    return train(ImageBucket(output_dir=output_dir), output_dir=output_dir)
 
 
 
 def cluster(label):
-    job = get_current_job()
+    progress = Progress(get_current_job(), max_rate=app.config['PROGRESS_RATE'])
    
-    OUTPUT_DIR = app.config['OUTPUT_DIR']  # Returns the  OUTPUT DIR of the latest model by default
-    ae, feat_ae, labels, imgs = load_model(OUTPUT_DIR)
+    OUTPUT_DIR = latest_output_dir(app.config['MODEL_OUTPUT_DIR'])   # Per job, the worker outlives uploads
+    tb, epoch, feat_ae, imgs = load_model(OUTPUT_DIR)
     clear_output(OUTPUT_DIR)   # Clearing old output
     
     MIN_CLUSTER_SIZE = 15
@@ -144,14 +220,12 @@ def cluster(label):
     dim_reduce = 2
     dim_reduce_method = 'umap'  ## HDBSCAN suffers from curse of dimensionality 
 
-    job.meta['MIN_CLUSTER_SIZE'] = MIN_CLUSTER_SIZE
-    job.meta['progress_msg'] = 'Reducing features from {} to {} dims with {} ...'\
-                                .format(feat_ae.shape[1], dim_reduce, dim_reduce_method.upper())
-    job.save_meta()
+    progress.stage('Reducing features from {} to {} dims with {} ...'\
+                    .format(feat_ae.shape[1], dim_reduce, dim_reduce_method.upper()),
+                    MIN_CLUSTER_SIZE=MIN_CLUSTER_SIZE)
    
     print('Reducing feat from {} to {} dims with {} ...'
             .format(feat_ae.shape[1], dim_reduce, dim_reduce_method.upper()))
-    import time
     start = time.time()
     if dim_reduce_method=='tsne':
         feat = tsne(feat_ae, dim_reduce)  
@@ -167,17 +241,15 @@ def cluster(label):
     c_labels_set = set(c_labels)
     if -1 in c_labels_set: c_labels_set.remove(-1) # -1 is noise
     print('Found' , len(c_labels_set), 'clusters ...')
-    job.meta['NUM_CLUSTERS'] = len(c_labels_set)    
-    job.save_meta()
+    progress.update(force=True, NUM_CLUSTERS=len(c_labels_set))
     
     img_plt = plt_scatter(feat, c_labels, output_dir=OUTPUT_DIR, 
                 plt_name='_{}_{}.png'.format('hdbscan', dim_reduce_method), pltshow=False)
-    ae.tb.add_image(tag='_{}_{}'.format('hdbscan', dim_reduce_method), 
+    tb.add_image(tag='_{}_{}'.format('hdbscan', dim_reduce_method), 
                     img_tensor=img_plt, 
-                    global_step = ae.EPOCH, dataformats='HWC')
+                    global_step = epoch, dataformats='HWC')
                     
-    job.meta['progress_msg'] = 'Saving <b>[ {} ]</b> images ...'.format(imgs.shape[0])
-    job.save_meta()
+    progress.stage('Saving <b>[ {} ]</b> images ...'.format(imgs.shape[0]))
     print('Saving images to client/static/imgs...')
     if os.path.exists(app.config['IMG_DIR']): # Clearing img dir
         shutil.rmtree(app.config['IMG_DIR'])    
@@ -189,62 +261,90 @@ def cluster(label):
     np.save(os.path.join(OUTPUT_DIR, '_feat.npy'), feat)
     print('Saving c_labels ...')  
     np.save(os.path.join(OUTPUT_DIR, '_c_labels.npy'), c_labels)
+    print('Building cluster indexes ...')
+    build_indexes(feat, c_labels, OUTPUT_DIR)
+
+    if app.config['SOM_PRETRAIN']:  # Ready SOMs for every cluster so cluster switches don't train
+        progress.stage('Training <b>[ {} ]</b> self organising maps ...'.format(len(set(c_labels))))
+        pretrain_soms(feat, c_labels, app.config['SOM_DIMS'], OUTPUT_DIR, progress)
     
+    progress.update(force=True, **artifacts.stats())
     return feat, c_labels, imgs
 
 
 
-def som(img_idx, c_label, dims, som_mode, num_refresh):
+def som(img_idx, c_label, dims, som_mode, num_refresh, cell=None, speculative=False):
+    # speculative: nothing is saved, the state to save is returned as a third result for commit_som()
+    # once the grid is claimed, so an abandoned speculation doesn't move the SOM past unshown images
     img_idx = np.array(img_idx)
-    job = get_current_job()
-    job.meta['NUM_IMGS'] = len(img_idx)
-    job.save_meta()
+    progress = Progress(get_current_job(), max_rate=app.config['PROGRESS_RATE'])
+    progress.update(force=True, NUM_IMGS=len(img_idx))
     
-    OUTPUT_DIR = app.config['OUTPUT_DIR'] # returns the  OUTPUT DIR of the latest models by default
-    feat = np.load( os.path.join(OUTPUT_DIR, '_feat.npy'))
-    c_labels = np.load( os.path.join(OUTPUT_DIR, '_c_labels.npy'))
+    OUTPUT_DIR = latest_output_dir(app.config['MODEL_OUTPUT_DIR'])   # Per job, the worker outlives uploads
+    store = SOMStore(OUTPUT_DIR)
+    if som_mode == 'drill':     # Child SOM over one cell of the top level grid, keyed as its own c_label
+        c_label, img_idx, som_mode = drill(store, c_label, cell, img_idx, dims)
+        progress.update(force=True, CELL=cell, NUM_CELL_IMGS=len(img_idx))
+    if som_mode == 'queue':
+        queues = NeuronQueues.load(store, c_label, dims)
+        if len(img_idx) <= (dims[0]*dims[1]) or queues is None:
+            som_mode = 'update'     # Full retrain when img_idx getting sparse or no queues saved yet
+        else:   # No training, pop the next unprocessed image off every neuron's queue
+            img_grd_idx = queues.next_grid(img_idx)
+            pending = {'output_dir': OUTPUT_DIR, 'dims': dims, 'queue_head': queues.queue_head}
+            progress.update(force=True, MAX_ITER=0, LR=0)
+            if speculative:
+                return img_grd_idx, c_label, pending
+            commit_som(c_label, pending)
+            return img_grd_idx, c_label
+
+    feat = artifacts.load_npy(os.path.join(OUTPUT_DIR, '_feat.npy'))
+    c_labels = artifacts.load_npy(os.path.join(OUTPUT_DIR, '_c_labels.npy'))
      
     img_idx = np.array(img_idx)
-    lut = dict(enumerate(list(img_idx)))
     data = feat[img_idx]
     
-    som_path = os.path.join(OUTPUT_DIR, '_som_{}.npy'.format(c_label))
+    som_path = store.path(c_label)
+    if som_mode == 'incremental':
+        state = {name: store.load_array(c_label, name) for name in ['img_idx', 'bmu', 'bmu_dist']}
+        if len(img_idx) <= (dims[0]*dims[1]) or state['bmu'] is None:
+            som_mode = 'update'     # Full retrain when img_idx getting sparse or no BMU map saved yet
     if som_mode == 'new':  # Declare new SOM 
-        if len(img_idx) > 2000:
-            iter = 3000
-            lr = 0.2  
-        elif len(img_idx) > 1000:
-            iter = 2000
-            lr = 0.2  
-        elif len(img_idx) > (dims[0]*dims[1]):
-            iter = 1000
-            lr = 0.1
-        else:
-            iter = 500
-            lr = 0.1
-        som = SOM(data=data, dims=dims, n_iter = iter, lr_init=lr, job=job)
+        som = new_som(data, dims, job=progress)
+        iter, lr = som.N_ITER, som.LR_INIT
     elif som_mode == 'update': # Update net
         iter = 100
         lr = 0.001
         if len(img_idx) <= (dims[0]*dims[1]):   # Get whole grid when img_idx getting sparse
             iter = 500
             lr = 0.1
-        som = SOM(data=data, dims=dims, n_iter = iter, lr_init=lr, net_path=som_path, job=job)
+        som = SOM(data=data, dims=dims, n_iter = iter, lr_init=lr, net_path=som_path, job=progress)
     elif som_mode == 'switch':
         iter = 1
         lr = 0.0001 
-        som = SOM(data=data, dims=dims, n_iter = iter, lr_init=lr, net_path=som_path, job=job)
+        som = SOM(data=data, dims=dims, n_iter = iter, lr_init=lr, net_path=som_path, job=progress)
+    elif som_mode == 'incremental':   # Retrain only the neurons that lost images since the last run
+        iter = 100
+        lr = 0.01
+        som = SOM(data=data, dims=dims, n_iter = iter, lr_init=lr, net_path=som_path, job=progress)
     
-    job.meta['MAX_ITER'] = iter
-    job.meta['LR'] = lr
-    job.save_meta()
+    progress.update(force=True, MAX_ITER=iter, LR=lr)
 
     print('Ordering image grid with Self Organising Map {} {}...'.format(c_label, len(img_idx)))
     print('iter: {} lr: {}\n'.format(iter, lr))
-    net = som.train()
-    net_w = np.array([net[x, y, :] for x in range(net.shape[0]) for y in range(net.shape[1])])
-    img_grd_idx, _ = pairwise_distances_argmin_min(net_w, data)
-    img_grd_idx = np.array([lut[i] for i in img_grd_idx])   # Remapping to img_idx indices
+    if som_mode == 'incremental':
+        bmu, bmu_dist, changed = som.refresh(img_idx, state['img_idx'], state['bmu'], state['bmu_dist'])
+        print('Retrained {} neurons'.format(len(changed)))
+        progress.update(force=True, NUM_CHANGED=len(changed))
+        net = som.net
+    else:
+        net = som.train()
+        if som_mode != 'switch':
+            bmu, bmu_dist = som.bmu_all(data)
+    net_w = net.reshape(-1, net.shape[-1])
+    index = load_index(feat, c_labels, OUTPUT_DIR, c_label, cache=artifacts,    # KD-tree over the whole cluster
+                        members=store.load_array(c_label, 'members'))  # or the drilled cell
+    img_grd_idx = index.query(net_w, available=img_idx, unique=app.config['SOM_UNIQUE_GRID'])
 
     # if not os.path.exists(som_path):  
     # Plotting HDBSCAN SOM grid     
@@ -265,24 +365,130 @@ def som(img_idx, c_label, dims, som_mode, num_refresh):
         #                         img_tensor=make_grid(img_grd, nrow=dims[1]), 
         #                         global_step = ae.EPOCH)
 
-        print('Saving SOM weights ...')
-        som = {'net': net}
-        np.save(som_path, som)
+        pending = {'output_dir': OUTPUT_DIR, 'dims': dims, 'net': net, 'img_idx': img_idx, 'bmu': bmu, 'bmu_dist': bmu_dist}
+        if speculative:
+            progress.update(force=True, **artifacts.stats())
+            return img_grd_idx, c_label, pending
+        commit_som(c_label, pending)
                             
+    progress.update(force=True, **artifacts.stats())
     return img_grd_idx, c_label
 
 
 
+
+# Helper functions for som()
+def som_schedule(num_imgs):
+    # (iter, lr) for training a new SOM on num_imgs images, from the SOM_SCHEDULE table
+    # which benchmarks/som_sweep.py regenerates
+    for min_imgs, iter, lr in app.config['SOM_SCHEDULE']:
+        if num_imgs > min_imgs:
+            return iter, lr
+    return app.config['SOM_SCHEDULE'][-1][1:]
+
+def new_som(data, dims, job=None):
+    # SOM sized by SOM_SCHEDULE, trained coarse-to-fine with SOM_MULTIRES when that cuts the full size updates
+    # and stopped early once converged with SOM_CONVERGE, the schedule's iter being the max
+    iter, lr = som_schedule(len(data))
+    return scheduled_som(data, dims, iter, lr, init=app.config['SOM_INIT'], multires=app.config['SOM_MULTIRES'], 
+                            converge=app.config['SOM_CONVERGE'], job=job)
+
+def pretrain_soms(feat, c_labels, dims, output_dir, progress):
+    # Train a new SOM for every cluster in a process pool, each saved as soon as it's done
+    c_label_set = np.unique(c_labels)
+    wall = {}
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count(), len(c_label_set))) as pool:
+        futures = [pool.submit(pretrain_som, np.flatnonzero(c_labels==c_label), feat[c_labels==c_label], 
+                                int(c_label), dims, output_dir) 
+                    for c_label in c_label_set]
+        for future in as_completed(futures):
+            c_label, wall[c_label] = future.result()
+            print('Pretrained SOM {} in {:.2f}s'.format(c_label, wall[c_label]))
+            progress.update(NUM_PRETRAINED=len(wall))
+    total = time.time() - start
+    # Per-worker times ran side by side and contended for cores, their sum is not a serial baseline
+    print('Pretrained {} SOMs in {:.2f}s, {:.2f}s summed over workers'.format(len(wall), total, sum(wall.values())))
+    progress.update(force=True, PRETRAIN_WALL={str(c): round(t, 3) for c, t in wall.items()},
+                        PRETRAIN_TOTAL=round(total, 3), PRETRAIN_WORKER_SUM=round(sum(wall.values()), 3))
+
+def pretrain_som(img_idx, data, c_label, dims, output_dir):
+    start = time.time()
+    som = new_som(data, dims)
+    som.update_interval = som.N_ITER     # Only print the first iteration
+    net = som.train()
+    bmu, bmu_dist = som.bmu_all(data)
+    save_som(SOMStore(output_dir), c_label, net, img_idx, bmu, bmu_dist, dims)
+    return c_label, time.time() - start
+
+def drill(store, c_label, cell, img_idx, dims):
+    # Child of c_label over the images mapped near the cell, members are fixed when the child is trained
+    # so refreshes work on the same images. The parent is returned in 'switch' mode once they're all processed
+    #  Returns: (c_label, img_idx, som_mode) to run som() with
+    key = cell_key(c_label, cell)
+    members = store.load_array(key, 'members')
+    if members is None:
+        parent = {name: store.load_array(c_label, name) for name in ['img_idx', 'bmu']}
+        if parent['bmu'] is None:   # Nothing to drill into, the cluster grid is shown instead
+            return c_label, img_idx, 'switch' if store.exists(c_label) else 'new'
+        members = cell_members(parent['img_idx'], parent['bmu'], cell, dims, 
+                                min_imgs=dims[0]*dims[1]*app.config['SOM_DRILL_FILL'])
+        members = members[np.isin(members, img_idx)]
+        if len(members) == 0:
+            return c_label, img_idx, 'switch'
+        feat = artifacts.load_npy(os.path.join(store.output_dir, '_feat.npy'))
+        GridIndex(feat[members], members).save(index_path(store.output_dir, key))
+        store.save_array(key, 'members', members)
+        print('Drilling into cell {} of cluster {} with {} images'.format(cell, c_label, len(members)))
+        return key, members, 'new'
+    
+    available = members[np.isin(members, img_idx)]
+    if len(available) == 0:
+        return c_label, img_idx, 'switch'
+    return key, available, app.config['SOM_REFRESH_MODE']
+
+def commit_som(c_label, pending):
+    # Saves what a som() job left to save, queue heads or the retrained weights and BMU map, into the
+    # output dir the job ran on
+    store = SOMStore(pending['output_dir'])
+    if 'queue_head' in pending:
+        store.save_array(c_label, 'queue_head', pending['queue_head'])
+        return
+    print('Saving SOM weights ...')
+    save_som(store, c_label, pending['net'], pending['img_idx'], pending['bmu'], pending['bmu_dist'], pending['dims'])
+
+def save_som(store, c_label, net, img_idx, bmu, bmu_dist, dims):
+    # Weights plus the BMU map for 'incremental' refreshes and the neuron queues for 'queue' refreshes
+    store.save(c_label, net, img_idx=img_idx, bmu=bmu, bmu_dist=bmu_dist)
+    NeuronQueues.from_bmu(img_idx, bmu, bmu_dist, dims).save(store, c_label)
+
                             
 # Helper functions for cluster()
 def load_model(output_dir):
-    ae = AutoEncoder()  
+    # Features saved at train time while they match the weights, else the encoder is loaded to redo them
+    #  Returns: tb, epoch, feat, imgs
+    dataset = artifacts.get(os.path.join(output_dir, 'img_bucket.pt'), 
+                            lambda _: ImageBucket(output_dir=output_dir))
     # dataset = FilteredMNIST(output_dir=output_dir)
-    dataset = ImageBucket(output_dir=output_dir)
-    model_path = ae.load_model(output_dir=output_dir)
-    dataset.test += dataset.train   # Get all the data, eval_model loads dataset.test
-    _, feat, labels, imgs = ae.eval_model(dataset=dataset, output_dir=output_dir)
-    return ae, feat, labels, imgs
+    dataset = TensorDataset(*tensors_of(dataset.test + dataset.train))    # All the data, numbered test first
+    imgs = dataset.tensors[0]
+    feat, config = load_features(output_dir)
+    if feat is not None and len(feat) == len(dataset):
+        print('Loaded {} features saved at train time'.format(len(feat)))
+        return SummaryWriter(log_dir=config['tb_log_dir']), config['epoch'], feat, imgs
+
+    ae = artifacts.get(model_path(output_dir),     # .weights, or .pth for older models
+                        lambda _: _load_ae(output_dir))
+    print('Encoding {} images ...'.format(len(dataset)))
+    feat = ae.encode(dataset, path=os.path.join(output_dir, FEAT))     # Fixed order, encoder only
+    mark_features(output_dir, FEAT)
+    return ae.tb, ae.EPOCH, feat, imgs
+
+def _load_ae(output_dir):
+    ae = AutoEncoder(profile=CPUProfile(**app.config['AE_CPU_PROFILE']))  
+    ae.load_model(output_dir=output_dir, encoder_only=True)
+    ae.freeze()     # Inference only
+    return ae
 
 def umap(feat_ae, dim_reduce, min_cluster_size):
     umap = UMAP(n_components=dim_reduce, n_neighbors=min_cluster_size, min_dist=0.1,
@@ -8,14 +8,36 @@
 
 import numpy as np
 
+from server.utils.progress import Progress
+from server.model.utils.som_store import load_net
+from server.model.utils.early_stopping import EarlyStopping
 
 SEED = 489
 np.random.seed(SEED)
 
+ENGINES = ('vectorized', 'batch', 'loop')
+INITS = ('random', 'pca')
+RESERVOIR_SIZE = 1000   # Samples the convergence monitor measures quantization error on
+REFRESH_ITER = 10   # Incremental refresh iterations per removed image
+
 class SOM(object):
-    def __init__(self, data, dims, n_iter, lr_init, net_path=None, job=None):
+    def __init__(self, data, dims, n_iter, lr_init, net_path=None, job=None, engine='vectorized', init='random', 
+                    coarse=None, converge=None):
+        if engine not in ENGINES:
+            raise ValueError('engine ' + engine + ' is unknown!')
+        if init not in INITS:
+            raise ValueError('init ' + init + ' is unknown!')
+        self.ENGINE = engine
+        self.INIT = init
+        self.COARSE = coarse    # (dims, n_iter) of a small map trained first, then N_ITER only fine tunes
+        # (ordering share, check share, tol % QE improvement, patience checks) with N_ITER as the max, the
+        # radius shrinks to RADIUS_FINAL over the ordering share of N_ITER, then QE is checked every check
+        # share of N_ITER until it converges, so every schedule entry gets to the convergence phase
+        self.CONVERGE = converge
+        self.NUM_ITER_USED = 0
+        self.STOP_REASON = None
         self.DIMS = np.array(dims)
-        self.N_ITER = n_iter
+        self.N_ITER = n_iter    # num of epochs for the batch engine
         self.LR_INIT = lr_init
         # self.LR_FINAL = 0.0001
 
@@ -28,69 +50,271 @@ class SOM(object):
         # setup random weights between 0 and 1
         # init the weight matrix using a normal distribution with a small standard deviation
         self.net = np.random.normal(0, 0.1, size=(dims[0], dims[1], self.M))
+        if init == 'pca':   # or linearly along the first two principal components of the data
+            self.net = pca_init(data, dims)
         self.update_interval = 100
         if net_path != None: # Load net from file
             print('Loading SOM weights ... '+net_path)
-            self.net = np.load(net_path).item()['net']
+            self.net = load_net(net_path)   # memory-mapped float32, copied below
             self.update_interval = 10
+        self.net = np.ascontiguousarray(self.net, dtype=np.float64)
+
+        # (row, col) coordinates of every neuron, matching the row-major order of net.reshape(-1, M)
+        self.grid = np.indices((dims[0], dims[1])).reshape(2, -1).T
 
         # initial neighbourhood radius
         self.RADIUS_INIT = max(dims[0], dims[1]) / 2
         self.RADIUS_FINAL = 1
-        
+
         # radius decay parameter
         #  decays to 1 as radius_init*exp(-ln(radius_init)) = radius_init*(1/(radius_init)) = 1
-        self.RAD_DECAY = self.N_ITER / np.log(self.RADIUS_INIT)
+        self.ORDER_ITER = self.N_ITER if converge == None else max(1, int(converge[0] * self.N_ITER))
+        self.CHECK_EVERY = None if converge == None else max(1, int(converge[1] * self.N_ITER))
+        self.RAD_DECAY = self.ORDER_ITER / np.log(self.RADIUS_INIT)
         # self.LR_DECAY = self.N_ITER / np.log(self.LR_INIT/self.LR_FINAL)
 
-        # rq worker job
+        # rq worker job, meta updates are rate limited
         self.job = job
+        self.progress = Progress.wrap(job)
 
     def __repr__(self):
-        return '<SOM: {} N_ITER: {} LR_INIT: {}>'.format(self.DIMS, self.N_ITER, self.LR_INIT)
+        return '<SOM: {} N_ITER: {} LR_INIT: {} ENGINE: {} INIT: {}>'.format(self.DIMS, self.N_ITER, self.LR_INIT, 
+                                                                            self.ENGINE, self.INIT)
 
     def find_bmu(self, t, net, m):
         #  Find the best matching unit for a given vector, t, in the SOM
         #  Returns: a (bmu, bmu_idx) tuple where bmu is the high-dimensional BMU
         #                 and bmu_idx is the index of this vector in the SOM
-        bmu_idx = np.array([0, 0])
-        # set the initial minimum distance to a huge number
-        min_dist = np.iinfo(np.int).max
-        # calculate the distance between each neuron and the input
-        for x in range(net.shape[0]):
-            for y in range(net.shape[1]):
-                w = net[x, y, :].reshape(m, 1)
-                # don't bother with actual Euclidean distance, to avoid expensive sqrt operation
-                dist = np.sum((w - t) ** 2)
-                if dist < min_dist:
-                    min_dist = dist
-                    bmu_idx = np.array([x, y])
+        w = net.reshape(-1, m)
+        # don't bother with actual Euclidean distance, to avoid expensive sqrt operation
+        dist = np.sum((w - t.reshape(1, m)) ** 2, axis=1)
+        bmu_idx = np.array(np.unravel_index(np.argmin(dist), net.shape[:2]))
         # get vector corresponding to bmu_idx
         bmu = net[bmu_idx[0], bmu_idx[1], :].reshape(m, 1)
-        # return the (bmu, bmu_idx) tuple
-        
+
         return (bmu, bmu_idx)
 
+    def bmu_all(self, data, chunk_size=4096):
+        #  Find the BMU of every row in data, in chunks to bound the (chunk, neurons) distance matrix
+        #  Returns: (bmu, dist) where bmu is the flat neuron index and dist the Euclidean distance to it
+        w = self.net.reshape(-1, self.M)
+        w_sq = np.sum(w ** 2, axis=1)
+        w_t = -2 * w.T
+        bmu = np.empty(len(data), dtype=np.int64)
+        dist = np.empty(len(data), dtype=np.float64)
+        for start in range(0, len(data), chunk_size):
+            x = data[start:start+chunk_size]
+            # ||x - w||^2 = ||x||^2 - 2x.w + ||w||^2, ||x||^2 is constant per row so only added to the min
+            d = np.dot(x, w_t)
+            d += w_sq
+            idx = np.argmin(d, axis=1)
+            bmu[start:start+chunk_size] = idx
+            dist[start:start+chunk_size] = d[np.arange(len(x)), idx] + np.sum(x ** 2, axis=1)
+        return bmu, np.sqrt(np.maximum(dist, 0))
+
+    def quantization_error(self, data):
+        #  Mean distance between each sample and its BMU
+        _, dist = self.bmu_all(data)
+        return dist.mean()
+
+    def topographic_error(self, data, chunk_size=4096):
+        #  Fraction of samples whose first and second BMUs aren't neighbours on the grid
+        w = self.net.reshape(-1, self.M)
+        w_sq = np.sum(w ** 2, axis=1)
+        n_errors = 0
+        for start in range(0, len(data), chunk_size):
+            x = data[start:start+chunk_size]
+            d = w_sq[None, :] - 2 * np.dot(x, w.T)
+            top2 = np.argpartition(d, 1, axis=1)[:, :2]
+            grid_dist = np.abs(self.grid[top2[:, 0]] - self.grid[top2[:, 1]]).max(axis=1)
+            n_errors += np.sum(grid_dist > 1)
+        return n_errors / len(data)
 
     def train(self):
+        if self.COARSE != None:
+            self._init_coarse()
+        if self.ENGINE == 'batch':
+            return self._train_batch()
+        elif self.ENGINE == 'loop':
+            return self._train_loop()
+
+        w = self.net.reshape(-1, self.M)    # view, updates write through to self.net
+        samples = np.random.randint(0, self.N, size=self.N_ITER)
+        monitor = self._monitor()
         for i in range(self.N_ITER):
-            if self.job!=None:
-                self.job.meta['NUM_ITER'] = i
-                self.job.save_meta()
-            if i % self.update_interval == 0: 
+            self.progress.update(NUM_ITER=i)
+            if i % self.update_interval == 0:
                 print('Num iterations {}'.format(i))
+            if monitor(i):
+                break
+
+            # select a training example at random
+            t = self.data[samples[i], :]
+
+            # find its Best Matching Unit over the whole weight matrix at once
+            bmu = np.argmin(np.sum((w - t) ** 2, axis=1))
+
+            # decay the SOM parameters
+            radius = max(self.RADIUS_INIT * np.exp(-i / self.RAD_DECAY), self.RADIUS_FINAL)
+            lr = self.LR_INIT * np.exp(-i / self.N_ITER)
+
+            # gaussian influence of the BMU on every neuron within the radius on the 2-D grid
+            w_dist = np.sum((self.grid - self.grid[bmu]) ** 2, axis=1)
+            influence = np.exp(-w_dist / (2* (radius**2)))
+            influence[w_dist > radius**2] = 0
+
+            # new w = old w + (learning rate * influence * delta)
+            w += (lr * influence)[:, None] * (t - w)
+        else:
+            self._stop(self.N_ITER, 'max_iter')
+
+        self.progress.close()
+        return self.net
+
+    def _monitor(self):
+        #  Convergence check run every iteration of the online engine, after the ordering iters the QE of
+        #  a fixed sample reservoir is measured every CHECK_EVERY iterations and training stops when it hasn't
+        #  improved by tol % for patience checks
+        #  Returns: a function of the iteration, True when training should stop
+        if self.CONVERGE == None:
+            return lambda i: False
+        _, _, tol, patience = self.CONVERGE
+        reservoir = self.data[np.random.RandomState(SEED).permutation(self.N)[:RESERVOIR_SIZE]]
+        es = EarlyStopping(tol=tol, patience=patience, percentage=True, metric='Quantization error')
+        def monitor(i):
+            if i < self.ORDER_ITER or i % self.CHECK_EVERY != 0:
+                return False
+            _, dist = self.bmu_all(reservoir)
+            self.progress.update(QE=round(float(dist.mean()), 5))
+            if es.step(dist.mean()):
+                self._stop(i, 'converged')
+                return True
+            return False
+        return monitor
+
+    def _stop(self, num_iter, reason):
+        self.NUM_ITER_USED = num_iter
+        self.STOP_REASON = reason
+        print('Stopped after {} iterations, {}'.format(num_iter, reason))
+        self.progress.update(force=True, NUM_ITER_USED=num_iter, STOP_REASON=reason)
+
+    def refresh(self, img_idx, prev_idx, prev_bmu, prev_dist, iter_per_img=REFRESH_ITER, max_neurons=None):
+        #  Incremental update after images have been removed from the data since the last run.
+        #  Only the BMUs of the removed images are retrained, at most max_neurons of them (by default a
+        #  quarter of the map) picked by the share of their images they lost, for iter_per_img iterations
+        #  per removed image up to N_ITER. Only the samples assigned to them are remapped, so the cost
+        #  scales with the number of removed images rather than with N
+        #  Returns: (bmu, dist, changed) aligned with img_idx, changed being the retrained neurons
+        changed = np.empty(0, dtype=np.int64)
+        self.NUM_ITER_USED = 0
+        if len(prev_idx) == 0:      # No previous map to refresh
+            bmu, dist = self.bmu_all(self.data)
+            return bmu, dist, changed
+        sorter = np.argsort(prev_idx)
+        pos = np.searchsorted(prev_idx, img_idx, sorter=sorter)
+        pos = sorter[np.minimum(pos, len(prev_idx)-1)]
+        found = prev_idx[pos] == img_idx
+        bmu = np.where(found, prev_bmu[pos], -1)
+        dist = np.where(found, prev_dist[pos], np.inf)
+
+        removed = np.ones(len(prev_idx), dtype=bool)
+        removed[pos[found]] = False
+        num_removed = int(removed.sum())
+        if num_removed > 0:
+            n_neurons = self.DIMS[0] * self.DIMS[1]
+            lost, num_lost = np.unique(prev_bmu[removed], return_counts=True)
+            share = num_lost / np.bincount(prev_bmu, minlength=n_neurons)[lost]
+            max_neurons = max_neurons if max_neurons != None else max(1, n_neurons // 4)
+            changed = lost[np.argsort(-share, kind='stable')[:max_neurons]]
+            members = np.flatnonzero(np.isin(bmu, changed))
+            self.NUM_ITER_USED = min(self.N_ITER, iter_per_img * num_removed)
+            if len(members) > 0:
+                self._train_neurons(self.data[members], changed, self.NUM_ITER_USED)
+
+        subset = np.flatnonzero(np.isin(bmu, changed) | ~found)
+        if len(subset) > 0:
+            bmu[subset], dist[subset] = self.bmu_all(self.data[subset])
+        return bmu, dist, changed
+
+    def _init_coarse(self):
+        # Coarse-to-fine, a small map is ordered first and bilinearly interpolated up to DIMS, so the
+        # full size map is only fine tuned from a radius of about one coarse cell
+        coarse_dims, coarse_iter = self.COARSE
+        coarse = SOM(data=self.data, dims=coarse_dims, n_iter=coarse_iter, lr_init=self.LR_INIT, 
+                        engine='loop' if self.ENGINE == 'loop' else 'vectorized',    # batch orders a random init poorly
+                        init=self.INIT)
+        coarse.update_interval = coarse_iter + 1   # quiet
+        print('Training coarse SOM {} ...'.format(coarse))
+        self.net = np.ascontiguousarray(upsample(coarse.train(), self.DIMS))
+        self.RADIUS_INIT = max(2, max(self.DIMS[0] / coarse_dims[0], self.DIMS[1] / coarse_dims[1]))
+        self.RAD_DECAY = self.ORDER_ITER / np.log(self.RADIUS_INIT)
+
+    def _train_neurons(self, data, neurons, n_iter):
+        # Online updates with the final radius among the given neurons only, the rest of the map is
+        # neither searched nor moved
+        w = self.net.reshape(-1, self.M)
+        w_sub = w[neurons]
+        grid = self.grid[neurons]
+        radius = self.RADIUS_FINAL
+        samples = np.random.randint(0, len(data), size=n_iter)
+        for i in range(n_iter):
+            t = data[samples[i], :]
+            bmu = np.argmin(np.sum((w_sub - t) ** 2, axis=1))
+            lr = self.LR_INIT * np.exp(-i / n_iter)
+            w_dist = np.sum((grid - grid[bmu]) ** 2, axis=1)
+            influence = np.exp(-w_dist / (2* (radius**2)))
+            influence[w_dist > radius**2] = 0
+            w_sub += (lr * influence)[:, None] * (t - w_sub)
+        w[neurons] = w_sub
+
+    def _train_batch(self):
+        # Batch SOM, every epoch moves each neuron to the neighbourhood weighted mean
+        # of all the samples, so N_ITER is the num of epochs and LR_INIT is unused
+        w = self.net.reshape(-1, self.M)
+        n_neurons = w.shape[0]
+        grid_dist = np.sum((self.grid[:, None, :] - self.grid[None, :, :]) ** 2, axis=2)   # (neurons, neurons)
+        for i in range(self.N_ITER):
+            self.progress.update(NUM_ITER=i)
+            print('Num epochs {}'.format(i))
+
+            radius = self.RADIUS_INIT * np.exp(-i / self.RAD_DECAY)
+            h = np.exp(-grid_dist / (2* (radius**2)))
+            h[grid_dist > radius**2] = 0
+
+            bmu, _ = self.bmu_all(self.data)
+            counts = np.bincount(bmu, minlength=n_neurons)
+            sums = np.stack([np.bincount(bmu, weights=self.data[:, m], minlength=n_neurons)
+                                for m in range(self.M)], axis=1)
+            num = np.dot(h, sums)
+            den = np.dot(h, counts)
+            mask = den > 0      # neurons with no samples in their neighbourhood keep their weights
+            w[mask] = num[mask] / den[mask, None]
+        self._stop(self.N_ITER, 'max_iter')
+
+        self.progress.close()
+        return self.net
+
+    def _train_loop(self):
+        # Reference per-neuron implementation, kept for benchmarking against the array engines
+        monitor = self._monitor()
+        for i in range(self.N_ITER):
+            self.progress.update(NUM_ITER=i)
+            if i % self.update_interval == 0:
+                print('Num iterations {}'.format(i))
+            if monitor(i):
+                break
 
             # select a training example at random
             t = self.data[np.random.randint(0, self.N), :].reshape(np.array([self.M, 1]))
-   
+
             # find its Best Matching Unit
-            bmu, bmu_idx = self.find_bmu(t, self.net, self.M)
-            
+            bmu, bmu_idx = self._find_bmu_loop(t, self.net, self.M)
+
             # decay the SOM parameters
-            radius = self.RADIUS_INIT * np.exp(-i / self.RAD_DECAY)
+            radius = max(self.RADIUS_INIT * np.exp(-i / self.RAD_DECAY), self.RADIUS_FINAL)
             # print(radius)
             lr = self.LR_INIT * np.exp(-i / self.N_ITER)
-            
+
             # update weight vector to move closer to input
             # and move its neighbours in 2-D vector space closer
             # by a factor proportional to their 2-D distance from the BMU
@@ -100,15 +324,67 @@ class SOM(object):
                     # get the 2-D distance (again, not the actual Euclidean distance)
                     w_dist = np.sum((np.array([x, y]) - bmu_idx) ** 2)
                     # w_dist = np.sqrt(w_dist)
-                    
+
                     if w_dist <= radius**2:
                         # calculate the degree of influence (based on the 2-D distance)
                         influence = np.exp(-w_dist / (2* (radius**2)))
-                        
+
                         # new w = old w + (learning rate * influence * delta)
                         # where delta = input vector (t) - old w
                         new_w = w + (lr * influence * (t - w))
                         self.net[x, y, :] = new_w.reshape(1, self.M)
-        
+        else:
+            self._stop(self.N_ITER, 'max_iter')
+
+        self.progress.close()
         return self.net
-    
+
+    def _find_bmu_loop(self, t, net, m):
+        bmu_idx = np.array([0, 0])
+        # set the initial minimum distance to a huge number
+        min_dist = np.inf
+        # calculate the distance between each neuron and the input
+        for x in range(net.shape[0]):
+            for y in range(net.shape[1]):
+                w = net[x, y, :].reshape(m, 1)
+                dist = np.sum((w - t) ** 2)
+                if dist < min_dist:
+                    min_dist = dist
+                    bmu_idx = np.array([x, y])
+        bmu = net[bmu_idx[0], bmu_idx[1], :].reshape(m, 1)
+
+        return (bmu, bmu_idx)
+
+
+def scheduled_som(data, dims, n_iter, lr, init='random', multires=None, converge=None, job=None):
+    # SOM set up the way new SOMs are trained, coarse-to-fine with multires (coarse dims, coarse iter, fine iter)
+    # when that cuts the full size updates and stopped early with converge, n_iter being the max
+    coarse = None
+    if multires != None and n_iter > multires[2]:
+        coarse_dims, coarse_iter, n_iter = multires
+        coarse = (coarse_dims, coarse_iter)
+    return SOM(data=data, dims=dims, n_iter=n_iter, lr_init=lr, job=job, init=init, coarse=coarse, converge=converge)
+
+def pca_init(data, dims):
+    # Linear initialisation, the grid spans +-2 std devs of the first (cols) and second (rows)
+    # principal components around the data mean
+    mean = data.mean(axis=0)
+    eigval, eigvec = np.linalg.eigh(np.atleast_2d(np.cov(data - mean, rowvar=False)))
+    order = np.argsort(eigval)[::-1]
+    eigval, eigvec = np.maximum(eigval[order], 0), eigvec[:, order]
+    pc_cols = eigvec[:, 0] * 2 * np.sqrt(eigval[0])
+    pc_rows = eigvec[:, 1] * 2 * np.sqrt(eigval[1]) if len(eigval) > 1 else np.zeros_like(mean)
+    rows = np.linspace(-1, 1, dims[0])[:, None, None]
+    cols = np.linspace(-1, 1, dims[1])[None, :, None]
+    return mean + rows * pc_rows + cols * pc_cols
+
+def upsample(net, dims):
+    # Bilinear interpolation of a (rows, cols, M) net to (dims[0], dims[1], M), corners stay on corners
+    for axis, size in enumerate(dims):
+        n = net.shape[axis]
+        pos = np.linspace(0, n-1, size)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo+1, n-1)
+        w = (pos - lo).reshape([-1 if a == axis else 1 for a in range(3)])
+        net = np.take(net, lo, axis=axis) * (1-w) + np.take(net, hi, axis=axis) * w
+    return net
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Resumable per-epoch training checkpoints, so a training run can span several bounded rq jobs
+###
+
+import os
+import glob
+import json
+import random
+
+import numpy as np
+import torch
+
+from server.model.utils.weights import model_path
+
+CHECKPOINT = 'checkpoint.pt'
+WARM_START = 'warm_start.json'
+
+
+def checkpoint_path(output_dir):
+    return os.path.join(output_dir, CHECKPOINT)
+
+def save_checkpoint(output_dir, **state):
+    # Written to a temp file then renamed, a job killed mid-write keeps the previous checkpoint
+    state['rng'] = rng_state()
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    path = checkpoint_path(output_dir)
+    torch.save(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def load_checkpoint(output_dir):
+    #  Returns: the saved state with the RNGs restored, None without a checkpoint
+    path = checkpoint_path(output_dir)
+    if not os.path.exists(path):
+        return None
+    state = torch.load(path, map_location=lambda storage, loc: storage)
+    set_rng_state(state['rng'])
+    return state
+
+def remove_checkpoint(output_dir):
+    path = checkpoint_path(output_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+def save_warm_start(output_dir, choice):
+    # The warm start the first job of a run picked, so its resume_train jobs train the same way
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    path = os.path.join(output_dir, WARM_START)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(choice, f)
+    os.replace(path + '.tmp', path)
+
+def load_warm_start(output_dir):
+    #  Returns: {'source', 'freeze', 'max_epochs', 'lr', 'patience'} saved for the run, None without one
+    path = os.path.join(output_dir, WARM_START)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def unfinished_run(model_output_dir, model, label):
+    #  Returns: latest {model}_{label}_<timestamp> output dir holding a checkpoint but no saved model, else None
+    runs = glob.glob(os.path.join(model_output_dir, '{}_{}_*'.format(model, glob.escape(str(label)))))
+    runs = [d for d in runs if os.path.exists(checkpoint_path(d)) and model_path(d) == None]
+    return max(runs, key=os.path.getctime) if len(runs) > 0 else None
+
+def finished_runs(model_output_dir, model):
+    #  Returns: {model}_* output dirs with a model saved in the lean format, newest first
+    runs = [d for d in glob.glob(os.path.join(model_output_dir, '{}_*'.format(model)))
+                if (model_path(d) or '').endswith('.weights')]
+    return sorted(runs, key=os.path.getctime, reverse=True)
+
+def rng_state():
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# CPU execution settings for the autoencoders, tuned per host with benchmarks/ae_cpu.py
+###
+
+import contextlib
+
+import torch
+
+COMPILERS = (None, 'script', 'compile')
+
+
+class CPUProfile(object):
+    """Thread counts, bf16 autocast, compiled forward and fused inference for models running on cpu
+
+    threads / interop_threads: torch intra / inter-op pool sizes (None keeps torch's default)
+    bf16: run the forward under cpu autocast to bfloat16, only pays off on cpus with native bf16 (AVX512-BF16, AMX)
+    compile: 'script' runs the encoder and decoder as TorchScript, 'compile' through torch.compile
+    fuse: inference only models are frozen and optimised for inference, folding each Linear+ReLU into one
+          oneDNN op, the frozen copy no longer follows the weights so it's never used by fit()
+
+    bf16, 'compile' and fuse need torch 1.10, 2.0 and 1.8 respectively, on older torch (requirements.txt pins
+    1.2.0) they're ignored and the plain module runs.
+    """
+    def __init__(self, threads=None, interop_threads=None, bf16=False, compile=None, fuse=False):
+        if compile not in COMPILERS:
+            raise ValueError('compile ' + str(compile) + ' is unknown!')
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.bf16 = bf16
+        self.compile = compile
+        self.fuse = fuse
+        unsupported = [name for name, on, supported in [('bf16', bf16, hasattr(torch, 'autocast')),
+                                                        ('compile', compile == 'compile', hasattr(torch, 'compile')),
+                                                        ('fuse', fuse, hasattr(torch.jit, 'freeze'))]
+                        if on and not supported]
+        if len(unsupported) > 0:
+            print('{} ignored, not supported by torch {}'.format(', '.join(unsupported), torch.__version__))
+
+    def __repr__(self):
+        return '<CPUProfile threads: {} interop_threads: {} bf16: {} compile: {} fuse: {}>'.format(
+                self.threads, self.interop_threads, self.bf16, self.compile, self.fuse)
+
+    def apply_threads(self):
+        if self.threads != None:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads != None:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:    # Only settable before the first inter-op parallel work in the process
+                pass
+
+    def autocast(self):
+        if not self.bf16 or not hasattr(torch, 'autocast'):
+            return contextlib.nullcontext()
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+
+    def wrap(self, module):
+        #  Returns: callable sharing the module's parameters, so training through it updates the module
+        if self.compile == 'script':
+            return torch.jit.script(module)
+        if self.compile == 'compile' and hasattr(torch, 'compile'):
+            return torch.compile(module)
+        return module
+
+    def freeze(self, module):
+        #  Returns: frozen TorchScript copy of the module for inference, the module itself when fuse is off
+        if not self.fuse or not hasattr(torch.jit, 'freeze'):
+            return self.wrap(module)
+        module.eval()
+        frozen = torch.jit.freeze(torch.jit.script(module))
+        if not hasattr(torch.jit, 'optimize_for_inference'):
+            return frozen
+        try:
+            return torch.jit.optimize_for_inference(frozen)
+        except RuntimeError as e:  # No oneDNN in this torch build
+            print('Inference optimisation failed', e)
+            return frozen
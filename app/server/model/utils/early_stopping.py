@@ -10,8 +10,9 @@ import numpy as np
 
 
 class EarlyStopping(object):
-    def __init__(self, mode='min', tol=0, patience=10, percentage=False):
+    def __init__(self, mode='min', tol=0, patience=10, percentage=False, metric='Loss'):
         self.mode = mode
+        self.metric = metric    # Name in the no improvement message
         self.tol = tol
         self.patience = patience
         self.best = None
@@ -36,7 +37,7 @@ class EarlyStopping(object):
             self.best = metrics
         else:
             self.num_bad_epochs += 1
-            print('Loss did not improve from {:.6f} for {} epochs\n'.format(metrics, self.num_bad_epochs))
+            print('{} did not improve from {:.6f} for {} evaluations\n'.format(self.metric, metrics, self.num_bad_epochs))
 
         if self.num_bad_epochs >= self.patience:
             return True
@@ -57,4 +58,11 @@ class EarlyStopping(object):
                             best * tol / 100)
             if mode == 'max':
                 self.is_better = lambda a, best: a > best + (
-                            best * tol / 100)
\ No newline at end of file
+                            best * tol / 100)
+
+    def state_dict(self):
+        return {'best': self.best, 'num_bad_epochs': self.num_bad_epochs}
+
+    def load_state_dict(self, state):
+        self.best = state['best']
+        self.num_bad_epochs = state['num_bad_epochs']
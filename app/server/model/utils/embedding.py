@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Embeddings streamed to disk chunk by chunk instead of concatenated in memory
+###
+
+import os
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+from server.utils.datasets.batch_loader import tensors_of
+
+SEED = 489
+
+
+def sample_idx(n, sample=None, seed=SEED):
+    #  Returns: sorted row indexes of a fixed random sample of n rows, all rows when sample is None or >= n
+    if sample == None or sample >= n:
+        return torch.arange(n)
+    g = torch.Generator().manual_seed(seed)
+    return torch.randperm(n, generator=g)[:sample].sort()[0]
+
+def iter_rows(dataset, idx=None, batch_size=1024):
+    # (imgs, labels) batches of the dataset rows idx in order, every row when idx is None. Sliced or
+    # gathered from the backing tensors when in memory
+    tensors = tensors_of(dataset)
+    n = len(dataset) if idx is None else len(idx)
+    for start in range(0, n, batch_size):
+        if idx is None and tensors != None:
+            yield tuple(t[start:start+batch_size] for t in tensors)
+            continue
+        chunk = torch.arange(start, min(start+batch_size, n)) if idx is None else idx[start:start+batch_size]
+        if tensors != None:
+            yield tuple(t.index_select(0, chunk) for t in tensors)
+        else:
+            yield default_collate([dataset[int(i)] for i in chunk])
+
+
+class EmbeddingWriter(object):
+    """Writes the rows of named arrays e.g. feat, labels, imgs chunk by chunk into <path>/<name>.npy
+
+    Each array is a preallocated .npy memmap of num_rows, shaped and typed by its first chunk, so only
+    one chunk is held in memory at a time. Read them back with load_embedding(path).
+    """
+    def __init__(self, path, num_rows):
+        self.path = path
+        self.num_rows = num_rows
+        self.arrays = {}
+        self.num_written = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def __repr__(self):
+        return '<EmbeddingWriter {} {}/{} rows {}>'.format(self.path, self.num_written, self.num_rows, list(self.arrays))
+
+    def write(self, **chunks):
+        n = None
+        for name, chunk in chunks.items():
+            chunk = chunk.detach().cpu().numpy() if isinstance(chunk, torch.Tensor) else np.asarray(chunk)
+            if name not in self.arrays:
+                self.arrays[name] = np.lib.format.open_memmap(os.path.join(self.path, name + '.npy'), mode='w+',
+                                        dtype=chunk.dtype, shape=(self.num_rows,) + chunk.shape[1:])
+            self.arrays[name][self.num_written:self.num_written+len(chunk)] = chunk
+            n = len(chunk)
+        self.num_written += n if n != None else 0
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = {}
+
+
+def load_embedding(path, mmap_mode='r'):
+    #  Returns: {name: array} of the arrays written by an EmbeddingWriter, memory mapped by default
+    return {f[:-4]: np.load(os.path.join(path, f), mmap_mode=mmap_mode)
+                for f in sorted(os.listdir(path)) if f.endswith('.npy')}
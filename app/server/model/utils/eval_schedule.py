@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Which epochs fit() evaluates on and how much of the test set, so training time goes to gradient steps
+###
+
+from types import SimpleNamespace
+
+from torch.utils.data import TensorDataset, Subset
+
+from server.utils.datasets.batch_loader import tensors_of
+from server.model.utils.embedding import sample_idx
+
+SEED = 489
+
+
+class EvalSchedule(object):
+    """Evaluation every `every` epochs on a fixed random sample of dataset.test
+
+    The last epoch and the plt_imgs / scatter_plt epochs are always evaluated. Early stopping steps once
+    per evaluation, so its patience counts evaluations, not epochs. sample=None evaluates the whole test
+    set, plot_sample caps the points the UMAP / t-SNE scatter plot is fit on.
+    """
+    def __init__(self, every=1, sample=None, plot_sample=5000, seed=SEED):
+        if every < 1:
+            raise ValueError('every ' + str(every) + ' must be at least 1')
+        self.every = every
+        self.sample = sample
+        self.plot_sample = plot_sample
+        self.seed = seed
+
+    def __repr__(self):
+        return '<EvalSchedule every: {} sample: {} plot_sample: {}>'.format(self.every, self.sample, self.plot_sample)
+
+    def due(self, epoch, max_epochs, intervals=()):
+        # intervals: plot intervals of the epoch, None when that plot is off
+        return epoch % self.every == 0 or epoch == max_epochs \
+                or any(interval != None and epoch % interval == 0 for interval in intervals)
+
+    def eval_dataset(self, dataset):
+        #  Returns: dataset with .test cut down to the sample, the same rows every evaluation
+        if self.sample == None or self.sample >= len(dataset.test):
+            return dataset
+        idx = sample_idx(len(dataset.test), self.sample, seed=self.seed)
+        tensors = tensors_of(dataset.test)
+        if tensors != None:     # Gathered once so batches are still sliced from tensors
+            test = TensorDataset(*(t.index_select(0, idx) for t in tensors))
+        else:
+            test = Subset(dataset.test, idx.tolist())
+        return SimpleNamespace(train=dataset.train, test=test)
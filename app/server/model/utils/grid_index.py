@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Per-cluster KD-tree for mapping SOM neurons back to images
+###
+
+import os
+import pickle
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+BRUTE_FORCE_MAX = 4096  # Free images below which unfilled neurons are matched by exact distances
+LIVE_MIN = 0.5  # Share of the searched tree still available below which it's rebuilt over the available images
+
+
+class GridIndex(object):
+    def __init__(self, feat, img_idx, leaf_size=40):
+        self.img_idx = np.asarray(img_idx)     # full tree row -> img_idx, ascending
+        self.leaf_size = leaf_size
+        self.full_tree = KDTree(feat, leaf_size=leaf_size)
+        self._reset()
+
+    def __repr__(self):
+        return '<GridIndex {} Images {} searched>'.format(len(self.img_idx), len(self.rows))
+
+    def __len__(self):
+        return len(self.img_idx)
+
+    def __getstate__(self):     # The compacted tree is rebuilt per process
+        return {'img_idx': self.img_idx, 'leaf_size': self.leaf_size, 'full_tree': self.full_tree}
+
+    def __setstate__(self, state):
+        self.img_idx = state['img_idx']
+        self.leaf_size = state.get('leaf_size', 40)
+        self.full_tree = state['full_tree'] if 'full_tree' in state else state['tree']  # Saved before compaction
+        self._reset()
+
+    def _reset(self):
+        # Searches start on the tree over every image and are compacted as images get processed
+        self.tree = self.full_tree
+        self.rows = np.arange(len(self.img_idx))    # searched tree row -> full tree row
+
+    def _compact(self, live):
+        # Rebuilt over the live rows only, so searches don't wade through processed images
+        self.tree = KDTree(np.asarray(self.full_tree.data)[live], leaf_size=self.leaf_size)
+        self.rows = live
+
+    def _rows(self, available):
+        #  Returns: full tree rows of the available img_idx, every row when None
+        if available is None:
+            return np.arange(len(self.img_idx))
+        available = np.asarray(available, dtype=self.img_idx.dtype)
+        pos = np.minimum(np.searchsorted(self.img_idx, available), len(self.img_idx)-1)
+        rows = pos[self.img_idx[pos] == available]
+        return rows if np.all(rows[1:] > rows[:-1]) else np.unique(rows)   # img_idx usually comes sorted
+
+    def query(self, net_w, available=None, unique=True, k=8):
+        #  Nearest available image to each neuron, with unique=True a neuron takes the nearest
+        #  image not already taken, neurons closest to an image get first pick
+        #  Returns: img_idx of the image shown in each grid cell, in net_w order
+        return self.query_many(net_w, [available], unique=unique, k=k)[0]
+
+    def query_many(self, net_w, availables, unique=True, k=8):
+        #  query() for several available sets against the same neurons, e.g. concurrent requests
+        #  for one cluster, sharing a single KD-tree search. The searched tree is rebuilt over the available
+        #  images once under LIVE_MIN of its points are, so a search costs O(G log A) rather than growing
+        #  towards O(N) as the cluster gets processed
+        #  Returns: a list of img_idx grids, one per available set
+        wanted = [self._rows(available) for available in availables]
+        if any(len(rows) == 0 for rows in wanted):
+            raise ValueError('no available images to assign')
+        live = wanted[0] if len(wanted) == 1 else np.unique(np.concatenate(wanted))
+        pos = np.minimum(np.searchsorted(self.rows, live), len(self.rows)-1)
+        if not np.all(self.rows[pos] == live) or len(live) < LIVE_MIN * len(self.rows):
+            self._compact(live)
+        k = min(k, len(self.rows))
+        dist, cand = self.tree.query(net_w, k=k)
+        return [self._assign(net_w, dist, cand, np.searchsorted(self.rows, rows), unique, k) for rows in wanted]
+
+    def _assign(self, net_w, dist, cand, available, unique, k):
+        # available: searched tree rows, cand are searched tree rows too
+        mask = np.zeros(len(self.rows), dtype=bool)
+        mask[available] = True
+        unique = unique and len(available) >= len(net_w)  # Duplicates can't be avoided when sparse
+
+        rows = np.full(len(net_w), -1, dtype=np.int64)
+        todo = np.arange(len(net_w))
+        while len(todo) > 0:
+            if dist is None:    # Search again for the neurons still without an image
+                free = np.flatnonzero(mask)
+                if len(free) <= BRUTE_FORCE_MAX:    # Exact distances to the few images left beat widening k
+                    d = np.sum((net_w[todo, None, :] - np.asarray(self.tree.data)[free][None, :, :]) ** 2, axis=2)
+                    order = np.argsort(d, axis=1)
+                    dist, cand = np.take_along_axis(d, order, axis=1), free[order]
+                    k = len(self.rows)   # Every free image is a candidate, last round
+                else:
+                    dist, cand = self.tree.query(net_w[todo], k=k)
+            for i in np.argsort(dist[:, 0], kind='stable'):
+                for row in cand[i]:
+                    if mask[row]:
+                        rows[todo[i]] = row
+                        if unique:
+                            mask[row] = False
+                        break
+            todo = np.flatnonzero(rows == -1)
+            if k == len(self.rows):
+                break
+            k = min(k*4, len(self.rows))
+            dist = None
+        return self.img_idx[self.rows[rows]]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def index_path(output_dir, c_label):
+    return os.path.join(output_dir, '_index_{}.pkl'.format(c_label))
+
+def build_indexes(feat, c_labels, output_dir):
+    for c_label in np.unique(c_labels):
+        img_idx = np.flatnonzero(c_labels == c_label)
+        GridIndex(feat[img_idx], img_idx).save(index_path(output_dir, c_label))
+
+def load_index(feat, c_labels, output_dir, c_label, cache=None, members=None):
+    # Built on first use for outputs clustered before the indexes were saved. c_label is kept a string
+    # key, drill keys like '3_cell12' are rebuilt from their members
+    path = index_path(output_dir, c_label)
+    if os.path.exists(path):
+        return cache.get(path, GridIndex.load) if cache != None else GridIndex.load(path)
+    if members is not None:
+        img_idx = np.sort(members)
+    else:
+        img_idx = np.flatnonzero(np.asarray(c_labels).astype(str) == str(c_label))
+    index = GridIndex(feat[img_idx], img_idx)
+    index.save(path)
+    return index
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Data parallel fit() across local processes, gradients all-reduced over torch.distributed gloo
+###
+
+import time
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+from server.utils.datasets.batch_loader import batch_loader, ShardedBatchLoader
+from server.model.utils.tb_log import LogPolicy, NullWriter
+from server.model.utils.cpu_profile import CPUProfile
+
+SEED = 489
+
+
+class SingleProcess(object):
+    """What fit() calls on a DataParallel, for the usual one process run"""
+    rank = 0
+    world_size = 1
+    is_main = True
+
+    def __repr__(self):
+        return '<SingleProcess>'
+
+    def loader(self, dataset, batch_size):
+        return batch_loader(dataset, batch_size=batch_size, shuffle=True)
+
+    def broadcast(self, module):
+        pass
+
+    def all_reduce_grads(self, params):
+        pass
+
+    def sum(self, value):
+        return value
+
+    def decide(self, flag):
+        return flag
+
+
+class DataParallel(SingleProcess):
+    """One of world_size processes training the same model on its own shard of dataset.train
+
+    Every rank keeps a full replica, gradients are averaged after each backward so the replicas take the
+    same optimizer steps. Rank 0 alone evaluates, logs, reports progress and writes checkpoints and the
+    model, its stop decisions are broadcast so every rank leaves the epoch loop together.
+    """
+    def __init__(self, rank, world_size, seed=SEED):
+        self.rank = rank
+        self.world_size = world_size
+        self.is_main = rank == 0
+        self.seed = seed
+
+    def __repr__(self):
+        return '<DataParallel rank {}/{}>'.format(self.rank, self.world_size)
+
+    def loader(self, dataset, batch_size):
+        # The global batch is split over the ranks, so the steps match a one process run of batch_size
+        return ShardedBatchLoader(dataset, max(1, batch_size // self.world_size), self.rank, self.world_size,
+                                    seed=self.seed)
+
+    def broadcast(self, module):
+        # Replicas start from rank 0's weights
+        for tensor in module.state_dict().values():
+            dist.broadcast(tensor, 0)
+
+    def all_reduce_grads(self, params):
+        # One flat all-reduce of every gradient instead of one per layer
+        grads = [p.grad for p in params if p.grad != None]
+        flat = _flatten_dense_tensors(grads)
+        dist.all_reduce(flat)
+        flat /= self.world_size
+        for grad, reduced in zip(grads, _unflatten_dense_tensors(flat, grads)):
+            grad.copy_(reduced)
+
+    def sum(self, value):
+        t = torch.tensor([value], dtype=torch.float64)
+        dist.all_reduce(t)
+        return t.item()
+
+    def decide(self, flag):
+        #  Returns: rank 0's flag on every rank
+        t = torch.tensor([int(bool(flag))])
+        dist.broadcast(t, 0)
+        return bool(t.item())
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def fit_parallel(world_size, model_cls, dataset, fit_kwargs, profile=None, warm_start=None,
+                    job_id=None, redis_url=None, progress_rate=4, tb=True):
+    # Spawns world_size local processes each running model_cls().fit(dataset, **fit_kwargs) on a shard of
+    # dataset.train, the cpu threads are split between them. Rank 0 reports to the rq job job_id.
+    # warm_start: (output_dir, freeze) applied on every rank before fit, tb=False logs nothing
+    #  Returns: {'EPOCH', 'FINISHED', 'FIT_TIME'} of rank 0
+    profile = profile if profile != None else CPUProfile()
+    threads = profile.threads if profile.threads != None else torch.get_num_threads()
+    profile = CPUProfile(threads=max(1, threads // world_size), interop_threads=1,
+                        bf16=profile.bf16, compile=profile.compile, fuse=profile.fuse)
+    ctx = mp.get_context('spawn')
+    results = ctx.SimpleQueue()
+    address = ('127.0.0.1', free_port())
+    mp.spawn(_fit_worker, nprocs=world_size, join=True,
+             args=(world_size, address, model_cls, dataset, fit_kwargs, profile, warm_start,
+                    job_id, redis_url, progress_rate, tb, results))
+    return results.get()
+
+def _fit_worker(rank, world_size, address, model_cls, dataset, fit_kwargs, profile, warm_start,
+                    job_id, redis_url, progress_rate, tb, results):
+    dist.init_process_group('gloo', init_method='tcp://{}:{}'.format(*address), rank=rank, world_size=world_size)
+    try:
+        job = None
+        if rank == 0 and job_id != None:    # Progress merged into the one rq job
+            from redis import Redis
+            from rq.job import Job
+            from server.utils.progress import Progress
+            job = Progress(Job.fetch(job_id, connection=Redis.from_url(redis_url)), max_rate=progress_rate)
+        model = model_cls(job=job, profile=profile)
+        if warm_start != None:
+            model.warm_start(*warm_start)
+        fit_kwargs = dict(fit_kwargs)
+        if rank != 0 or not tb:
+            model.tb = NullWriter()
+            fit_kwargs['log_policy'] = LogPolicy(scalars=0, histograms=0, images=0, embeddings=0, embed_sample=0)
+        if rank != 0:
+            fit_kwargs.update(eval=False, plt_imgs=None, scatter_plt=None, save_model=False)
+        start = time.time()
+        model.fit(dataset, parallel=DataParallel(rank, world_size), **fit_kwargs)
+        if rank == 0:
+            if job != None:
+                job.close()
+            results.put({'EPOCH': model.EPOCH, 'FINISHED': model.FINISHED, 'FIT_TIME': time.time() - start})
+    finally:
+        dist.destroy_process_group()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Drill-down child SOMs over the images of one cell of a cluster's top level grid
+###
+
+import numpy as np
+
+
+def cell_key(c_label, cell):
+    # SOMStore and GridIndex key of the child SOM, _som_{c_label}_cell{cell}.* is removed with the parent
+    return '{}_cell{}'.format(c_label, cell)
+
+def cell_members(img_idx, bmu, cell, dims, min_imgs):
+    #  Images whose BMU is the cell, grown by rings of neighbouring cells on the grid until there are
+    #  at least min_imgs so a child grid isn't mostly duplicates
+    #  Returns: img_idx of the child SOM's images, sorted
+    grid = np.indices((dims[0], dims[1])).reshape(2, -1).T
+    ring = np.abs(grid - grid[cell]).max(axis=1)    # Chebyshev distance of every cell to the drilled cell
+    img_ring = ring[bmu]
+    for r in range(max(dims)):
+        members = img_idx[img_ring <= r]
+        if len(members) >= min_imgs:
+            break
+    return np.sort(members)
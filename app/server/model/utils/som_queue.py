@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Per-neuron queues of images ordered by distance, for grid refreshes without SOM training
+###
+
+import numpy as np
+
+
+class NeuronQueues(object):
+    """Every image in the BMU map queued on its BMU, closest first
+
+        queue       img_idx sorted by (bmu, dist)
+        queue_ptr   neuron g owns queue[queue_ptr[g]:queue_ptr[g+1]]
+        queue_head  position of the first image of each queue that may still be unprocessed
+    """
+    def __init__(self, queue, queue_ptr, queue_head, dims):
+        self.queue = np.asarray(queue)
+        self.queue_ptr = np.asarray(queue_ptr)
+        self.queue_head = np.array(queue_head)    # Writable copy, heads move on every refresh
+        self.grid = np.indices((dims[0], dims[1])).reshape(2, -1).T
+
+    def __repr__(self):
+        return '<NeuronQueues {} Neurons {} Images>'.format(len(self.queue_ptr)-1, len(self.queue))
+
+    @classmethod
+    def from_bmu(cls, img_idx, bmu, bmu_dist, dims):
+        order = np.lexsort((bmu_dist, bmu))
+        queue_ptr = np.searchsorted(bmu[order], np.arange(dims[0]*dims[1]+1))
+        return cls(np.asarray(img_idx)[order], queue_ptr, queue_ptr[:-1], dims)
+
+    @classmethod
+    def load(cls, store, c_label, dims):
+        arrays = [store.load_array(c_label, name) for name in ['queue', 'queue_ptr', 'queue_head']]
+        if any(a is None for a in arrays):
+            return None
+        return cls(*arrays, dims=dims)
+
+    def save(self, store, c_label, heads_only=False):
+        if heads_only:
+            store.save_array(c_label, 'queue_head', self.queue_head)
+            return
+        for name in ['queue', 'queue_ptr', 'queue_head']:
+            store.save_array(c_label, name, getattr(self, name))
+
+    def next_grid(self, img_idx):
+        #  Front of every neuron's queue after skipping processed images, neurons whose queue has run
+        #  out borrow from the nearest neurons on the grid
+        #  Returns: img_idx of the image shown in each grid cell, in row-major neuron order
+        available = np.isin(self.queue, img_idx)
+        taken = np.zeros(len(self.queue), dtype=bool)
+        n_neurons = len(self.queue_ptr) - 1
+        cells = np.full(n_neurons, -1, dtype=np.int64)
+        for g in range(n_neurons):
+            head, end = self.queue_head[g], self.queue_ptr[g+1]
+            while head < end and not available[head]:
+                head += 1
+            self.queue_head[g] = head
+            if head < end:
+                cells[g] = head
+                taken[head] = True
+
+        for g in np.flatnonzero(cells == -1):
+            grid_dist = np.abs(self.grid - self.grid[g]).sum(axis=1)
+            for n in np.argsort(grid_dist, kind='stable'):
+                pos = np.arange(self.queue_head[n], self.queue_ptr[n+1])
+                free = pos[available[pos] & ~taken[pos]]
+                if len(free) > 0:
+                    cells[g] = free[0]
+                    taken[free[0]] = True
+                    break
+        if np.any(cells == -1):     # Fewer images left than cells
+            cells[cells == -1] = np.resize(cells[cells != -1], np.sum(cells == -1))
+        return self.queue[cells]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# SOM checkpoints as raw float32 .npy weights plus a JSON counters sidecar
+###
+
+import os
+import glob
+import json
+import tempfile
+
+import numpy as np
+
+from server.model.utils.grid_index import index_path
+from server.model.utils.som_drill import cell_key
+
+# path -> (mtime_ns, size, value), shared by every SOMStore in the process
+_cache = {}
+
+
+class SOMStore(object):
+    """Per-cluster SOM state in output_dir
+
+        _som_{c_label}.npy          weights (rows, cols, M) float32, memory-mapped on read
+        _som_{c_label}_{name}.npy   extra arrays e.g. the BMU map
+        _som_{c_label}.json         NUM_IMGS, NUM_FILTERED, NUM_REFRESH, DIMS
+        _som_{c_label}_cell{n}*     child SOM drilled into cell n, removed with its parent
+
+    Every file is written to a temp file and renamed into place, so readers never see a partial write.
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def __repr__(self):
+        return '<SOMStore {}>'.format(self.output_dir)
+
+    def path(self, c_label, name=None, ext='.npy'):
+        if name is None:
+            return os.path.join(self.output_dir, '_som_{}{}'.format(c_label, ext))
+        return os.path.join(self.output_dir, '_som_{}_{}{}'.format(c_label, name, ext))
+
+    def exists(self, c_label):
+        return os.path.exists(self.path(c_label))
+
+    def load_net(self, c_label):
+        return load_net(self.path(c_label))
+
+    def load_array(self, c_label, name):
+        path = self.path(c_label, name)
+        if not os.path.exists(path):
+            return None
+        return _read(path, lambda p: np.load(p, mmap_mode='r'))
+
+    def load_counters(self, c_label):
+        path = self.path(c_label, ext='.json')
+        if not os.path.exists(path):
+            return {}
+        return dict(_read(path, _load_json))
+
+    def save(self, c_label, net, **arrays):
+        _atomic_save(self.path(c_label), np.asarray(net, dtype=np.float32))
+        for name, array in arrays.items():
+            self.save_array(c_label, name, array)
+
+    def save_array(self, c_label, name, array):
+        _atomic_save(self.path(c_label, name), np.asarray(array))
+
+    def save_counters(self, c_label, **counters):
+        path = self.path(c_label, ext='.json')
+        merged = self.load_counters(c_label)
+        merged.update(counters)
+        with _atomic_open(path, 'w') as f:
+            json.dump(merged, f)
+
+    def remove(self, c_label):
+        # The child SOMs drilled from the grid go too, _som_{c_label}_cell{n}* and their _index_{c_label}_cell{n}.pkl,
+        # their members came from this SOM's BMU map
+        paths = glob.glob(self.path(c_label, ext='.*')) + glob.glob(self.path(c_label, '*', ext='.*'))
+        paths += glob.glob(index_path(self.output_dir, cell_key(glob.escape(str(c_label)), '*')))
+        for path in paths:
+            os.remove(path)
+            _cache.pop(path, None)
+
+
+def clear_cache():
+    # Drops every cached SOM, e.g. once the output dir they were read from is no longer the latest
+    _cache.clear()
+
+def load_net(path):
+    def loader(p):
+        try:
+            return np.load(p, mmap_mode='r')
+        except ValueError:  # Pickled {'net': net} dict from before the store
+            return np.load(p, allow_pickle=True).item()['net']
+    return _read(path, loader)
+
+def _read(path, loader):
+    st = os.stat(path)
+    cached = _cache.get(path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    value = loader(path)
+    _cache[path] = (st.st_mtime_ns, st.st_size, value)
+    return value
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _atomic_save(path, array):
+    with _atomic_open(path, 'wb') as f:
+        np.save(f, array)
+
+class _atomic_open(object):
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp_')
+        self.f = os.fdopen(fd, self.mode)
+        return self.f
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
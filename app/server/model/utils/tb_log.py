@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# What TensorBoard logs when during training, written from a background thread
+###
+
+import queue
+import threading
+
+import torch
+
+CATEGORIES = ('scalars', 'histograms', 'images', 'embeddings')
+
+
+class LogPolicy(object):
+    """Epoch intervals per TensorBoard category, 0 turns a category off
+
+    scalars: train and test loss, histograms: weights and gradients, images: batch, scatter and decoded
+    images, embeddings: projector embedding of embed_sample training images (None for all). The embedding
+    is written once training ends, and every embeddings epochs when not 0. embed_sample=0 turns it off.
+    """
+    def __init__(self, scalars=1, histograms=10, images=10, embeddings=0, embed_sample=5000):
+        self.scalars = scalars
+        self.histograms = histograms
+        self.images = images
+        self.embeddings = embeddings
+        self.embed_sample = embed_sample
+
+    def __repr__(self):
+        return '<LogPolicy {} embed_sample: {}>'.format(
+                ' '.join('{}: {}'.format(c, getattr(self, c)) for c in CATEGORIES), self.embed_sample)
+
+    def due(self, category, epoch):
+        interval = getattr(self, category)
+        return self.enabled(category) and interval != 0 and epoch % interval == 0
+
+    def enabled(self, category):
+        if category == 'embeddings':
+            return self.embed_sample != 0
+        return getattr(self, category) != 0
+
+
+class AsyncWriter(object):
+    """SummaryWriter proxy whose add_* calls run on a background thread
+
+    Tensors are detached and copied to the cpu when the call is made, so training can keep updating
+    the weights while histograms are binned and events serialised. At most max_pending calls are
+    queued before add_* blocks. flush() waits for everything queued so far.
+    """
+    def __init__(self, writer, max_pending=256):
+        self.writer = writer
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.errors = 0
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return '<AsyncWriter {} pending: {} errors: {}>'.format(self.log_dir, self.pending.qsize(), self.errors)
+
+    @classmethod
+    def wrap(cls, writer, **kwargs):
+        if isinstance(writer, (cls, NullWriter)):
+            return writer
+        return cls(writer, **kwargs)
+
+    @property
+    def log_dir(self):
+        return self.writer.log_dir
+
+    def __getattr__(self, name):
+        # add_scalar, add_histogram, add_image(s), add_embedding, ... are queued
+        if not name.startswith('add_'):
+            raise AttributeError(name)
+        method = getattr(self.writer, name)
+        def add(*args, **kwargs):
+            args = [_snapshot(a) for a in args]
+            kwargs = {k: _snapshot(v) for k, v in kwargs.items()}
+            self.pending.put((method, args, kwargs))
+        return add
+
+    def _write_loop(self):
+        while True:
+            method, args, kwargs = self.pending.get()
+            try:
+                method(*args, **kwargs)
+            except Exception as e:
+                self.errors += 1
+                print('TensorBoard write failed', e)
+            finally:
+                self.pending.task_done()
+
+    def flush(self):
+        self.pending.join()
+        self.writer.flush()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class NullWriter(object):
+    """Drops every add_* call, for the processes of a data parallel run that don't log"""
+    log_dir = None
+
+    def __repr__(self):
+        return '<NullWriter>'
+
+    def __getattr__(self, name):
+        if not name.startswith('add_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _snapshot(value):
+    if isinstance(value, torch.Tensor):
+        return value.detach().cpu().clone()
+    return value
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Flat, memory mappable float32 weight files for inference, indexed from the model's config.json
+###
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import torch
+
+FEAT = 'feat_ae.npy'    # Encoder features of dataset.test + dataset.train, the order cluster() numbers the images in
+
+def weights_name(output_dir, ext='weights'):
+    return '{}.{}'.format(os.path.basename(os.path.normpath(output_dir)), ext)
+
+def model_path(output_dir):
+    # The .weights only count once config.json indexes them, save_model() writes it last so a save
+    # that was cut short doesn't pass for a finished model
+    #  Returns: path of the saved model, the lean .weights or else a legacy .pth, None if neither exists
+    path = os.path.join(output_dir, weights_name(output_dir))
+    config_path = os.path.join(output_dir, 'config.json')
+    if os.path.exists(path) and os.path.exists(config_path):
+        with open(config_path) as f:
+            if 'weights_index' in json.load(f):
+                return path
+    path = os.path.join(output_dir, weights_name(output_dir, 'pth'))
+    return path if os.path.exists(path) else None
+
+def save_weights(state_dict, path):
+    # Every tensor back to back as float32 in state_dict order, i.e. the encoder before the decoder
+    #  Returns: index {key: [offset, shape]}, offsets in elements
+    index = {}
+    offset = 0
+    with open(path + '.tmp', 'wb') as f:
+        for key, tensor in state_dict.items():
+            array = np.ascontiguousarray(tensor.detach().cpu().numpy(), dtype=np.float32)
+            f.write(array.tobytes())
+            index[key] = [offset, list(array.shape)]
+            offset += array.size
+    os.replace(path + '.tmp', path)
+    return index
+
+def load_weights(path, index, prefix=''):
+    #  Returns: {key: tensor} of the keys starting with prefix, backed by a copy-on-write memory map
+    #           so only their pages are read from disk
+    flat = np.memmap(path, dtype=np.float32, mode='c')
+    return {key: torch.from_numpy(flat[offset:offset+int(np.prod(shape))].reshape(shape))
+                for key, (offset, shape) in index.items() if key.startswith(prefix)}
+
+def compatible(output_dir, state_dict):
+    #  Returns: whether the lean weights saved in output_dir have the keys and shapes of state_dict
+    config_path = os.path.join(output_dir, 'config.json')
+    if not os.path.exists(config_path):
+        return False
+    with open(config_path) as f:
+        index = json.load(f).get('weights_index')
+    return index != None and set(index) == set(state_dict) \
+            and all(index[key][1] == list(tensor.shape) for key, tensor in state_dict.items())
+
+def weights_hash(path, chunk_size=2**20):
+    #  Returns: sha1 hex digest of the weight file's bytes
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_features(output_dir):
+    # Features saved next to the weights by save_model(), only while the weights are the ones they were
+    # encoded with
+    #  Returns: ((N, 10) float32 memory map in dataset order, config), (None, config) when missing or stale
+    config_path = os.path.join(output_dir, 'config.json')
+    if not os.path.exists(config_path):
+        return None, None
+    with open(config_path) as f:
+        config = json.load(f)
+    if 'feat' not in config or not os.path.exists(os.path.join(output_dir, config['feat'])):
+        return None, config
+    if weights_hash(os.path.join(output_dir, config['model_name'])) != config['weights_hash']:
+        return None, config
+    return np.load(os.path.join(output_dir, config['feat']), mmap_mode='r'), config
+
+def mark_features(output_dir, feat_name):
+    # Records feat_name as encoded with the current weights, after re-encoding stale features
+    config_path = os.path.join(output_dir, 'config.json')
+    if not os.path.exists(config_path):
+        return
+    with open(config_path) as f:
+        config = json.load(f)
+    config['feat'] = feat_name
+    config['weights_hash'] = weights_hash(os.path.join(output_dir, config['model_name']))
+    with open(config_path + '.tmp', 'w') as f:
+        json.dump(config, f)
+    os.replace(config_path + '.tmp', config_path)
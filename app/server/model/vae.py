@@ -8,12 +8,13 @@
 
 
 import os
+import time
 from datetime import datetime
 import json
 
+import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
 from torchvision.utils import save_image, make_grid
 from torch.utils.tensorboard import SummaryWriter
 
@@ -22,13 +23,22 @@ from sklearn.manifold import TSNE
 
 from .utils.plt import plt_scatter
 from .utils.early_stopping import EarlyStopping
+from server.utils.progress import Progress
+from server.utils.datasets.batch_loader import batch_loader
+from .utils.embedding import EmbeddingWriter, load_embedding, sample_idx, iter_rows
+from .utils.tb_log import LogPolicy, AsyncWriter
+from .utils.cpu_profile import CPUProfile
+from .utils.checkpoint import save_checkpoint, load_checkpoint, remove_checkpoint
+from .utils.parallel import SingleProcess
+from .utils.eval_schedule import EvalSchedule
+from .utils.weights import weights_name, save_weights, load_weights, weights_hash, FEAT
 
 MODEL = os.path.basename(__file__).split('.')[0]
 SEED = 489
 
 
 class VariationalAutoEncoder(nn.Module):
-    def __init__(self, tb=None, job=None):
+    def __init__(self, tb=None, job=None, profile=None):
         super(AutoEncoder, self).__init__() 
         self.encoder = nn.Sequential(
             nn.Linear(28*28, 500),
@@ -57,44 +67,84 @@ class VariationalAutoEncoder(nn.Module):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.to(self.device)
 
-        # Tensorboard SummaryWriter event log
+        # Threads, autocast and compiled or fused forward on cpu
+        self.set_profile(profile if profile != None else CPUProfile())
+
+        # Tensorboard SummaryWriter event log and what to log when during fit()
         self.tb = tb
+        self.LOG = LogPolicy()
+
+        # Which epochs fit() evaluates and on how much of the test set
+        self.EVAL = EvalSchedule()
 
-        # RQ Job
+        # RQ Job, meta updates are rate limited
         self.job = job
+        self.progress = Progress.wrap(job)
 
     def __repr__(self):
         return '<{}> \n{} \n{} \n\n{}'.format(__class__.__name__, self.encoder, self.decoder, self.device)
         
     def forward(self, batch):                   # batch=x
-        encoded = self.encoder(batch)           # z
-        decoded = self.decoder(encoded)         # recon_x (x_hat)
-        return encoded, decoded
+        encoder, decoder = self.layers
+        with self.PROFILE.autocast():
+            encoded = encoder(batch)            # z
+            decoded = decoder(encoded)          # recon_x (x_hat)
+        return encoded.float(), decoded.float()
+
+    def set_profile(self, profile):
+        self.PROFILE = profile
+        if self.device.type == 'cpu':
+            profile.apply_threads()
+        # A tuple so the wrappers aren't registered as submodules, the state_dict keys stay the same
+        self.layers = (profile.wrap(self.encoder), profile.wrap(self.decoder))
+
+    def freeze(self):
+        # For inference only models, fit() unfreezes
+        self.layers = (self.PROFILE.freeze(self.encoder), self.PROFILE.freeze(self.decoder))
 
     def gen_tb(self, output_dir, lr, batch_size, ):
         base_output_dir = os.path.join(output_dir, '..')    # output folder
         output_dir = os.path.basename(os.path.normpath(output_dir))
         comment ='{}_lr={}_bs={}'.format(output_dir, lr, batch_size)
         log_dir_name = os.path.join(base_output_dir, 'tb_runs', comment)
-        return SummaryWriter(log_dir=log_dir_name)    # Tensorboard
+        return AsyncWriter(SummaryWriter(log_dir=log_dir_name))    # Tensorboard, written in the background
         
     def fit(self, dataset, batch_size, max_epochs, lr, opt='Adam', loss='BCE', patience=0,  
-                eval=True, plt_imgs=None, scatter_plt=None, pltshow=False, output_dir='', save_model=False):
+                eval=True, plt_imgs=None, scatter_plt=None, pltshow=False, output_dir='', save_model=False,
+                log_policy=None, checkpoint_every=0, time_budget=None, parallel=None, eval_schedule=None):
+        # checkpoint_every: epochs between resumable checkpoints in output_dir, a checkpoint left there by
+        #                   an earlier run is resumed from, 0 trains from scratch
+        # time_budget: seconds, stops with a checkpoint before the epoch that would overrun, self.FINISHED is
+        #              then False and the next fit() on the same output_dir carries on
+        # eval_schedule: EvalSchedule of the evaluated epochs and test sample, patience counts evaluations
+        # parallel: DataParallel rank of a run launched by fit_parallel(), see server/model/utils/parallel.py
+        fit_start = time.time()
+        self.FINISHED = True
 
         self.EPOCH = 1
         self.BATCH_SIZE = batch_size
         self.LR = lr
         self.OUTPUT_DIR = output_dir
+        self.PARALLEL = parallel if parallel != None else SingleProcess()
+        self.set_profile(self.PROFILE)  # Trainable layers
+        if log_policy != None:
+            self.LOG = log_policy
+        if eval_schedule != None:
+            self.EVAL = eval_schedule
+        eval_dataset = self.EVAL.eval_dataset(dataset)     # Fixed test sample
         if self.tb==None:  
             self.tb = self.gen_tb(output_dir, lr, batch_size)
+        self.tb = AsyncWriter.wrap(self.tb)
 
-        # Data Loader for easy mini-batch return in training, the image batch shape will be (BATCH_SIZE, 1, 28, 28)
-        train_loader = DataLoader(dataset=dataset.train, batch_size=self.BATCH_SIZE, shuffle=True, num_workers=4)
+        # Batches sliced from the in-memory dataset tensors, the image batch shape will be (BATCH_SIZE, 1, 28, 28),
+        # this rank's share of it when data parallel
+        train_loader = self.PARALLEL.loader(dataset.train, self.BATCH_SIZE)
 
+        params = [p for p in self.parameters() if p.requires_grad]     # Skips layers frozen by warm_start()
         if opt=='Adam':
-            self.optimizer = torch.optim.Adam(self.parameters(), lr=self.LR)
+            self.optimizer = torch.optim.Adam(params, lr=self.LR)
         elif opt=='SGD':
-            self.optimizer = torch.optim.SGD(self.parameters(), lr=self.LR, momentum=0.9)
+            self.optimizer = torch.optim.SGD(params, lr=self.LR, momentum=0.9)
           
         if loss=='BCE':     # TODO: Investigate BCE or MSE loss
             self.loss_fn = nn.BCELoss()
@@ -103,7 +153,8 @@ class VariationalAutoEncoder(nn.Module):
 
         # =================== TENSORBOARD ===================== #
         images, _ = next(iter(train_loader))    # first batch
-        self.tb.add_image('batch_images_{}'.format(images.numpy().shape), make_grid(images))
+        if self.LOG.due('images', self.EPOCH):
+            self.tb.add_image('batch_images_{}'.format(images.numpy().shape), make_grid(images))
         if plt_imgs!=None:
             view_data = images.to(self.device)  # Decode to show training
             row = 2
@@ -113,10 +164,13 @@ class VariationalAutoEncoder(nn.Module):
         es = EarlyStopping(tol = 0.001, patience=patience)
         self.train()        # Set to train mode
         start_epoch = self.EPOCH    # To continue training 
-        for epoch in range(start_epoch, start_epoch+max_epochs+1):
-            train_feat = []
-            train_labels = []
-            train_imgs = []
+        if checkpoint_every:
+            start_epoch = self.resume(es)
+        self.PARALLEL.broadcast(self)   # Same weights on every rank
+        n_iter = self.EPOCH * len(train_loader)
+        epoch_time = 0
+        for epoch in range(start_epoch, 1+max_epochs+1):
+            epoch_start = time.time()
             train_loss = 0      # printing intermediary loss
             self.EPOCH = epoch
             for batch_idx, (batch_train, batch_train_label) in enumerate(train_loader):
@@ -133,86 +187,109 @@ class VariationalAutoEncoder(nn.Module):
                 # =================== backward ==================== #
                 self.optimizer.zero_grad()               # clear gradients for this training step
                 self.loss.backward()                     # backpropagation, compute gradients
+                self.PARALLEL.all_reduce_grads(params)   # average over the ranks
                 self.optimizer.step()                    # apply gradients
 
                 train_loss += self.loss.item()*batch_train.size(0)
-                
-                train_feat.append(encoded.data.cpu().view(batch_train.size(0), -1))
-                train_labels.append(batch_train_label)
-                train_imgs.append(batch_train.cpu())
 
                  # =================== Report progress ==================== #
-                if batch_idx % 10 == 0:
+                if batch_idx % 10 == 0 and self.PARALLEL.is_main:
                     print('Train Epoch: {} [{}/{} ({:.0f}%)] \t Batch Loss:{:.6f} \t MSE Loss:{:.6f} '.format(
-                        self.EPOCH, batch_idx * len(batch_train), len(train_loader.dataset),
+                        self.EPOCH, batch_idx * len(batch_train) * self.PARALLEL.world_size, len(train_loader.dataset),
                             100.0 * batch_idx / len(train_loader),
                             self.loss.item() / len(batch_train),
                             MSE_loss.data / len(batch_train)
                     ))
                     # Report for rq worker
 
-                    if self.job != None:
-                        self.job.meta['epoch'] = self.EPOCH
-                        self.job.meta['epoch_progress'] = '{}/{}'.format(batch_idx * len(batch_train), len(train_loader.dataset))
-                        self.job.meta['progress'] ='{:.0f}'.format(100.0 * batch_idx / len(train_loader))
-                        self.job.save_meta()
+                    self.progress.update(epoch=self.EPOCH,
+                        epoch_progress='{}/{}'.format(batch_idx * len(batch_train) * self.PARALLEL.world_size,
+                                                        len(train_loader.dataset)),
+                        progress='{:.0f}'.format(100.0 * batch_idx / len(train_loader)))
 
-            train_loss /= len(train_loader.dataset)
-            print('\n====> Epoch: {} Average loss: {:.4f}'.format(self.EPOCH, train_loss))
+            train_loss = self.PARALLEL.sum(train_loss) / len(train_loader.dataset)
+            if self.PARALLEL.is_main:
+                print('\n====> Epoch: {} Average loss: {:.4f}'.format(self.EPOCH, train_loss))
 
             # Report for rq worker
-            if self.job != None:
-                self.job.meta['EPOCH'] = self.EPOCH
-                self.job.meta['epoch_progress'] = '{}/{}'.format(len(train_loader.dataset), len(train_loader.dataset))
-                self.job.meta['progress'] = 100
-                self.job.meta['train_loss'] = '{:.4f}'.format(train_loss)
-                self.job.meta['NUM_BAD_EPOCHS'] = es.num_bad_epochs+1
-                self.job.save_meta()
+            self.progress.update(force=True, EPOCH=self.EPOCH,
+                epoch_progress='{}/{}'.format(len(train_loader.dataset), len(train_loader.dataset)),
+                progress=100,
+                train_loss='{:.4f}'.format(train_loss),
+                NUM_BAD_EPOCHS=es.num_bad_epochs+1)
            
             # =================== TENSORBOARD ===================== #
-            self.tb.add_scalar('Train Loss', train_loss, self.EPOCH)
-            for name, weight in self.named_parameters():
-                self.tb.add_histogram(name, weight, self.EPOCH)
-                self.tb.add_histogram(f'{name}.grad', weight.grad, self.EPOCH)
+            if self.LOG.due('scalars', self.EPOCH):
+                self.tb.add_scalar('Train Loss', train_loss, self.EPOCH)
+            if self.LOG.due('histograms', self.EPOCH):
+                for name, weight in self.named_parameters():
+                    self.tb.add_histogram(name, weight, self.EPOCH)
+                    if weight.requires_grad:
+                        self.tb.add_histogram(f'{name}.grad', weight.grad, self.EPOCH)
+            if self.LOG.due('embeddings', self.EPOCH):
+                self.add_embedding(dataset, n_iter)
         
             # =================== EVAL MODEL ==================== #
             ## Plot decoded img
             if plt_imgs!=None and self.EPOCH % plt_imgs[1] == 0:
-                view_data = view_data.view(self.BATCH_SIZE, -1)
+                view_data = view_data.view(view_data.size(0), -1)
                 encoded, decoded = self.forward(view_data) 
                 decoded = decoded[row*plt_imgs[0]:row*plt_imgs[0]+plt_imgs[0]].view(-1, 1, 28, 28).cpu()
                 decoded_plt = torch.cat((decoded_plt, decoded), dim=0)
 
-            if eval:
-                test_loss, _, _, _ = self.eval_model(dataset, plt_imgs, scatter_plt, pltshow, self.OUTPUT_DIR)
-                if es.step(test_loss):  # Early Stopping
+            stop = False
+            plt_intervals = (plt_imgs[1] if plt_imgs != None else None, scatter_plt[1] if scatter_plt != None else None)
+            if eval and self.EVAL.due(self.EPOCH, max_epochs+1, plt_intervals):
+                test_loss, _, _, _ = self.eval_model(eval_dataset, plt_imgs, scatter_plt, pltshow, self.OUTPUT_DIR)
+                stop = es.step(test_loss)   # Early Stopping
+                if stop:
                     # Check whether to plt last epoch
+                    replot = True
                     if (plt_imgs != None and self.EPOCH % plt_imgs[1] !=0): 
                         plt_imgs = (plt_imgs[0], self.EPOCH)        # (N_TEST_IMGS, plt_interval)
                     elif (scatter_plt != None and self.EPOCH % scatter_plt[1] !=0):
                         scatter_plt = (scatter_plt[0], self.EPOCH)  # ('method', plt_interval)
                     else:
-                        break
-                    self.eval_model(dataset,           # Plot last epoch
-                                    plt_imgs=plt_imgs,         
-                                    scatter_plt=scatter_plt,   
-                                    pltshow=pltshow, output_dir=self.OUTPUT_DIR)
-                    break
+                        replot = False
+                    if replot:
+                        self.eval_model(eval_dataset,           # Plot last epoch
+                                        plt_imgs=plt_imgs,         
+                                        scatter_plt=scatter_plt,   
+                                        pltshow=pltshow, output_dir=self.OUTPUT_DIR)
+            if self.PARALLEL.decide(stop):     # Rank 0 evaluates for every rank
+                break
+
+            # =================== CHECKPOINT ==================== #
+            epoch_time = max(epoch_time, time.time() - epoch_start)
+            over_budget = time_budget != None and self.EPOCH < max_epochs+1 \
+                            and time.time() - fit_start + epoch_time > time_budget    # The last epoch goes on to save
+            if self.PARALLEL.decide(over_budget):
+                self.FINISHED = False
+                if self.PARALLEL.is_main:
+                    self.save_checkpoint(es)
+                    dataset.save_dataset(self._mkdirs(self.OUTPUT_DIR))     # To carry on in another job
+                    print('Time budget of {}s used, stopping after epoch {}\n'.format(time_budget, self.EPOCH))
+                break
+            if checkpoint_every and self.EPOCH % checkpoint_every == 0 and self.PARALLEL.is_main:
+                self.save_checkpoint(es)
                 
-        train_feat = torch.cat(train_feat, dim=0)
-        train_labels = torch.cat(train_labels, dim=0)
-        train_imgs = torch.cat(train_imgs, dim=0)
-
+        if not self.FINISHED:
+            self.tb.flush()
+            return
         # =================== SAVE MODEL AND DATA ==================== #
-        self.tb.add_embedding(train_feat, metadata=train_labels, label_img=train_imgs, global_step=n_iter)
-        if plt_imgs!=None:
+        if self.LOG.enabled('embeddings'):
+            self.add_embedding(dataset, n_iter)
+        if plt_imgs!=None and self.LOG.due('images', self.EPOCH):
             self.tb.add_images('decoded_row_{}_epochs_{}'.format(row, plt_imgs[1]), decoded_plt, self.EPOCH)   
+        self.tb.flush()     # Wait for the background writes
         if save_model: 
             self.save_model(dataset, self.OUTPUT_DIR)
+        if checkpoint_every and self.PARALLEL.is_main:
+            remove_checkpoint(self.OUTPUT_DIR)
 
             
     def eval_model(self, dataset, plt_imgs=None, scatter_plt=None, pltshow=False, output_dir=''):
-            test_loader = DataLoader(dataset=dataset.test, batch_size=self.BATCH_SIZE, shuffle=True, num_workers=4)
+            test_loader = batch_loader(dataset.test, batch_size=self.BATCH_SIZE, shuffle=True)
             self.eval()  
             test_loss = 0   
             test_feat = []
@@ -235,11 +312,10 @@ class VariationalAutoEncoder(nn.Module):
                 test_loss /= len(test_loader.dataset)
                 print('====> Test set loss: {:.4f}\n'.format(test_loss))
 
-                if self.job != None:
-                    self.job.meta['test_loss'] = '{:.4f}'.format(test_loss)
-                    self.job.save_meta()
+                self.progress.update(force=True, test_loss='{:.4f}'.format(test_loss))
 
-                self.tb.add_scalar('Test Loss', test_loss, self.EPOCH)
+                if self.LOG.due('scalars', self.EPOCH):
+                    self.tb.add_scalar('Test Loss', test_loss, self.EPOCH)
                 
                 test_feat = torch.cat(test_feat, dim=0)
                 test_labels = torch.cat(test_labels, dim=0)
@@ -263,9 +339,9 @@ class VariationalAutoEncoder(nn.Module):
                 labels = test_labels.numpy()
 
                 if feat.shape[1] > 2:            # Reduce to 2 dim
-                    if feat.shape[0] > 5000:     # Plot only first 5000 pts   
-                        feat = feat[:5000, :]
-                        labels = labels[:5000]
+                    if feat.shape[0] > self.EVAL.plot_sample:     # Plot only first plot_sample pts   
+                        feat = feat[:self.EVAL.plot_sample, :]
+                        labels = labels[:self.EVAL.plot_sample]
                     if scatter_plt[0]=='tsne':
                         tsne = TSNE(perplexity=30, n_components=2, init='pca', n_iter=1000, random_state=SEED)
                         feat = tsne.fit_transform(feat)
@@ -274,33 +350,120 @@ class VariationalAutoEncoder(nn.Module):
                 plt_name = 'tsne_{}.png'.format(self.EPOCH)
                 img_plt = plt_scatter(feat=feat, labels=labels, output_dir=output_dir, 
                                                 plt_name=plt_name, pltshow=pltshow)
-                self.tb.add_image(plt_name, img_plt, self.EPOCH, dataformats='HWC')
+                if self.LOG.due('images', self.EPOCH):
+                    self.tb.add_image(plt_name, img_plt, self.EPOCH, dataformats='HWC')
        
             return test_loss, test_feat, test_labels, test_imgs
     
                 
+    def add_embedding(self, dataset, global_step):
+        embedding = self.write_embedding(dataset.train, os.path.join(self._mkdirs(self.OUTPUT_DIR), 'embedding'), 
+                                            sample=self.LOG.embed_sample)
+        self.tb.add_embedding(torch.from_numpy(np.array(embedding['feat'])), 
+                                metadata=torch.from_numpy(np.array(embedding['labels'])), 
+                                label_img=torch.from_numpy(np.array(embedding['imgs'])), global_step=global_step)
+
+    def encode(self, dataset, path=None, batch_size=4096):
+        # Encoder only features of every dataset row in dataset order, no decoder, loss or shuffling.
+        # Batches are written straight into a float32 .npy at path when given
+        #  Returns: (N, 10) float32 array, memory mapped from path when given
+        shape = (len(dataset), self.encoder[-1].out_features)
+        if path != None:
+            feat = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            feat = np.empty(shape, dtype=np.float32)
+        self.eval()
+        encoder = self.layers[0]
+        start = 0
+        with torch.no_grad():
+            for batch, _ in iter_rows(dataset, batch_size=batch_size):
+                batch = batch.to(self.device)
+                with self.PROFILE.autocast():
+                    encoded = encoder(batch.view(batch.size(0), -1))
+                feat[start:start+len(batch)] = encoded.float().cpu().numpy()
+                start += len(batch)
+        if path != None:
+            feat.flush()
+        return feat
+
+    def write_embedding(self, dataset, path, sample=None, batch_size=1024):
+        # Features of the final weights for a fixed sample of the dataset, streamed to disk a batch at a time
+        #  Returns: {'feat', 'labels', 'imgs'} arrays memory mapped from path
+        idx = sample_idx(len(dataset), sample)
+        writer = EmbeddingWriter(path, len(idx))
+        self.eval()
+        with torch.no_grad():
+            for batch, batch_label in iter_rows(dataset, idx, batch_size):
+                batch = batch.to(self.device)
+                with self.PROFILE.autocast():
+                    encoded = self.layers[0](batch.view(batch.size(0), -1)).float()
+                writer.write(feat=encoded, labels=batch_label, imgs=batch)
+        writer.close()
+        self.train()
+        print('Embedding of {}/{} images saved to {}'.format(len(idx), len(dataset), path))
+        return load_embedding(path)
+
+    def warm_start(self, output_dir, freeze=0):
+        # Fine tunes from a trained run, its first freeze encoder Linear layers kept as they are
+        self.load_model(output_dir, tb=False)
+        linears = [layer for layer in self.encoder if isinstance(layer, nn.Linear)]
+        for layer in linears[:freeze]:
+            for param in layer.parameters():
+                param.requires_grad = False
+        print('Warm start from {} with {} encoder layers frozen\n'.format(output_dir, min(freeze, len(linears))))
+
+    def recon_loss(self, dataset, sample=1000, batch_size=1024):
+        #  Returns: mean loss_fn reconstruction loss over a fixed sample of the dataset
+        idx = sample_idx(len(dataset), sample)
+        self.eval()
+        total = 0
+        with torch.no_grad():
+            for batch, _ in iter_rows(dataset, idx, batch_size):
+                batch = batch.to(self.device).view(batch.size(0), -1)
+                _, decoded = self.forward(batch)
+                total += self.loss_fn(decoded, batch).item() * batch.size(0)
+        return total / len(idx)
+
+    def save_checkpoint(self, es):
+        save_checkpoint(self.OUTPUT_DIR, 
+            model_state_dict=self.state_dict(),
+            optimizer_state_dict=self.optimizer.state_dict(),
+            es_state_dict=es.state_dict(),
+            epoch=self.EPOCH,
+            loss=float(self.loss),
+            lr=self.LR,
+            batch_size=self.BATCH_SIZE)
+
+    def resume(self, es):
+        # Picks up from the checkpoint in OUTPUT_DIR if there is one, RNGs included
+        #  Returns: the epoch to train next
+        checkpt = load_checkpoint(self.OUTPUT_DIR)
+        if checkpt == None:
+            return self.EPOCH
+        self.load_state_dict(checkpt['model_state_dict'])
+        self.optimizer.load_state_dict(checkpt['optimizer_state_dict'])
+        es.load_state_dict(checkpt['es_state_dict'])
+        self.EPOCH = checkpt['epoch']
+        if 'loss' in checkpt:   # A checkpoint of the last epoch goes straight on to save_model()
+            self.loss = checkpt['loss']
+        print('Resuming from epoch {} checkpoint in {}\n'.format(self.EPOCH, self.OUTPUT_DIR))
+        self.progress.update(force=True, RESUMED_EPOCH=self.EPOCH)
+        return self.EPOCH + 1
+
     def save_model(self, dataset, output_dir):
+        # Inference weights as a flat float32 file, optimizer state on its own in .train.pt and the
+        # metadata plus the weight index in config.json, written last
         output_dir = self._mkdirs(output_dir)  
         dataset.save_dataset(output_dir)
         
-        model_name = '{}.pth'.format(os.path.basename(os.path.normpath(output_dir)))
+        model_name = weights_name(output_dir)
         save_path = os.path.join(output_dir, model_name)
-        torch.save({        # Saving checkpt for inference and/or resuming training
-            'model_name': model_name,
-            'model_type': MODEL,
-            'model_state_dict': self.state_dict(),
-            'device': self.device,
-            'lr': self.LR,
-            'batch_size': self.BATCH_SIZE,
-            'optimizer': self.optimizer,
-            'optimizer_state_dict': self.optimizer.state_dict(),
-            'epoch': self.EPOCH,
-            'loss': self.loss,
-            'loss_fn': self.loss_fn,
-            'tb_log_dir': self.tb.log_dir
-            },
-            save_path
-        )
+        index = save_weights(self.state_dict(), save_path)
+        train_state = weights_name(output_dir, 'train.pt')
+        torch.save({'optimizer_state_dict': self.optimizer.state_dict()},   # Only to resume training
+                    os.path.join(output_dir, train_state))
+        print('Encoding features of {} images ...'.format(len(dataset.test) + len(dataset.train)))
+        self.encode(dataset.test + dataset.train, path=os.path.join(output_dir, FEAT))  # Saves cluster() a model reload
         config = {          # Save config file
             'model_name': model_name,
             'model_type': MODEL,
@@ -309,19 +472,60 @@ class VariationalAutoEncoder(nn.Module):
             'batch_size': self.BATCH_SIZE,
             'optimizer': self.optimizer.__class__.__name__,
             'epoch': self.EPOCH,
-            'loss': self.loss.data.item(),
+            'loss': float(self.loss),
             'loss_fn': self.loss_fn.__class__.__name__,
-            'tb_log_dir': self.tb.log_dir
+            'tb_log_dir': self.tb.log_dir,
+            'weights_index': index,
+            'train_state': train_state,
+            'feat': FEAT,
+            'weights_hash': weights_hash(save_path)
             }
  
-        with open(output_dir+'/config.json', 'w') as f:
+        with open(output_dir+'/config.json.tmp', 'w') as f:
             json.dump(config, f)
+        os.replace(output_dir+'/config.json.tmp', output_dir+'/config.json')
 
         print('\nAE Model saved to {}\n'.format(save_path))
 
 
 
-    def load_model(self, output_dir):
+    def load_model(self, output_dir, encoder_only=False, train_state=False, tb=True):
+        # Memory maps the weights, encoder_only reads just the encoder's, the optimizer is only rebuilt
+        # with train_state. Models saved before the lean format fall back to their .pth
+        config_path = os.path.join(output_dir, 'config.json')
+        config = None
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                config = json.load(f)
+        if config == None or 'weights_index' not in config:
+            return self.load_legacy_model(output_dir)
+
+        prefix = 'encoder.' if encoder_only else ''
+        state_dict = load_weights(os.path.join(output_dir, config['model_name']), config['weights_index'], prefix)
+        self.load_state_dict(state_dict, strict=not encoder_only)
+        self.model_name = config['model_name']
+        self.LR = float(config['lr'])
+        self.BATCH_SIZE = int(config['batch_size'])
+        self.EPOCH = config['epoch']
+        self.loss = float(config['loss'])
+        self.loss_fn = nn.MSELoss() if config['loss_fn'] == 'MSELoss' else nn.BCELoss()
+        self.optimizer = None
+        if train_state:
+            if config['optimizer'] == 'SGD':
+                self.optimizer = torch.optim.SGD(self.parameters(), lr=self.LR, momentum=0.9)
+            else:
+                self.optimizer = torch.optim.Adam(self.parameters(), lr=self.LR)
+            train_checkpt = torch.load(os.path.join(output_dir, config['train_state']), 
+                                        map_location=lambda storage, loc: storage)
+            self.optimizer.load_state_dict(train_checkpt['optimizer_state_dict'])
+        if tb:  # The run's event log
+            self.tb = SummaryWriter(log_dir=config['tb_log_dir'])
+
+        print('Loaded model\t{} {}\n'.format(self.model_name, '(encoder)' if encoder_only else ''))
+        print('Batch size: {} LR: {} Optimiser: {}\n'.format(self.BATCH_SIZE, self.LR, config['optimizer']))
+        print('Epoch: {}\tLoss: {}\n'.format(self.EPOCH, self.loss))
+
+    def load_legacy_model(self, output_dir):
         model_name = '{}.pth'.format(os.path.basename(os.path.normpath(output_dir)))
         model_path = os.path.join(output_dir, model_name)
         model_checkpt = torch.load(model_path, map_location=lambda storage, loc: storage)
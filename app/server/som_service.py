@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Long running SOM grid service, answers the grid requests that need no training ('queue' refreshes
+# and 'switch') over a local socket so the routes skip the rq enqueue, work horse and polling delay
+#   $ cd app && python -m server.som_service
+###
+
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from datetime import datetime
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import numpy as np
+
+from server.config import DevelopmentConfig, latest_output_dir
+from server.utils.cache import ArtifactCache
+from server.model.utils.grid_index import load_index
+from server.model.utils.som_store import SOMStore, clear_cache
+from server.model.utils.som_queue import NeuronQueues
+
+MODES = ('queue', 'switch')
+
+
+class SOMService(object):
+    """Serves ('grid', img_idx, c_label, dims, som_mode) requests, replying (status, img_grd_idx)
+
+    Features, labels and indexes stay in an ArtifactCache and weights and queues in the SOMStore cache,
+    both keyed on file mtimes so SOMs retrained by rq jobs are picked up. The latest model's output dir is
+    looked up for every batch and both caches are dropped when a new model replaces it. Requests arriving within
+    batch_window of each other are handled together, 'switch' requests for one cluster share a single
+    KD-tree search. Requests it can't answer without training are replied 'cold' for the caller to enqueue.
+    """
+    def __init__(self, config, batch_window=0.002):
+        self.config = config
+        self.batch_window = batch_window
+        self.requests = queue.Queue()
+        self.artifacts = ArtifactCache(max_bytes=config.ARTIFACT_CACHE_MB * 2**20)
+        self.output_dir = None
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def __repr__(self):
+        return '<SOMService requests: {} batches: {} {}>'.format(self.num_requests, self.num_batches, self.artifacts)
+
+    def serve(self, address, authkey):
+        if isinstance(address, str) and os.path.exists(address):    # Stale socket from a previous run
+            os.remove(address)
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        with Listener(address, authkey=authkey) as listener:
+            print('SOM service listening on {}'.format(address))
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    print('Rejected connection', e)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        # One thread per connection, requests are answered by the batch loop
+        with conn:
+            try:
+                while True:
+                    future = Future()
+                    self.requests.put((conn.recv(), future))
+                    conn.send(future.result())
+            except (EOFError, OSError):
+                pass
+
+    def _batch_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.batch_window
+            while time.time() < deadline:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            self.grids(batch)
+
+    def refresh_output_dir(self):
+        # Same latest model dir as the rq jobs, artifacts of the previous model are dropped on a switch
+        output_dir = latest_output_dir(self.config.MODEL_OUTPUT_DIR)
+        if output_dir != self.output_dir:
+            if self.output_dir != None:
+                print('Switching to {}'.format(output_dir))
+            self.artifacts.clear()
+            clear_cache()
+            self.output_dir = output_dir
+        return output_dir
+
+    def grids(self, batch):
+        # 'queue' refreshes move the neuron queue heads so run one at a time, 'switch' requests are
+        # grouped by cluster
+        try:
+            self.refresh_output_dir()
+        except Exception as e:
+            for _, future in batch:
+                future.set_result(('error', repr(e)))
+            return
+        switch = {}
+        for req, future in batch:
+            _, img_idx, c_label, dims, som_mode = req
+            try:
+                if som_mode == 'queue':
+                    future.set_result(self.queue_grid(np.asarray(img_idx), c_label, dims))
+                elif som_mode == 'switch':
+                    switch.setdefault(str(c_label), []).append((np.asarray(img_idx), future))
+                else:
+                    future.set_result(('cold', None))
+            except Exception as e:
+                future.set_result(('error', repr(e)))
+        for c_label, reqs in switch.items():
+            try:
+                for (_, future), grid in zip(reqs, self.switch_grids(c_label, [r[0] for r in reqs])):
+                    future.set_result(grid)
+            except Exception as e:
+                for _, future in reqs:
+                    future.set_result(('error', repr(e)))
+
+    def queue_grid(self, img_idx, c_label, dims):
+        store = SOMStore(self.output_dir)
+        queues = NeuronQueues.load(store, c_label, dims)
+        if queues is None or len(img_idx) <= dims[0]*dims[1]:   # rq falls back to an 'update' retrain
+            return ('cold', None)
+        img_grd_idx = queues.next_grid(img_idx)
+        queues.save(store, c_label, heads_only=True)
+        return ('ok', img_grd_idx.tolist())
+
+    def switch_grids(self, c_label, img_idxs):
+        # The weights as saved, rq runs a single lr=0.0001 iteration over them first which is a no-op in practice
+        store = SOMStore(self.output_dir)
+        if not store.exists(c_label) or any(len(img_idx) == 0 for img_idx in img_idxs):
+            return [('cold', None)] * len(img_idxs)
+        net = np.asarray(store.load_net(c_label), dtype=np.float64)
+        feat = self.artifacts.load_npy(os.path.join(self.output_dir, '_feat.npy'))
+        c_labels = self.artifacts.load_npy(os.path.join(self.output_dir, '_c_labels.npy'))
+        index = load_index(feat, c_labels, self.output_dir, c_label, cache=self.artifacts, 
+                            members=store.load_array(c_label, 'members'))
+        grids = index.query_many(net.reshape(-1, net.shape[-1]), img_idxs, unique=self.config.SOM_UNIQUE_GRID)
+        return [('ok', grid.tolist()) for grid in grids]
+
+
+class SOMServiceClient(object):
+    def __init__(self, address, authkey, timeout=1.0):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<SOMServiceClient {}>'.format(self.address)
+
+    def grid(self, img_idx, c_label, dims, som_mode):
+        #  Returns: img_grd_idx, or None when the service is down or slow, the cluster is cold or
+        #           the mode needs training, for the caller to fall back to rq
+        if som_mode not in MODES:
+            return None
+        try:
+            with Client(self.address, authkey=self.authkey) as conn:
+                conn.send(('grid', [int(i) for i in img_idx], c_label, list(dims), som_mode))
+                if not conn.poll(self.timeout):
+                    return None
+                status, img_grd_idx = conn.recv()
+        except (OSError, EOFError, AuthenticationError):
+            return None
+        if status == 'error':
+            print('SOM service error', img_grd_idx)
+        return img_grd_idx if status == 'ok' else None
+
+
+class SyncTask(object):
+    """Finished stand-in for an rq job, so a grid answered by the service is polled like any som task"""
+    PREFIX = 'sync-'
+
+    def __init__(self, task_id, result, meta=None, ended_at=None):
+        self.task_id = task_id
+        self.result = result
+        self.meta = meta if meta != None else {}
+        self.ended_at = ended_at if ended_at != None else datetime.utcnow()
+
+    def __repr__(self):
+        return '<SyncTask {}>'.format(self.task_id)
+
+    @classmethod
+    def create(cls, redis, result, ttl=300, **meta):
+        task = cls(cls.PREFIX + str(uuid.uuid4()), result, meta)
+        redis.set('som:sync:' + task.task_id, json.dumps({'result': result, 'meta': meta}), ex=ttl)
+        return task
+
+    @classmethod
+    def fetch(cls, redis, task_id):
+        data = redis.get('som:sync:' + task_id)
+        if data == None:
+            return None
+        data = json.loads(data)
+        return cls(task_id, data['result'], data['meta'])
+
+    def get_id(self):
+        return self.task_id
+
+    def get_status(self):
+        return 'finished'
+
+    def refresh(self):
+        pass
+
+
+if __name__ == '__main__':
+    config = DevelopmentConfig
+    SOMService(config).serve(config.SOM_SERVICE_ADDRESS, authkey=config.SECRET_KEY)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Process-level LRU cache of output dir artifacts for rq workers
+###
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ArtifactCache(object):
+    """LRU cache of loaded artifacts keyed by (path, mtime, size) with a memory cap in bytes.
+
+    Only useful when jobs run in the worker process itself (rq SimpleWorker), a forking
+    worker throws the cache away with every work horse.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # key -> (value, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<ArtifactCache {} entries {:.1f}/{:.1f} MB hits: {} misses: {}>'.format(
+                len(self.entries), self.nbytes / 2**20, self.max_bytes / 2**20, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, loader):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        self.misses += 1
+        self._pop_path(key[0])     # Stale versions of the same file
+        value = loader(path)
+        nbytes = sizeof(value)
+        if nbytes <= self.max_bytes:
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+        return value
+
+    def load_npy(self, path):
+        return self.get(path, np.load)
+
+    def stats(self):
+        return {'CACHE_HITS': self.hits, 'CACHE_MISSES': self.misses,
+                'CACHE_MB': round(self.nbytes / 2**20, 1)}
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def _pop_path(self, path):
+        for key in [k for k in self.entries if k[0] == path]:
+            self.nbytes -= self.entries.pop(key)[1]
+
+
+def sizeof(value, seen=None):
+    # Rough memory footprint of arrays, tensors, models and the containers holding them
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, 'element_size') and hasattr(value, 'nelement'):     # torch.Tensor
+        return value.element_size() * value.nelement()
+    if isinstance(value, dict):
+        return sum(sizeof(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return sum(sizeof(v, seen) for v in value)
+    if hasattr(value, '__dict__'):      # models, datasets
+        return sum(sizeof(v, seen) for v in vars(value).values())
+    return 0
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# In-memory batch iterator for tensor datasets, no worker processes and no per-item collate
+###
+
+import math
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset, ConcatDataset
+
+
+class TensorBatchLoader(object):
+    """Batches sliced straight from the tensors behind a TensorDataset (or a ConcatDataset of them)
+
+    Shuffling draws one index permutation per epoch and gathers each batch with it, unshuffled batches
+    are views of the backing tensors. Yields the same (imgs, labels) batches as a DataLoader.
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, drop_last=False, generator=None):
+        self.dataset = dataset
+        self.tensors = tensors_of(dataset)
+        if self.tensors is None:
+            raise ValueError('{} is not backed by tensors'.format(dataset.__class__.__name__))
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __repr__(self):
+        return '<TensorBatchLoader {} samples batch_size: {} shuffle: {}>'.format(
+                len(self.dataset), self.batch_size, self.shuffle)
+
+    def __len__(self):
+        n = len(self.tensors[0])
+        return n // self.batch_size if self.drop_last else math.ceil(n / self.batch_size)
+
+    def __iter__(self):
+        n = len(self.tensors[0])
+        end = n - n % self.batch_size if self.drop_last else n
+        if self.shuffle:
+            perm = torch.randperm(n, generator=self.generator)
+            for start in range(0, end, self.batch_size):
+                idx = perm[start:start+self.batch_size]
+                yield tuple(t.index_select(0, idx) for t in self.tensors)
+        else:
+            for start in range(0, end, self.batch_size):
+                yield tuple(t[start:start+self.batch_size] for t in self.tensors)
+
+
+def tensors_of(dataset):
+    # Backing tensors of a TensorDataset or a ConcatDataset of TensorDatasets (concatenated once), else None
+    if isinstance(dataset, TensorDataset):
+        return dataset.tensors
+    if is_tensor_dataset(dataset):     # ConcatDataset
+        return tuple(torch.cat(ts, dim=0) for ts in zip(*[tensors_of(d) for d in dataset.datasets]))
+    return None
+
+def is_tensor_dataset(dataset):
+    if isinstance(dataset, ConcatDataset):
+        return len(dataset.datasets) > 0 and all(is_tensor_dataset(d) for d in dataset.datasets)
+    return isinstance(dataset, TensorDataset)
+
+def batch_loader(dataset, batch_size, shuffle=False, num_workers=4):
+    # TensorBatchLoader for in-memory tensor datasets, a worker DataLoader for ones that load or
+    # transform per item e.g. torchvision MNIST
+    if is_tensor_dataset(dataset):
+        return TensorBatchLoader(dataset, batch_size, shuffle=shuffle)
+    return DataLoader(dataset=dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers)
+
+
+class ShardedBatchLoader(TensorBatchLoader):
+    """One process's share of every epoch of a data parallel run
+
+    All ranks draw the same permutation each epoch (seed + epoch) and take equal sized slices of it, so
+    they run the same number of steps. Up to world_size-1 samples an epoch are left out.
+    """
+    def __init__(self, dataset, batch_size, rank, world_size, seed=489):
+        super(ShardedBatchLoader, self).__init__(dataset, batch_size, shuffle=True)
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = len(self.tensors[0]) // world_size
+
+    def __repr__(self):
+        return '<ShardedBatchLoader rank {}/{} {} of {} samples batch_size: {}>'.format(
+                self.rank, self.world_size, self.num_samples, len(self.dataset), self.batch_size)
+
+    def __len__(self):
+        return math.ceil(self.num_samples / self.batch_size)
+
+    def __iter__(self):
+        g = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        perm = torch.randperm(len(self.tensors[0]), generator=g)
+        idx = perm[self.rank*self.num_samples:(self.rank+1)*self.num_samples]
+        for start in range(0, self.num_samples, self.batch_size):
+            batch_idx = idx[start:start+self.batch_size]
+            yield tuple(t.index_select(0, batch_idx) for t in self.tensors)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Rate-limited progress reporting for rq jobs
+###
+
+import time
+
+
+class Progress(object):
+    """Buffers rq job meta updates and saves them to Redis at most max_rate times per second.
+
+    Stage changes (a new progress_msg) and forced updates are saved straight away,
+    max_rate=None saves on every update. Without a job every call is a no-op.
+    """
+    def __init__(self, job=None, max_rate=4):
+        self.job = job
+        self.min_interval = 0 if max_rate is None else 1.0 / max_rate
+        self.last_flush = 0
+        self.dirty = False
+        self.num_flushes = 0
+
+    def __repr__(self):
+        return '<Progress {} flushes: {}>'.format(self.job.get_id() if self.job != None else None, self.num_flushes)
+
+    @classmethod
+    def wrap(cls, job, **kwargs):
+        # Models take either a bare rq job or a Progress shared with the calling task
+        if isinstance(job, cls):
+            return job
+        return cls(job, **kwargs)
+
+    @property
+    def meta(self):
+        return self.job.meta if self.job != None else {}
+
+    def update(self, force=False, **meta):
+        if self.job == None:
+            return
+        if 'progress_msg' in meta and meta['progress_msg'] != self.job.meta.get('progress_msg'):
+            force = True    # Stage changed
+        self.job.meta.update(meta)
+        self.dirty = True
+        self.flush(force)
+
+    def stage(self, progress_msg, **meta):
+        self.update(force=True, progress_msg=progress_msg, **meta)
+
+    def flush(self, force=False):
+        if self.job == None or not self.dirty:
+            return
+        now = time.time()
+        if force or now - self.last_flush >= self.min_interval:
+            self.job.save_meta()
+            self.last_flush = now
+            self.dirty = False
+            self.num_flushes += 1
+
+    def close(self):
+        self.flush(force=True)
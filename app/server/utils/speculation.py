@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Speculative som jobs for the next image grid, enqueued while the user reviews the current one
+###
+
+import hashlib
+from datetime import datetime
+
+import numpy as np
+from rq.job import Job
+
+METRICS_KEY = 'som:spec:metrics'
+
+
+class Speculation(object):
+    """Next grid som jobs keyed by (c_label, hash of the unprocessed img_idx) in Redis
+
+    Every grid image is processed on refresh whether or not it's selected, so both likely
+    outcomes ("none selected" and "some selected") leave the same unprocessed set and one
+    speculative job covers them. Keys expire after ttl seconds, a claimed key is deleted.
+    Jobs run with speculative=True so they save nothing, the claimer commits their result.
+    """
+    def __init__(self, redis, queue, ttl=600):
+        self.redis = redis
+        self.queue = queue
+        self.ttl = ttl
+
+    def __repr__(self):
+        return '<Speculation {}>'.format(self.stats())
+
+    def key(self, c_label, img_idx, cell=None):
+        digest = hashlib.sha1(np.sort(np.asarray(img_idx, dtype=np.int64)).tobytes()).hexdigest()
+        if cell != None:    # Drilled into a cell of the grid
+            return 'som:spec:{}:cell{}:{}'.format(c_label, cell, digest)
+        return 'som:spec:{}:{}'.format(c_label, digest)
+
+    def enqueue(self, func, img_idx, c_label, *args, cell=None, **kwargs):
+        key = self.key(c_label, img_idx, cell)
+        if self.redis.exists(key):  # Already speculated on this processed set
+            return None
+        job = self.queue.enqueue(func, args=(list(img_idx), c_label) + args, kwargs={'speculative': True}, **kwargs)
+        self.redis.set(key, job.id, ex=self.ttl)
+        return job
+
+    def claim(self, c_label, img_idx, cell=None):
+        #  Returns: (job, saved) if a live job was speculated on img_idx else (None, 0), saved being
+        #           the seconds the job had run by the time the grid was asked for, 0 if it hadn't started
+        key = self.key(c_label, img_idx, cell)
+        job_id = self.redis.get(key)
+        self.redis.delete(key)
+        job = None
+        if job_id != None:
+            try:
+                job = Job.fetch(job_id.decode(), connection=self.redis)
+            except Exception:   # Expired or cleaned up by rq
+                job = None
+        if job == None or job.get_status() in ('failed', 'canceled', 'stopped'):
+            self.redis.hincrby(METRICS_KEY, 'MISSES', 1)
+            return None, 0
+
+        saved = 0
+        start = job.started_at     # Time spent queued isn't saved, the request would have waited on the queue anyway
+        if start != None:
+            end = job.ended_at
+            if end == None:     # Still running, saved the time it has had so far
+                end = datetime.now(start.tzinfo) if start.tzinfo != None else datetime.utcnow()   # Older rq stores naive utc
+            saved = max((end - start).total_seconds(), 0)
+        self.redis.hincrby(METRICS_KEY, 'HITS', 1)
+        self.redis.hincrbyfloat(METRICS_KEY, 'SAVED_S', saved)
+        return job, saved
+
+    def cancel(self, c_label):
+        # Drop the speculations of c_label when its SOM is reset
+        for key in self.redis.scan_iter('som:spec:{}:*'.format(c_label)):
+            job_id = self.redis.get(key)
+            self.redis.delete(key)
+            if job_id == None:
+                continue
+            try:
+                job = Job.fetch(job_id.decode(), connection=self.redis)
+            except Exception:
+                continue
+            if job.get_status() == 'queued':
+                job.cancel()
+
+    def stats(self):
+        metrics = {k.decode(): float(v) for k, v in self.redis.hgetall(METRICS_KEY).items()}
+        hits = int(metrics.get('HITS', 0))
+        misses = int(metrics.get('MISSES', 0))
+        return {
+            'SPEC_HITS': hits,
+            'SPEC_MISSES': misses,
+            'SPEC_HIT_RATE': round(hits / (hits + misses), 3) if hits + misses > 0 else 0,
+            'SPEC_SAVED_S': round(metrics.get('SAVED_S', 0), 3),
+        }
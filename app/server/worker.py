@@ -8,7 +8,7 @@
 import os
 
 import redis
-from rq import Worker, Queue, Connection
+from rq import SimpleWorker, Queue, Connection
 
 listen = ['default']
 
@@ -18,5 +18,7 @@ conn = redis.from_url(redis_url)
 
 if __name__ == '__main__':
     with Connection(conn):
-        worker = Worker(list(map(Queue, listen)))
+        # Jobs run in this process instead of a forked work horse so the
+        # artifact cache in server.main.tasks stays warm between jobs
+        worker = SimpleWorker(list(map(Queue, listen)))
         worker.work()
\ No newline at end of file
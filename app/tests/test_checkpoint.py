@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Training checkpoints carry a run over time budgeted jobs through to a saved model
+#   $ cd app && python -m pytest tests
+###
+
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+ae_module = pytest.importorskip('server.model.ae')
+
+from torch.utils.data import TensorDataset
+
+from server.model.utils.checkpoint import checkpoint_path, unfinished_run, finished_runs
+from server.model.utils.early_stopping import EarlyStopping
+from server.model.utils.tb_log import LogPolicy, NullWriter
+from server.model.utils.weights import model_path
+
+SEED = 489
+
+
+class Bucket(object):
+    LABEL = 'test'
+
+    def __init__(self, num_imgs=64):
+        gen = torch.Generator().manual_seed(SEED)
+        self.train = TensorDataset(torch.rand(num_imgs, 1, 28, 28, generator=gen), torch.zeros(num_imgs))
+        self.test = TensorDataset(torch.rand(num_imgs // 4, 1, 28, 28, generator=gen), torch.zeros(num_imgs // 4))
+
+    def save_dataset(self, output_dir):
+        pass
+
+
+def fit(output_dir, max_epochs, **kwargs):
+    ae = ae_module.AutoEncoder(tb=NullWriter())
+    ae.fit(Bucket(), batch_size=32, max_epochs=max_epochs, lr=0.001, eval=False, output_dir=output_dir,
+            log_policy=LogPolicy(scalars=0, histograms=0, images=0, embeddings=0, embed_sample=0), **kwargs)
+    return ae
+
+
+def test_budget_carries_on_to_the_last_epoch(tmp_path):
+    output_dir = str(tmp_path / 'ae_test_1')
+    ae = fit(output_dir, 2, checkpoint_every=1, time_budget=0, save_model=True)
+    assert not ae.FINISHED and os.path.exists(checkpoint_path(output_dir))
+    assert unfinished_run(str(tmp_path), 'ae', 'test') == output_dir
+
+    ae = fit(output_dir, 2, checkpoint_every=1, time_budget=0, save_model=True)    # Not stopped after epoch 2
+    assert ae.FINISHED and ae.EPOCH == 2
+    assert model_path(output_dir).endswith('.weights') and not os.path.exists(checkpoint_path(output_dir))
+    assert unfinished_run(str(tmp_path), 'ae', 'test') == None
+    assert finished_runs(str(tmp_path), 'ae') == [output_dir]
+
+def test_resume_from_last_epoch_checkpoint(tmp_path):
+    # A job that checkpointed its last epoch and was killed before save_model()
+    output_dir = str(tmp_path / 'ae_test_1')
+    ae = fit(output_dir, 1)
+    ae.save_checkpoint(EarlyStopping())
+
+    resumed = fit(output_dir, 1, checkpoint_every=1, save_model=True)     # No epochs left to train
+    assert resumed.FINISHED and resumed.EPOCH == 1
+    assert resumed.loss == pytest.approx(float(ae.loss))
+    assert model_path(output_dir).endswith('.weights')
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# EvalSchedule picks the evaluated epochs and a fixed test sample
+#   $ cd app && python -m pytest tests
+###
+
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.utils.data import TensorDataset, Subset
+
+from server.model.utils.eval_schedule import EvalSchedule
+
+
+def dataset(num_test=100):
+    test = TensorDataset(torch.arange(num_test, dtype=torch.float32).view(-1, 1), torch.arange(num_test))
+    return SimpleNamespace(train=TensorDataset(torch.zeros(10, 1), torch.zeros(10)), test=test)
+
+
+def test_every_k_epochs_and_the_last():
+    schedule = EvalSchedule(every=3)
+    assert [e for e in range(1, 11) if schedule.due(e, 10)] == [3, 6, 9, 10]
+
+def test_plot_epochs_evaluated():
+    schedule = EvalSchedule(every=4)
+    assert [e for e in range(1, 11) if schedule.due(e, 10, intervals=(5, None))] == [4, 5, 8, 10]
+
+def test_every_must_be_positive():
+    with pytest.raises(ValueError):
+        EvalSchedule(every=0)
+
+def test_same_sample_every_evaluation():
+    schedule = EvalSchedule(sample=20)
+    data = dataset()
+    first, second = schedule.eval_dataset(data), schedule.eval_dataset(data)
+    assert isinstance(first.test, TensorDataset) and len(first.test) == 20
+    assert torch.equal(first.test.tensors[1], second.test.tensors[1])
+    assert first.train is data.train
+
+def test_whole_test_set_without_sample():
+    data = dataset()
+    assert EvalSchedule(sample=None).eval_dataset(data) is data
+    assert EvalSchedule(sample=1000).eval_dataset(data) is data
+
+def test_non_tensor_test_set_subset():
+    data = dataset()
+    data.test = [data.test[i] for i in range(len(data.test))]
+    sampled = EvalSchedule(sample=20).eval_dataset(data)
+    assert isinstance(sampled.test, Subset) and len(sampled.test) == 20
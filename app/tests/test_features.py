@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Features saved with a model are only reused while its weights are the ones they were encoded with
+#   $ cd app && python -m pytest tests
+###
+
+import os
+import json
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from server.model.utils.weights import weights_name, save_weights, weights_hash, load_features, mark_features, FEAT
+
+SEED = 489
+
+
+def save_run(output_dir):
+    os.makedirs(output_dir)
+    path = os.path.join(output_dir, weights_name(output_dir))
+    save_weights({'w': torch.ones(3, 2)}, path)
+    feat = np.random.RandomState(SEED).rand(5, 10).astype(np.float32)
+    np.save(os.path.join(output_dir, FEAT), feat)
+    with open(os.path.join(output_dir, 'config.json'), 'w') as f:
+        json.dump({'model_name': weights_name(output_dir), 'feat': FEAT, 'weights_hash': weights_hash(path)}, f)
+    return path, feat
+
+
+def test_fresh_features_loaded(tmp_path):
+    output_dir = str(tmp_path / 'ae_x')
+    _, feat = save_run(output_dir)
+    loaded, config = load_features(output_dir)
+    assert np.array_equal(loaded, feat) and config['feat'] == FEAT
+
+def test_retrained_weights_invalidate_features(tmp_path):
+    output_dir = str(tmp_path / 'ae_x')
+    path, _ = save_run(output_dir)
+    save_weights({'w': torch.zeros(3, 2)}, path)
+    loaded, config = load_features(output_dir)
+    assert loaded is None and config != None
+
+def test_mark_features_after_reencoding(tmp_path):
+    output_dir = str(tmp_path / 'ae_x')
+    path, feat = save_run(output_dir)
+    save_weights({'w': torch.zeros(3, 2)}, path)
+    mark_features(output_dir, FEAT)
+    loaded, _ = load_features(output_dir)
+    assert np.array_equal(loaded, feat)
+
+def test_missing_features(tmp_path):
+    output_dir = str(tmp_path / 'ae_x')
+    save_run(output_dir)
+    os.remove(os.path.join(output_dir, FEAT))
+    assert load_features(output_dir)[0] is None
+    assert load_features(str(tmp_path)) == (None, None)     # No config.json
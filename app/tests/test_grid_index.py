@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# GridIndex compacts its searched tree as a cluster's images get processed
+#   $ cd app && python -m pytest tests
+###
+
+import pickle
+
+import numpy as np
+
+from server.model.utils.grid_index import GridIndex, LIVE_MIN
+
+SEED = 489
+NUM_NEURONS = 250
+
+
+def index(num_imgs=5000, m=2):
+    rs = np.random.RandomState(SEED)
+    img_idx = np.sort(rs.choice(num_imgs * 3, num_imgs, replace=False))    # Cluster members among all images
+    return GridIndex(rs.rand(num_imgs, m), img_idx), rs.rand(NUM_NEURONS, m)
+
+def available(index, share):
+    return np.sort(np.random.RandomState(SEED).choice(index.img_idx, int(share * len(index)), replace=False))
+
+def check_grid(grid, avail):
+    assert len(grid) == NUM_NEURONS
+    assert np.all(np.isin(grid, avail))
+    assert len(np.unique(grid)) == NUM_NEURONS
+
+
+def test_full_tree_searched_while_mostly_available():
+    gi, net_w = index()
+    avail = available(gi, LIVE_MIN + 0.1)
+    check_grid(gi.query(net_w, available=avail), avail)
+    assert gi.tree is gi.full_tree and len(gi.rows) == len(gi)
+
+def test_compacts_when_processed():
+    gi, net_w = index()
+    avail = available(gi, LIVE_MIN / 2)
+    grid = gi.query(net_w, available=avail)
+    check_grid(grid, avail)
+    assert np.array_equal(gi.img_idx[gi.rows], avail)
+    # Same grid as an index built over just the available images
+    assert np.array_equal(grid, GridIndex(np.asarray(gi.full_tree.data)[gi.rows], avail).query(net_w))
+
+def test_regrows_for_images_outside_the_searched_tree():
+    gi, net_w = index()
+    gi.query(net_w, available=available(gi, 0.1))
+    avail = available(gi, 0.3)     # Not a subset of the compacted rows
+    check_grid(gi.query(net_w, available=avail), avail)
+    assert np.array_equal(gi.img_idx[gi.rows], avail)
+
+def test_query_many_shares_one_tree():
+    gi, net_w = index()
+    avails = [available(gi, 0.2), available(gi, 0.25)]
+    grids = gi.query_many(net_w, avails)
+    for grid, avail in zip(grids, avails):
+        check_grid(grid, avail)
+    assert np.array_equal(gi.img_idx[gi.rows], np.union1d(*avails))
+
+def test_pickle_drops_compacted_tree():
+    gi, net_w = index()
+    gi.query(net_w, available=available(gi, 0.1))
+    loaded = pickle.loads(pickle.dumps(gi))
+    assert loaded.tree is loaded.full_tree and len(loaded.rows) == len(gi)
+    avail = available(gi, 0.1)
+    assert np.array_equal(loaded.query(net_w, available=avail), gi.query(net_w, available=avail))
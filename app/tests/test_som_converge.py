@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# SOM convergence monitoring follows each cluster's own iteration schedule
+#   $ cd app && python -m pytest tests
+###
+
+import numpy as np
+
+from server.model.som import SOM
+
+SEED = 0
+DIMS = [10, 25]
+CONVERGE = (0.4, 0.05, 2.0, 2)
+
+
+def blobs(num_imgs):
+    rs = np.random.RandomState(SEED)
+    return rs.normal(size=(num_imgs, 2)) * 0.3 + rs.randint(0, 4, size=(num_imgs, 1)) * 3
+
+def train(data, n_iter, converge):
+    np.random.seed(SEED)
+    som = SOM(data=data, dims=DIMS, n_iter=n_iter, lr_init=0.1, init='pca', converge=converge)
+    som.update_interval = n_iter + 1    # quiet
+    som.train()
+    return som
+
+
+def test_order_iter_scales_with_schedule():
+    for n_iter in (500, 1000, 3000):
+        som = SOM(data=blobs(100), dims=DIMS, n_iter=n_iter, lr_init=0.1, converge=CONVERGE)
+        assert som.ORDER_ITER == int(CONVERGE[0] * n_iter) < n_iter
+        assert som.CHECK_EVERY == int(CONVERGE[1] * n_iter)
+
+def test_small_cluster_stops_early():
+    som = train(blobs(150), 500, CONVERGE)     # The smallest SOM_SCHEDULE entry
+    assert som.STOP_REASON == 'converged'
+    assert som.ORDER_ITER <= som.NUM_ITER_USED < som.N_ITER
+
+def test_no_converge_runs_every_iter():
+    som = train(blobs(150), 500, None)
+    assert som.STOP_REASON == 'max_iter' and som.NUM_ITER_USED == som.N_ITER
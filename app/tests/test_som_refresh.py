@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# SOM.refresh work scales with the number of removed images
+#   $ cd app && python -m pytest tests
+###
+
+import numpy as np
+
+from server.model.som import SOM
+
+SEED = 489
+DIMS = [10, 25]
+
+
+def trained_map(num_imgs=20000, m=10):
+    data = np.random.RandomState(SEED).rand(num_imgs, m)
+    som = SOM(data=data, dims=DIMS, n_iter=1000, lr_init=0.1)
+    som.update_interval = som.N_ITER + 1     # quiet
+    som.train()
+    bmu, dist = som.bmu_all(data)
+    return data, np.arange(num_imgs), bmu, dist
+
+def refresh(data, prev_idx, prev_bmu, prev_dist, num_removed):
+    keep = np.sort(np.random.RandomState(SEED).permutation(len(prev_idx))[num_removed:])
+    img_idx = prev_idx[keep]
+    som = SOM(data=data[img_idx], dims=DIMS, n_iter=100, lr_init=0.01)
+    som.net = np.random.RandomState(SEED).rand(DIMS[0], DIMS[1], data.shape[1])
+    bmu, dist, changed = som.refresh(img_idx, prev_idx, prev_bmu, prev_dist)
+    return som, bmu, changed
+
+
+def test_work_scales_with_removed():
+    data, prev_idx, prev_bmu, prev_dist = trained_map()
+    work = []
+    for num_removed in (1, 5, 25):
+        som, _, changed = refresh(data, prev_idx, prev_bmu, prev_dist, num_removed)
+        assert len(changed) <= num_removed
+        num_remapped = np.isin(prev_bmu, changed).sum()
+        work.append((som.NUM_ITER_USED, len(changed), num_remapped))
+    for fewer, more in zip(work, work[1:]):     # (iterations, retrained neurons, remapped samples)
+        assert all(a < b for a, b in zip(fewer, more))
+
+def test_neurons_capped():
+    data, prev_idx, prev_bmu, prev_dist = trained_map()
+    _, _, changed = refresh(data, prev_idx, prev_bmu, prev_dist, DIMS[0]*DIMS[1])   # about one per neuron, a grid
+    assert len(changed) <= DIMS[0]*DIMS[1] // 4
+
+def test_nothing_removed():
+    data, prev_idx, prev_bmu, prev_dist = trained_map(2000)
+    som, bmu, changed = refresh(data, prev_idx, prev_bmu, prev_dist, 0)
+    assert len(changed) == 0 and som.NUM_ITER_USED == 0
+    assert np.array_equal(bmu, prev_bmu)
+
+def test_no_previous_map():
+    data = np.random.RandomState(SEED).rand(500, 10)
+    som = SOM(data=data, dims=DIMS, n_iter=100, lr_init=0.01)
+    bmu, dist, changed = som.refresh(np.arange(500), np.empty(0, dtype=np.int64), 
+                                        np.empty(0, dtype=np.int64), np.empty(0))
+    assert len(bmu) == 500 and len(changed) == 0
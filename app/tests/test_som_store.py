@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# SOMStore.remove takes a cluster's drilled child SOMs and their indexes with it, nothing else
+#   $ cd app && python -m pytest tests
+###
+
+import os
+
+import numpy as np
+
+from server.model.utils.som_store import SOMStore
+from server.model.utils.som_drill import cell_key
+from server.model.utils.grid_index import GridIndex, index_path
+
+DIMS = [2, 3]
+
+
+def save_som(store, c_label):
+    store.save(c_label, np.zeros(DIMS + [2]), img_idx=np.arange(6), bmu=np.arange(6))
+    store.save_counters(c_label, NUM_IMGS=6, NUM_FILTERED=0, NUM_REFRESH=0)
+
+def save_index(output_dir, key):
+    GridIndex(np.random.RandomState(0).rand(6, 2), np.arange(6)).save(index_path(output_dir, key))
+
+def populate(output_dir):
+    store = SOMStore(output_dir)
+    for c_label in (1, 10, 2):
+        save_som(store, c_label)
+        save_index(output_dir, c_label)
+        child = cell_key(c_label, 3)
+        save_som(store, child)
+        store.save_array(child, 'members', np.arange(6))
+        save_index(output_dir, child)
+    return store
+
+
+def test_remove_takes_drilled_children(tmp_path):
+    output_dir = str(tmp_path)
+    store = populate(output_dir)
+    store.remove(1)
+    assert not store.exists(1) and store.load_counters(1) == {} and store.load_array(1, 'bmu') is None
+    child = cell_key(1, 3)
+    assert not store.exists(child) and store.load_array(child, 'members') is None
+    assert not os.path.exists(index_path(output_dir, child))
+    assert os.path.exists(index_path(output_dir, 1))    # The cluster's own index comes from clustering
+
+def test_remove_keeps_other_clusters(tmp_path):
+    output_dir = str(tmp_path)
+    store = populate(output_dir)
+    store.remove(1)
+    for c_label in (10, 2):    # 10 shares the prefix of 1
+        child = cell_key(c_label, 3)
+        assert store.exists(c_label) and store.exists(child)
+        assert store.load_counters(c_label)['NUM_IMGS'] == 6
+        assert store.load_array(child, 'members') is not None
+        assert os.path.exists(index_path(output_dir, child))
+
+def test_removed_som_not_served_from_cache(tmp_path):
+    store = SOMStore(str(tmp_path))
+    save_som(store, 1)
+    assert store.load_array(1, 'bmu') is not None    # Cached
+    store.remove(1)
+    assert store.load_array(1, 'bmu') is None
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+###
+# Lean .weights files round-trip the state_dict and count as a model only once config.json indexes them
+#   $ cd app && python -m pytest tests
+###
+
+import os
+import json
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from server.model.utils.weights import (weights_name, model_path, save_weights, load_weights, compatible,
+                                        weights_hash)
+
+SEED = 489
+
+
+def state_dict():
+    torch.manual_seed(SEED)
+    model = torch.nn.Sequential(torch.nn.Linear(6, 4), torch.nn.ReLU(), torch.nn.Linear(4, 2))
+    return {'encoder.' + key: value for key, value in model.state_dict().items()}
+
+def save_run(output_dir, config=True):
+    os.makedirs(output_dir)
+    state = state_dict()
+    path = os.path.join(output_dir, weights_name(output_dir))
+    index = save_weights(state, path)
+    if config:
+        with open(os.path.join(output_dir, 'config.json'), 'w') as f:
+            json.dump({'model_name': weights_name(output_dir), 'weights_index': index}, f)
+    return state, path, index
+
+
+def test_round_trip(tmp_path):
+    state, path, index = save_run(str(tmp_path / 'ae_x'))
+    loaded = load_weights(path, index)
+    assert list(loaded) == list(state)
+    for key, tensor in state.items():
+        assert loaded[key].dtype == torch.float32 and torch.equal(loaded[key], tensor)
+
+def test_prefix_reads_only_matching_keys(tmp_path):
+    state, path, index = save_run(str(tmp_path / 'ae_x'))
+    loaded = load_weights(path, index, prefix='encoder.0')
+    assert set(loaded) == {'encoder.0.weight', 'encoder.0.bias'}
+
+def test_loaded_weights_are_copy_on_write(tmp_path):
+    state, path, index = save_run(str(tmp_path / 'ae_x'))
+    before = weights_hash(path)
+    loaded = load_weights(path, index)
+    loaded['encoder.0.weight'].add_(1)
+    assert weights_hash(path) == before
+
+def test_compatible(tmp_path):
+    output_dir = str(tmp_path / 'ae_x')
+    state, _, _ = save_run(output_dir)
+    assert compatible(output_dir, state)
+    other = dict(state)
+    other['encoder.2.weight'] = torch.zeros(3, 4)
+    assert not compatible(output_dir, other)
+
+def test_model_path_needs_config(tmp_path):
+    output_dir = str(tmp_path / 'ae_x')
+    save_run(output_dir, config=False)     # Save cut short before config.json
+    assert model_path(output_dir) == None
+    legacy = os.path.join(output_dir, weights_name(output_dir, 'pth'))
+    open(legacy, 'wb').close()
+    assert model_path(output_dir) == legacy
+    with open(os.path.join(output_dir, 'config.json'), 'w') as f:
+        json.dump({'weights_index': {}}, f)
+    assert model_path(output_dir).endswith('.weights')